@@ -0,0 +1,367 @@
+"""Runtime and memory benchmarks for the package's hot paths
+
+All inputs are synthetic and generated in a temporary cache directory
+(XDG_CACHE_HOME is redirected before lgmproxies is imported), and the Gaskell &
+Hull web converter is replaced by a local stub HTTP server, so the suite runs
+offline. Each benchmark reports the best wall time over `--repeat` runs and the
+peak memory traced by tracemalloc (numpy allocations included).
+
+    python benchmarks/hot_paths.py                      # run and compare against baseline.json
+    python benchmarks/hot_paths.py --save               # overwrite the baseline
+    python benchmarks/hot_paths.py delo_to_sst --scale 0.1
+
+The check fails (exit code 1) if a benchmark is slower or uses more memory than
+the baseline by more than `--tolerance`.
+"""
+import os
+import sys
+import json
+import time
+import tempfile
+import argparse
+import threading
+import tracemalloc
+from pathlib import Path
+
+BASELINE = Path(__file__).parent / "baseline.json"
+
+BENCHMARKS = {}
+
+
+def benchmark(func):
+    """Register `func(scale)`, which prepares the inputs and returns the callable to time
+    """
+    BENCHMARKS[func.__name__] = func
+    return func
+
+
+def _posterior(shape, **variables):
+    import numpy as np
+    import arviz as az
+    rng = np.random.default_rng(0)
+    return az.from_dict(posterior={name: loc + scale * rng.standard_normal(shape + extra)
+                                   for name, (loc, scale, extra) in variables.items()})
+
+
+@benchmark
+def delo_to_sst(scale):
+    import numpy as np
+    from lgmproxies.datasets.tierney import DeltaO18
+    n = int(5000 * scale)
+    model = DeltaO18(None, _posterior((4, 1000), a=(3.3, 0.05, ()), b=(-0.22, 0.005, ()), tau=(0.5, 0.01, ())))
+    rng = np.random.default_rng(1)
+    d18o, d18osw = rng.normal(0, 1, n), rng.normal(0.5, 0.3, n)
+    return lambda: model.to_sst(d18o, d18osw)
+
+
+@benchmark
+def delo_hierarchical_to_sst(scale):
+    import numpy as np
+    from lgmproxies.datasets.tierney import DeltaO18Hierarchical, CATEGORIES
+    n = int(5000 * scale)
+    k = len(CATEGORIES)
+    model = DeltaO18Hierarchical(None, _posterior((4, 1000), a=(3.3, 0.05, (k,)), b=(-0.22, 0.005, (k,)), tau=(0.5, 0.01, (k,))))
+    rng = np.random.default_rng(1)
+    d18o, d18osw = rng.normal(0, 1, n), rng.normal(0.5, 0.3, n)
+    species = rng.choice(CATEGORIES, n)
+    return lambda: model.to_sst(d18o, species, d18osw)
+
+
+@benchmark
+def delo_predictive_score(scale):
+    import numpy as np
+    import pandas as pd
+    from lgmproxies.datasets.tierney import DeltaO18Hierarchical, CATEGORIES, posterior_predictive_score
+    n = int(1500 * scale)
+    k = len(CATEGORIES)
+    model = DeltaO18Hierarchical(None, _posterior((4, 2500), a=(3.3, 0.05, (k,)), b=(-0.22, 0.005, (k,)), tau=(0.5, 0.01, (k,))))
+    rng = np.random.default_rng(1)
+    temp, d18osw = rng.uniform(0, 30, n), rng.normal(0.5, 0.3, n)
+    coretops = pd.DataFrame({"temp": temp, "d18osw": d18osw, "d18oc": 3.3 - 0.22 * temp + d18osw - 0.27 + rng.normal(0, 0.5, n),
+                             "foramtype": rng.integers(0, k, n)})
+    return lambda: posterior_predictive_score(model, coretops)
+
+
+def _coretops_fixture(scale):
+    import numpy as np
+    import pandas as pd
+    from lgmproxies.datasets.manager import get_repo_path
+    folder = get_repo_path("brews/d18oc_sst") / "data/parsed"
+    if not (folder / "coretops_grid.csv").exists():
+        folder.mkdir(parents=True, exist_ok=True)
+        rng = np.random.default_rng(2)
+        n = int(20000 * scale)
+        pd.DataFrame({"latitude": rng.uniform(-70, 70, 2000), "longitude": rng.uniform(-180, 180, 2000),
+                      "d18oc": rng.normal(0, 1, 2000)}).to_csv(folder / "coretops.csv", index=False)
+        pd.DataFrame({"gridlat": rng.uniform(-90, 90, n), "gridlon": rng.uniform(-180, 180, n),
+                      "d18osw": rng.normal(0.3, 0.5, n)}).to_csv(folder / "coretops_grid.csv", index=False)
+
+
+@benchmark
+def delosw_malevitch_init(scale):
+    from lgmproxies.datasets.tierney import DeloSWMalevitch
+    _coretops_fixture(scale)
+    return DeloSWMalevitch
+
+
+@benchmark
+def delosw_malevitch_interpolate(scale):
+    import numpy as np
+    from lgmproxies.datasets.tierney import DeloSWMalevitch
+    _coretops_fixture(scale)
+    delosw = DeloSWMalevitch()
+    rng = np.random.default_rng(3)
+    n = int(100000 * scale)
+    lon, lat = rng.uniform(-180, 180, n), rng.uniform(-90, 90, n)
+    return lambda: delosw.interpolate(lon, lat)
+
+
+def _shapes(scale, polygons=False):
+    import numpy as np
+    import shapely.geometry as shg
+    rng = np.random.default_rng(4)
+    geoms = []
+    for _ in range(int(1000 * scale)):
+        x0, y0 = rng.uniform(-180, 180), rng.uniform(-80, 80)
+        angle = np.linspace(0, 2 * np.pi, 50)
+        r = rng.uniform(0.5, 5) * (1 + 0.2 * rng.random(50))
+        coords = np.column_stack([x0 + r * np.cos(angle), y0 + r * np.sin(angle)])
+        geoms.append(shg.Polygon(coords) if polygons else shg.LineString(coords))
+    return shg.GeometryCollection(geoms)
+
+
+@benchmark
+def add_coast(scale):
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    from lgmproxies.datasets import naturalearth
+    naturalearth.coastline_data["synthetic"] = _shapes(scale)
+
+    def run():
+        fig, ax = plt.subplots()
+        naturalearth.add_coast(ax, res="synthetic", lon0=-30)
+        fig.canvas.draw()
+        plt.close(fig)
+    return run
+
+
+@benchmark
+def add_land(scale):
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    from lgmproxies.datasets import naturalearth
+    naturalearth.land_data["synthetic"] = _shapes(scale, polygons=True)
+
+    def run():
+        fig, ax = plt.subplots()
+        naturalearth.add_land(ax, res="synthetic", bbox=(-90, 90, -60, 60))
+        fig.canvas.draw()
+        plt.close(fig)
+    return run
+
+
+def _d18o_table(n):
+    import numpy as np
+    import pandas as pd
+    rng = np.random.default_rng(5)
+    return pd.DataFrame({"d18O": rng.normal(0, 1, n), "age": rng.uniform(0, 0.03, n),
+                         "lat": rng.uniform(-60, 60, n), "long": rng.uniform(-180, 180, n)})
+
+
+@benchmark
+def hash_dataframe(scale):
+    from lgmproxies.gaskell_hull2023 import hash_dataframe
+    df = _d18o_table(int(1_000_000 * scale))
+    return lambda: hash_dataframe(df)
+
+
+def _stub_converter(delay=0.0):
+    """Serve a fixed HTML table on a local port, in the format returned by the Yale converter
+
+    Each response is sent after `delay` seconds; `server.n_requests` counts the requests.
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from lgmproxies import gaskell_hull2023
+
+    rows = "".join(f"<tr><td>{i}</td><td>{0.1 * i:.2f}</td><td>{20 + 0.01 * i:.2f}</td></tr>" for i in range(1000))
+    page = f"<html><body><table><tr><th>id</th><th>d18O</th><th>temperature</th></tr>{rows}</table></body></html>".encode()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            with lock:
+                server.n_requests += 1
+            time.sleep(delay)
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html")
+            self.send_header("Content-Length", str(len(page)))
+            self.end_headers()
+            self.wfile.write(page)
+
+        def log_message(self, *args):
+            pass
+
+    lock = threading.Lock()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.n_requests = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    gaskell_hull2023.CONVERTER_URL = f"http://127.0.0.1:{server.server_port}/d180/proxy.php"
+    return server
+
+
+@benchmark
+def convert_d18o_df_uncached(scale):
+    from lgmproxies import gaskell_hull2023
+    import shutil
+    _stub_converter()
+    df = _d18o_table(int(1000 * scale))
+
+    def run():
+        # clear the cache, so that the stub server is always hit
+        shutil.rmtree(gaskell_hull2023.cachedir, ignore_errors=True)
+        return gaskell_hull2023.convert_d18o_df(df)
+    return run
+
+
+@benchmark
+def convert_d18o_df_cached(scale):
+    from lgmproxies import gaskell_hull2023
+    _stub_converter()
+    df = _d18o_table(int(1000 * scale))
+    gaskell_hull2023.convert_d18o_df(df)
+    return lambda: gaskell_hull2023.convert_d18o_df(df)
+
+
+@benchmark
+def tex86_monte_carlo(scale):
+    import numpy as np
+    from lgmproxies.datasets.chatgpt import tex86_to_sst_monte_carlo
+    rng = np.random.default_rng(6)
+    n = int(2000 * scale)
+    tex86, lat = rng.uniform(0.3, 0.8, n), rng.uniform(-60, 60, n)
+    return lambda: tex86_to_sst_monte_carlo(tex86, lat, n_samples=1000, seed=1)
+
+
+@benchmark
+def tex86_monte_carlo_summary(scale):
+    import numpy as np
+    from lgmproxies.datasets.chatgpt import tex86_to_sst_monte_carlo
+    rng = np.random.default_rng(6)
+    n = int(2000 * scale)
+    tex86, lat = rng.uniform(0.3, 0.8, n), rng.uniform(-60, 60, n)
+    return lambda: tex86_to_sst_monte_carlo(tex86, lat, n_samples=1000, seed=1, summary=True)
+
+
+def _archive_fixture(scale, ext):
+    import numpy as np
+    import shutil
+    # inside the benchmark cache directory, removed at exit
+    tmp = Path(tempfile.mkdtemp(prefix="archive_", dir=os.environ.get("XDG_CACHE_HOME")))
+    content = tmp / "content"
+    content.mkdir()
+    rng = np.random.default_rng(7)
+    for i in range(20):
+        # partly compressible, like text tables
+        np.savetxt(content / f"table_{i}.csv", rng.normal(size=(int(20000 * scale), 5)), fmt="%.3f", delimiter=",")
+    fmt = {".zip": "zip", ".tar.gz": "gztar"}[ext]
+    archive = shutil.make_archive(str(tmp / "archive"), fmt, content)
+    return tmp, archive
+
+
+def _extract(scale, ext):
+    import shutil
+    from lgmproxies.datasets.datamanager import extract_archive
+    tmp, archive = _archive_fixture(scale, ext)
+
+    def run():
+        target = tmp / "extracted"
+        shutil.rmtree(target, ignore_errors=True)
+        extract_archive(archive, target)
+    return run
+
+
+@benchmark
+def extract_zip(scale):
+    return _extract(scale, ".zip")
+
+
+@benchmark
+def extract_tar_gz(scale):
+    return _extract(scale, ".tar.gz")
+
+
+def measure(func, repeat: int) -> dict:
+    """Best wall time (s) over `repeat` runs, and the peak traced memory (MB) of one run
+
+    An untimed first call loads the lazy imports and warms the caches.
+    """
+    func()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {"time": min(times), "peak_mb": peak / 2**20}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3, help="number of timed runs per benchmark (the minimum is kept)")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiply the problem sizes")
+    parser.add_argument("--tolerance", type=float, default=1.5, help="allowed ratio to the baseline, for time and memory")
+    parser.add_argument("--baseline", type=Path, default=BASELINE)
+    parser.add_argument("--save", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--json", action="store_true", help="print the results as json")
+    parser.add_argument("benchmarks", nargs="*", default=list(BENCHMARKS))
+    o = parser.parse_args()
+
+    import shutil
+    os.environ["XDG_CACHE_HOME"] = tempfile.mkdtemp(prefix="lgmproxies_bench_")
+    try:
+        run_benchmarks(o)
+    finally:
+        shutil.rmtree(os.environ["XDG_CACHE_HOME"], ignore_errors=True)
+
+
+def run_benchmarks(o):
+    baseline = json.loads(o.baseline.read_text()) if o.baseline.exists() else {}
+    if baseline.get("scale", o.scale) != o.scale:
+        print(f"Baseline was recorded with --scale {baseline['scale']}, ignoring it")
+        baseline = {}
+    reference = baseline.get("results", {})
+
+    results = {}
+    failed = False
+    for name in o.benchmarks:
+        res = results[name] = measure(BENCHMARKS[name](o.scale), o.repeat)
+        ref = reference.get(name)
+        status = "new "
+        if ref:
+            ok = res["time"] <= ref["time"] * o.tolerance and res["peak_mb"] <= max(ref["peak_mb"] * o.tolerance, 1)
+            failed |= not ok
+            status = "ok  " if ok else "FAIL"
+        print(f"{status} {name:32s} {res['time'] * 1000:10.1f} ms {res['peak_mb']:9.1f} MB"
+              + (f"   (baseline {ref['time'] * 1000:.1f} ms {ref['peak_mb']:.1f} MB)" if ref else ""))
+
+    if o.json:
+        print(json.dumps(results, indent=2))
+
+    if o.save:
+        saved = {**reference, **results} if baseline else results
+        o.baseline.write_text(json.dumps({"scale": o.scale, "python": sys.version.split()[0], "results": saved}, indent=2) + "\n")
+        print(f"Baseline written to {o.baseline}")
+        return
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
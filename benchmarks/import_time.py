@@ -0,0 +1,83 @@
+"""Import-time benchmark for lgmproxies
+
+Each module is imported in a fresh interpreter with `python -X importtime`.
+The check fails (exit code 1) if the cumulative import time exceeds the
+budget, or if a heavy dependency got imported eagerly.
+
+    python benchmarks/import_time.py [--repeat 5] [--scale 1.0]
+"""
+import sys
+import subprocess as sp
+import argparse
+
+HEAVY = ["pymc", "arviz", "pytensor", "cloudpickle", "scipy", "pandas", "requests", "bs4", "tqdm", "matplotlib", "fiona", "shapely"]
+
+# module: (budget in ms, modules that must not be imported)
+BUDGETS = {
+    "lgmproxies.logs": (50, HEAVY + ["argparse"]),
+    "lgmproxies.profiling": (50, HEAVY + ["argparse"]),
+    "lgmproxies.fileutils": (50, HEAVY + ["numpy"]),
+    "lgmproxies.datasets.repos": (50, HEAVY),
+    "lgmproxies.datasets.mirror": (50, HEAVY),
+    "lgmproxies.datasets.datamanager": (100, HEAVY),
+    "lgmproxies.datasets.manager": (100, HEAVY),
+    "lgmproxies.datasets.catalogue": (100, HEAVY),
+    "lgmproxies.datasets.naturalearth": (100, HEAVY),
+    "lgmproxies.gaskell_hull2023": (100, HEAVY),
+    "lgmproxies.datasets.chatgpt": (300, HEAVY),
+    "lgmproxies.datasets.tierney": (300, HEAVY),
+    "lgmproxies.datasets.tierney2020": (300, HEAVY),
+    "lgmproxies.datasets.lgmda": (300, HEAVY + ["xarray"]),
+    "lgmproxies.pipeline": (100, HEAVY + ["numpy"]),
+    "lgmproxies.tools": (150, HEAVY),
+    "lgmproxies.datasets.calibrations": (300, HEAVY),
+    "lgmproxies.datasets.bayspline": (300, HEAVY),
+    "lgmproxies.datasets.bayspar": (300, HEAVY),
+    "lgmproxies.datasets.baymag": (300, HEAVY),
+    "lgmproxies.ensemble": (300, HEAVY + ["h5py", "netCDF4", "xarray"]),
+}
+
+CHECK = "import sys, {module}; print(' '.join(m for m in {forbidden!r} if m in sys.modules))"
+
+
+def import_time_ms(module: str) -> float:
+    """Cumulative import time (ms) of `module` in a fresh interpreter
+    """
+    out = sp.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                 capture_output=True, text=True, check=True).stderr
+    for line in out.splitlines():
+        fields = [f.strip() for f in line.split("|")]
+        if len(fields) == 3 and fields[2] == module:
+            return int(fields[1]) / 1000
+    raise RuntimeError(f"Could not find {module} in -X importtime output")
+
+
+def eager_imports(module: str, forbidden: list[str]) -> list[str]:
+    out = sp.run([sys.executable, "-c", CHECK.format(module=module, forbidden=forbidden)],
+                 capture_output=True, text=True, check=True).stdout
+    return out.split()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5, help="number of imports per module (the minimum is kept)")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiply all budgets (slow machines)")
+    parser.add_argument("modules", nargs="*", default=list(BUDGETS))
+    o = parser.parse_args()
+
+    failed = False
+    for module in o.modules:
+        budget, forbidden = BUDGETS[module]
+        budget *= o.scale
+        elapsed = min(import_time_ms(module) for _ in range(o.repeat))
+        eager = eager_imports(module, forbidden)
+        ok = elapsed <= budget and not eager
+        failed |= not ok
+        print(f"{'ok  ' if ok else 'FAIL'} {module:40s} {elapsed:8.1f} ms (budget {budget:.0f} ms)"
+              + (f" eager imports: {', '.join(eager)}" if eager else ""))
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
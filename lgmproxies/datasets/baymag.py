@@ -0,0 +1,206 @@
+"""Mg/Ca to SST with the BAYMAG calibration (Tierney et al., 2019)
+
+Python version of jesstierney/BAYMAG (MATLAB), using the posterior parameter
+draws shipped with that repository. The .mat files are read once and cached
+as binary .npz.
+
+Forward model in log space, for each posterior draw d and species s:
+
+    ln(Mg/Ca) = alpha[d, s] + betaT[d, s] * T + betaS[d] * S + betaP[d, s] * pH
+                + betaO[d] * omega**-2 + ln(1 - betaC[d] * clean)
+                + H * ln(mgsw / mgsw_modern) + N(0, sigma[d, s]**2)
+
+Terms absent from the posterior file are left out (e.g. pH for the
+non-pH-sensitive species). Given all other terms, ln(Mg/Ca) is linear in T, so
+with a normal prior on T the posterior for each draw is normal (conjugate) and
+the inverse prediction is one array expression over (draws x samples).
+
+https://github.com/jesstierney/BAYMAG
+https://doi.org/10.1029/2018PA003505
+"""
+from __future__ import annotations
+from pathlib import Path
+import numpy as np
+from lgmproxies.logs import logger
+from lgmproxies.config import get_datapath
+from lgmproxies.datasets.manager import get_repo_path
+from lgmproxies.datasets.calibrations import _keyed_calibration
+from lgmproxies.tools import default_block_size, load_cached_arrays, sample_blocks, sample_draws, sample_linear_inverse
+
+CACHE_DIR = get_datapath("baymag")
+
+SPECIES_PARAMS = "species_model_params.mat"
+POOLED_PARAMS = "pooled_model_params.mat"
+
+# species order in the species-specific posterior (last axis of the parameters)
+SPECIES = ["ruber", "bulloides", "sacculifer", "pachy", "incompta"]
+
+# model parameter -> variable name in the .mat files (only alpha, betaT and sigma are required)
+MAT_KEYS = {"alpha": "alpha", "betaT": "betaT", "betaS": "betaS", "betaP": "betaP",
+            "betaO": "betaO", "betaC": "betaC", "sigma": "sigma"}
+
+
+def load_params(path: str | Path, keys: dict = MAT_KEYS, cache: bool = True) -> dict:
+    """Return {parameter: (n_draws,) or (n_draws, n_species) array} from a BAYMAG .mat file
+
+    Optional parameters (betaS, betaP...) absent from the file are left out.
+    """
+    path = Path(path)
+
+    def read():
+        from scipy.io import loadmat
+        logger.info(f"Read {path}")
+        mat = loadmat(path, squeeze_me=True)
+        params = {k: np.asarray(mat[v], dtype=float) for k, v in keys.items() if v in mat}
+        missing = {"alpha", "betaT", "sigma"} - set(params)
+        if missing:
+            raise KeyError(f"{path} lacks the required parameters {sorted(missing)}. Found: {sorted(k for k in mat if not k.startswith('__'))}")
+        return params
+
+    return load_cached_arrays(read, [path], CACHE_DIR, path.stem, options=keys, cache=cache)
+
+
+class BayMag:
+    """BAYMAG forward and inverse (prediction) model
+
+    Parameters are (n_draws, n_species + 1) arrays: one column per name in
+    `species`, and a last column with the pooled model, used for any other species.
+
+    Args:
+        params: {parameter: array}, see MAT_KEYS
+        species: species names of the species-specific columns
+    """
+    files = ()  # source files of the posteriors, set by load
+
+    def __init__(self, params: dict, species: list[str] = SPECIES):
+        self.species = list(species)
+        n_draws = len(np.atleast_1d(params["alpha"]))
+        self.params = {}
+        for k, v in params.items():
+            v = np.asarray(v, dtype=float)
+            if v.ndim == 1:
+                v = v[:, None]
+            if v.shape[0] != n_draws:
+                raise ValueError(f"Parameter {k} has {v.shape[0]} draws, expected {n_draws}")
+            self.params[k] = np.broadcast_to(v, (n_draws, len(self.species) + 1))
+
+    @classmethod
+    def load(cls, species_path: str | Path | None = None, pooled_path: str | Path | None = None,
+             species: list[str] = SPECIES, **kwargs) -> "BayMag":
+        """Combine the species-specific and pooled posteriors (the pooled one fills in for other species)
+        """
+        repo = get_repo_path("jesstierney/BAYMAG")
+        species_path = Path(species_path or repo / SPECIES_PARAMS)
+        pooled_path = Path(pooled_path or repo / POOLED_PARAMS)
+        species_params = load_params(species_path, **kwargs)
+        pooled_params = load_params(pooled_path, **kwargs)
+        n_draws = min(len(species_params["alpha"]), len(pooled_params["alpha"]))
+        params = {}
+        for k in set(species_params) | set(pooled_params):
+            sp = np.zeros((n_draws, len(species))) if k not in species_params else np.asarray(species_params[k])[:n_draws]
+            po = np.zeros(n_draws) if k not in pooled_params else np.asarray(pooled_params[k])[:n_draws]
+            sp = np.broadcast_to(sp if sp.ndim == 2 else sp[:, None], (n_draws, len(species)))
+            params[k] = np.column_stack([sp, po])
+        model = cls(params, species)
+        model.files = [species_path, pooled_path]
+        return model
+
+    @property
+    def n_draws(self) -> int:
+        return self.params["alpha"].shape[0]
+
+    def species_index(self, species) -> np.ndarray:
+        """Column of each sample's species (the pooled column for unknown species)
+        """
+        lookup = {s: i for i, s in enumerate(self.species)}
+        pooled = len(self.species)
+        return np.array([lookup.get(s, pooled) for s in np.asarray(species, dtype=object).ravel()], dtype=int)
+
+    def _get(self, name, draws, cols):
+        if name not in self.params:
+            return 0.
+        return self.params[name][draws].take(cols, axis=1)
+
+    def _intercept(self, draws, cols, salinity, ph, omega, clean, mgsw_ratio, H):
+        """All terms of ln(Mg/Ca) except the temperature term (block, n)
+        """
+        intercept = self._get("alpha", draws, cols)
+        intercept = intercept + self._get("betaS", draws, cols) * salinity
+        intercept = intercept + self._get("betaP", draws, cols) * ph
+        intercept = intercept + self._get("betaO", draws, cols) * omega**-2.
+        intercept = intercept + np.log(1 - self._get("betaC", draws, cols) * clean)
+        intercept = intercept + H * np.log(mgsw_ratio)
+        return intercept
+
+    def forward(self, temp, species=None, salinity=35., ph=8.1, omega=4., clean=0., mgsw_ratio=1., H=0.,
+                draws=None, seed: int | None = None, rng=None) -> np.ndarray:
+        """Mg/Ca ensemble (n_draws, n) given temperature and the other environmental parameters
+        """
+        if rng is None:
+            rng = np.random.default_rng(seed)
+        temp = np.asarray(temp, dtype=float)
+        draws = np.arange(self.n_draws) if draws is None else np.asarray(draws)
+        cols = self.species_index(species if species is not None else np.full(temp.shape, None))
+        mean = self._intercept(draws, cols, salinity, ph, omega, clean, mgsw_ratio, H) + self._get("betaT", draws, cols) * temp
+        return np.exp(mean + self._get("sigma", draws, cols) * rng.standard_normal(mean.shape))
+
+    def predict(self, mgca, species=None, salinity=35., ph=8.1, omega=4., clean=0., mgsw_ratio=1., H=0.,
+                prior_mean=None, prior_std: float = 10, draws=None, thin: int = 1,
+                summary: bool = False, quantiles=(2.5, 50, 97.5), block_size: int | None = None,
+                seed: int | None = None, rng=None):
+        """Sample temperature given Mg/Ca (mmol/mol)
+
+        Args:
+            mgca: (n,) Mg/Ca values
+            species: (n,) species names (None or unknown names use the pooled model)
+            salinity, ph, omega: scalars or (n,) arrays of salinity (psu), pH and calcite saturation state
+            clean: cleaning method, 1 for reductive, 0 for oxidative (scalar or (n,))
+            mgsw_ratio, H: seawater Mg/Ca relative to modern and its non-linearity exponent
+            prior_mean: prior temperature mean, scalar or (n,). Default to the Anand et al. (2003) estimate of each sample.
+            prior_std: prior temperature standard deviation (°C)
+            draws: indices of the posterior draws to use (default: all, every `thin`-th)
+            summary: if True, return streaming statistics (see StreamingSummary.result) instead of the samples
+            block_size: number of posterior draws processed at once (default: about 1M values per block)
+
+        Returns:
+            (n_draws, n) array of temperature samples, or a dict of statistics if summary is True
+        """
+        from lgmproxies.datasets.chatgpt import mgca_to_temp
+
+        if rng is None:
+            rng = np.random.default_rng(seed)
+        mgca = np.asarray(mgca, dtype=float)
+        n = len(mgca)
+        if draws is None:
+            draws = np.arange(0, self.n_draws, thin)
+        draws = np.asarray(draws)
+        cols = self.species_index(species if species is not None else np.full(n, None))
+        if prior_mean is None:
+            prior_mean = mgca_to_temp(mgca)
+        log_mgca = np.log(mgca)
+        if block_size is None:
+            block_size = default_block_size(n)
+
+        def sample(block):
+            d = draws[block]
+            intercept = self._intercept(d, cols, salinity, ph, omega, clean, mgsw_ratio, H)
+            return sample_linear_inverse(log_mgca, intercept, self._get("betaT", d, cols),
+                                         self._get("sigma", d, cols)**2, prior_mean, prior_std, rng)
+
+        return sample_blocks(sample, len(draws), n, block_size, summary, quantiles)
+
+
+def baymag_calibration(model: BayMag | None = None, **kwargs):
+    """Calibration for "mg" in lgmproxies.datasets.calibrations
+
+    Example:
+        register_calibration("mg", baymag_calibration(prior_std=10, clean=1))
+    """
+    if model is None:
+        model = BayMag.load()
+
+    def calibration(group, n_samples, rng):
+        draws = sample_draws(model.n_draws, n_samples, rng)
+        return model.predict(group.values, group.species, draws=draws, rng=rng, **kwargs)
+
+    return _keyed_calibration(calibration, kwargs, model.files)
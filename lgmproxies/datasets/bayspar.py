@@ -0,0 +1,294 @@
+"""TEX86 to SST with the BAYSPAR calibration (Tierney and Tingley, 2014)
+
+Vectorised version of brews/baysparpy (python port of jesstierney/BAYSPAR),
+reading the posterior draws and observations shipped with that repository.
+
+Forward model, for each posterior draw d and 20x20 degree grid box g:
+
+    tex86 = alpha[g, d] + beta[g, d] * sst + N(0, tau2[d])
+
+With a normal prior on SST, the posterior for each draw is normal (conjugate),
+so the inverse prediction is a closed-form expression evaluated for all sites
+and a block of draws at once.
+
+- standard mode: each site uses the parameters of the grid box with the
+  closest centre (as BAYSPAR), found with a KD-tree on the box centres.
+- analog mode: each site uses the boxes whose mean modern TEX86 is within
+  `search_tol` of its value, found by binary search in the sorted box means.
+
+The sorted box means (and the box lookup table they are built with) are
+computed once and stored in a .npz cache next to the posterior draws.
+
+https://github.com/brews/baysparpy
+https://doi.org/10.1016/j.gca.2013.11.026
+"""
+from __future__ import annotations
+from pathlib import Path
+import numpy as np
+from lgmproxies.logs import logger
+from lgmproxies.config import get_datapath
+from lgmproxies.datasets.manager import get_repo_path
+from lgmproxies.datasets.calibrations import _keyed_calibration
+from lgmproxies.tools import load_cached_arrays, sample_blocks, sample_draws, sample_linear_inverse
+
+CACHE_DIR = get_datapath("bayspar")
+EARTH_RADIUS = 6378.137  # km, as in baysparpy
+GRID_SPACING = 20  # degrees
+
+TRANSLATE_VAR = {'sst': 'SST', 'subt': 'subT'}
+
+
+def get_source_files(temptype: str = "sst", repo: str | Path | None = None) -> dict[str, Path]:
+    if repo is None:
+        repo = get_repo_path("brews/baysparpy")
+    repo = Path(repo) / "bayspar"
+    var = TRANSLATE_VAR[temptype]
+    return {
+        "alpha": repo / f"modelparams/Output_SpatAg_{var}/alpha_samples_comp.mat",
+        "beta": repo / f"modelparams/Output_SpatAg_{var}/beta_samples_comp.mat",
+        "tau2": repo / f"modelparams/Output_SpatAg_{var}/tau2_samples.mat",
+        "locs": repo / f"modelparams/Output_SpatAg_{var}/Locs_Comp.mat",
+        "tex": repo / f"observations/Data_Input_SpatAg_{var}.mat",
+        "seatemp": repo / f"observations/st_woa_1degree_asvec_{var}.mat",
+        "seatemp_locs": repo / f"observations/locs_woa_1degree_asvec_{var}.mat",
+    }
+
+
+def grid_box(lat, lon):
+    """(lat, lon) indices of the 20x20 degree box containing each point
+    """
+    lon = (np.asarray(lon, dtype=float) + 180) % 360 - 180
+    ilat = np.clip(np.floor((np.asarray(lat, dtype=float) + 90) / GRID_SPACING), 0, 180 // GRID_SPACING - 1).astype(int)
+    ilon = np.clip(np.floor((lon + 180) / GRID_SPACING), 0, 360 // GRID_SPACING - 1).astype(int)
+    return ilat, ilon
+
+
+def _read_sources(files: dict[str, Path]) -> dict:
+    from scipy.io import loadmat
+
+    def read(name, var, **kwargs):
+        logger.info(f"Read {files[name]}")
+        return loadmat(files[name], **kwargs)[var]
+
+    data = {
+        "alpha": read("alpha", "alpha_samples_comp", squeeze_me=True),
+        "beta": read("beta", "beta_samples_comp", squeeze_me=True),
+        "tau2": read("tau2", "tau2_samples", squeeze_me=True),
+        "locs": read("locs", "Locs_Comp", squeeze_me=True).astype(float),  # lon, lat
+        "seatemp": read("seatemp", "st_obs_ave_vec").squeeze(),
+        "seatemp_locs": read("seatemp_locs", "locs_st_obs").squeeze(),  # lon, lat
+    }
+
+    # lookup table of grid boxes: (lat index, lon index) -> row in alpha/beta
+    ilat, ilon = grid_box(data["locs"][:, 1], data["locs"][:, 0])
+    grid_index = np.full((180 // GRID_SPACING, 360 // GRID_SPACING), -1)
+    grid_index[ilat, ilon] = np.arange(len(data["locs"]))
+    data["grid_index"] = grid_index
+
+    # mean modern TEX86 in each box with observations, sorted for the analog search
+    tex = read("tex", "Data_Input")
+    tex_locs = tex["Locs"].squeeze().item()
+    obs_stack = tex["Obs_Stack"].squeeze().item().ravel()
+    inds_stack = tex["Inds_Stack"].squeeze().item().ravel() - 1  # 1-based in the .mat file
+    means = np.bincount(inds_stack, weights=obs_stack, minlength=len(tex_locs)) / np.bincount(inds_stack, minlength=len(tex_locs))
+    box_rows = grid_index[grid_box(tex_locs[:, 1], tex_locs[:, 0])]
+    order = np.argsort(means)
+    data["analog_means"] = means[order]
+    data["analog_rows"] = box_rows[order]
+    return data
+
+
+def load_bayspar(temptype: str = "sst", repo: str | Path | None = None, cache: bool = True) -> dict:
+    """Return the BAYSPAR posterior draws, observations and search structures as arrays
+
+    The search structures are built along with the first read of the sources.
+    """
+    files = get_source_files(temptype, repo)
+    return load_cached_arrays(lambda: _read_sources(files), files.values(), CACHE_DIR, f"bayspar_{temptype}", cache=cache)
+
+
+def _to_xyz(lat, lon):
+    lat, lon = np.deg2rad(lat), np.deg2rad(lon)
+    return EARTH_RADIUS * np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+
+class BaySpar:
+    """BAYSPAR inverse (prediction) model for TEX86
+
+    Args:
+        alpha, beta: (n_boxes, n_draws) posterior draws of intercept and slope in each grid box
+        tau2: (n_draws,) posterior draws of the residual variance
+        locs: (n_boxes, 2) box centres (lon, lat)
+        grid_index: (9, 18) table of box rows by (lat, lon) index, -1 where no parameters
+        seatemp, seatemp_locs: modern sea temperature observations and their (lon, lat), for the default prior
+        analog_means, analog_rows: sorted mean modern TEX86 per box and the corresponding box rows
+    """
+    files = ()  # source files of the posterior, set by load
+
+    def __init__(self, alpha, beta, tau2, locs, grid_index, seatemp=None, seatemp_locs=None,
+                 analog_means=None, analog_rows=None):
+        self.alpha = np.asarray(alpha)
+        self.beta = np.asarray(beta)
+        self.tau2 = np.asarray(tau2).ravel()
+        self.locs = np.asarray(locs)
+        self.grid_index = np.asarray(grid_index)
+        self.seatemp = seatemp
+        self.seatemp_locs = seatemp_locs
+        self.analog_means = analog_means
+        self.analog_rows = analog_rows
+        self._tree = None
+        self._box_tree = None
+
+    @classmethod
+    def load(cls, temptype: str = "sst", repo: str | Path | None = None, **kwargs) -> "BaySpar":
+        model = cls(**load_bayspar(temptype, repo, **kwargs))
+        model.files = list(get_source_files(temptype, repo).values())
+        return model
+
+    @property
+    def n_draws(self) -> int:
+        return len(self.tau2)
+
+    def find_boxes(self, lat, lon) -> np.ndarray:
+        """Row of the grid box parameters for each site (-1 where lat or lon is NaN)
+
+        As in BAYSPAR, this is the box whose centre (`locs`) is closest (chordal
+        distance), so sites in a box without parameters use a neighbouring one.
+        """
+        from scipy.spatial import cKDTree
+        if self._box_tree is None:
+            self._box_tree = cKDTree(_to_xyz(self.locs[:, 1], self.locs[:, 0]))
+        lat, lon = (np.asarray(x, dtype=float).ravel() for x in np.broadcast_arrays(lat, lon))
+        valid = np.isfinite(lat) & np.isfinite(lon)
+        rows = np.full(len(lat), -1)
+        rows[valid] = self._box_tree.query(_to_xyz(lat[valid], lon[valid]))[1]
+        return rows
+
+    def get_prior_mean(self, lat, lon, distance: float = 500) -> np.ndarray:
+        """Mean modern sea temperature within `distance` km of each site (or at the closest observation)
+
+        NaN where lat or lon is NaN.
+        """
+        from scipy.spatial import cKDTree
+        if self._tree is None:
+            self._tree = cKDTree(_to_xyz(self.seatemp_locs[:, 1], self.seatemp_locs[:, 0]))
+        lat, lon = (np.asarray(x, dtype=float).ravel() for x in np.broadcast_arrays(lat, lon))
+        valid = np.isfinite(lat) & np.isfinite(lon)
+        xyz = _to_xyz(lat[valid], lon[valid])
+        # straight-line (chordal) distance in 3D, as baysparpy's chord_distance
+        neighbours = self._tree.query_ball_point(xyz, r=distance)
+        _, closest = self._tree.query(xyz)
+        prior_mean = np.full(len(lat), np.nan)
+        prior_mean[valid] = [self.seatemp[idx].mean() if len(idx) else self.seatemp[c]
+                             for idx, c in zip(neighbours, closest)]
+        return prior_mean
+
+    def find_analogs(self, tex86, search_tol: float) -> tuple[np.ndarray, np.ndarray]:
+        """For each value, the range [start, stop) of matching boxes in analog_means/analog_rows
+        """
+        tex86 = np.asarray(tex86, dtype=float)
+        start = np.searchsorted(self.analog_means, tex86 - search_tol, side="left")
+        stop = np.searchsorted(self.analog_means, tex86 + search_tol, side="right")
+        return start, stop
+
+    def _predict(self, tex86, boxes, prior_mean, prior_std, draws, summary, quantiles, block_size, rng):
+        tex86 = np.asarray(tex86, dtype=float)
+        n = len(tex86)
+        prior_mean = np.broadcast_to(np.asarray(prior_mean, dtype=float), tex86.shape)
+        if block_size is None:
+            block_size = max(1, 2**20 // max(n, 1))
+
+        def sample(block):
+            d = draws[block]
+            rows = boxes(len(d))  # (block, n)
+            a = self.alpha[rows, d[:, None]]
+            b = self.beta[rows, d[:, None]]
+            tau2 = self.tau2[d][:, None]
+            return sample_linear_inverse(tex86, a, b, tau2, prior_mean, prior_std, rng)
+
+        return sample_blocks(sample, len(draws), n, block_size, summary, quantiles)
+
+    def predict(self, tex86, lat, lon, prior_std: float = 10, prior_mean=None, draws=None, thin: int = 1,
+                summary: bool = False, quantiles=(2.5, 50, 97.5), block_size: int | None = None,
+                seed: int | None = None, rng=None):
+        """Sample SST given TEX86 values, with the parameters of each site's grid box (standard mode)
+
+        Args:
+            tex86, lat, lon: (n,) arrays
+            prior_std: prior SST standard deviation (°C)
+            prior_mean: prior SST mean, scalar or (n,). Default to the mean modern observation within 500 km of each site.
+            draws: indices of the posterior draws to use (default: all, every `thin`-th)
+            summary: if True, return streaming statistics (see StreamingSummary.result) instead of the samples
+
+        Returns:
+            (n_draws, n) array of SST samples, or a dict of statistics if summary is True
+        """
+        if rng is None:
+            rng = np.random.default_rng(seed)
+        if draws is None:
+            draws = np.arange(0, self.n_draws, thin)
+        if prior_mean is None:
+            prior_mean = self.get_prior_mean(lat, lon)
+        rows = self.find_boxes(lat, lon)
+        located = rows >= 0
+        rows = np.where(located, rows, 0)  # any box: sites without a location are set to NaN below
+        res = self._predict(tex86, lambda nb: np.broadcast_to(rows, (nb, len(rows))), prior_mean, prior_std,
+                            np.asarray(draws), summary, quantiles, block_size, rng)
+        return _mask_sites(res, ~located, summary)
+
+    def predict_analog(self, tex86, search_tol: float, prior_mean, prior_std: float = 10, draws=None, thin: int = 1,
+                       summary: bool = False, quantiles=(2.5, 50, 97.5), block_size: int | None = None,
+                       seed: int | None = None, rng=None):
+        """Sample SST given TEX86 values, with the parameters of analog grid boxes (analog mode)
+
+        The analog boxes of each value are those whose mean modern TEX86 is within
+        `search_tol`. Each draw uses one of them, chosen at random, so that the
+        ensemble mixes over all analogs (baysparpy keeps them as a separate dimension).
+        Values without any analog are NaN.
+        """
+        if rng is None:
+            rng = np.random.default_rng(seed)
+        if draws is None:
+            draws = np.arange(0, self.n_draws, thin)
+        start, stop = self.find_analogs(tex86, search_tol)
+        count = stop - start
+        if np.any(count == 0):
+            logger.warning(f"No analog found for {np.sum(count == 0)} values within {search_tol}")
+
+        def boxes(nb):
+            pick = start + np.floor(rng.random((nb, len(start))) * count).astype(int)
+            return self.analog_rows[np.minimum(pick, len(self.analog_rows) - 1)]
+
+        res = self._predict(tex86, boxes, prior_mean, prior_std, np.asarray(draws), summary, quantiles, block_size, rng)
+        return _mask_sites(res, count == 0, summary)
+
+
+def _mask_sites(res, mask, summary):
+    """Set the samples (or statistics) of the masked sites to NaN"""
+    if not np.any(mask):
+        return res
+    if summary:
+        for v in [res["mean"], res["std"], *res.get("quantiles", {}).values()]:
+            v[mask] = np.nan
+    else:
+        res[:, mask] = np.nan
+    return res
+
+
+def bayspar_calibration(model: BaySpar | None = None, mode: str = "standard", **kwargs):
+    """Calibration for "tex" in lgmproxies.datasets.calibrations
+
+    Example:
+        register_calibration("tex", bayspar_calibration(prior_std=10))
+        register_calibration("tex", bayspar_calibration(mode="analog", search_tol=0.05, prior_mean=15))
+    """
+    if model is None:
+        model = BaySpar.load()
+
+    def calibration(group, n_samples, rng):
+        draws = sample_draws(model.n_draws, n_samples, rng)
+        if mode == "analog":
+            return model.predict_analog(group.values, draws=draws, rng=rng, **kwargs)
+        return model.predict(group.values, group.latitude, group.longitude, draws=draws, rng=rng, **kwargs)
+
+    return _keyed_calibration(calibration, {"mode": mode, **kwargs}, model.files)
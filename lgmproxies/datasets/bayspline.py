@@ -0,0 +1,218 @@
+"""UK'37 to SST with the BAYSPLINE calibration (Tierney and Tingley, 2018)
+
+Python version of jesstierney/BAYSPLINE (MATLAB), using the posterior draws of
+the B-spline coefficients and residual variance shipped with that repository
+(bayes_posterior_v2.mat). The .mat file is converted once to a binary .npz cache.
+
+Forward model, for each posterior draw d:
+
+    uk37 = spline_d(sst) + N(0, tau2_d)
+
+The inverse prediction combines this likelihood with a normal prior on SST. It is
+evaluated on a regular SST grid for all samples and a block of posterior draws
+at once, and SST is sampled from the discretized posterior by inverse CDF. The
+MATLAB code uses a Metropolis sampler for the same posterior.
+
+https://github.com/jesstierney/BAYSPLINE
+https://doi.org/10.1038/sdata.2018.56
+"""
+from __future__ import annotations
+from pathlib import Path
+import numpy as np
+from lgmproxies.logs import logger
+from lgmproxies.config import get_datapath
+from lgmproxies.datasets.manager import get_repo_path
+from lgmproxies.datasets.calibrations import _keyed_calibration
+from lgmproxies.tools import iter_blocks, load_cached_arrays, sample_blocks, sample_draws
+
+BAYSPLINE_POSTERIOR = "bayes_posterior_v2.mat"
+CACHE_DIR = get_datapath("bayspline")
+
+# variable names in bayes_posterior_v2.mat
+MAT_KEYS = {"bdraws": "bdraws", "tau2": "tau2", "knots": "knots"}
+
+
+def load_posterior(path: str | Path | None = None, keys: dict = MAT_KEYS, cache: bool = True) -> dict:
+    """Return the posterior draws as {"bdraws": (n_draws, n_coef), "tau2": (n_draws,), "knots": (n_knots,)}
+
+    `keys` maps these names to the variables of the .mat file (see load_cached_arrays for the caching).
+    """
+    if path is None:
+        path = get_repo_path("jesstierney/BAYSPLINE") / BAYSPLINE_POSTERIOR
+    path = Path(path)
+
+    def read():
+        from scipy.io import loadmat
+        logger.info(f"Read {path}")
+        mat = loadmat(path, squeeze_me=True)
+        return {k: np.asarray(mat[v], dtype=float) for k, v in keys.items()}
+
+    return load_cached_arrays(read, [path], CACHE_DIR, path.stem, options=keys, cache=cache)
+
+
+class BaySpline:
+    """BAYSPLINE forward and inverse (prediction) model
+
+    Args:
+        bdraws: (n_draws, n_coef) posterior draws of the B-spline coefficients
+        tau2: (n_draws,) posterior draws of the residual variance
+        knots: spline knots (the end knots are repeated `order` times, as MATLAB's augknt)
+        order: spline order (3 for quadratic, as in BAYSPLINE)
+    """
+    files = ()  # source files of the posterior, set by load
+
+    def __init__(self, bdraws: np.ndarray, tau2: np.ndarray, knots: np.ndarray, order: int = 3):
+        self.knots = np.asarray(knots, dtype=float).ravel()
+        self.order = order
+        self.t = np.concatenate([np.repeat(self.knots[0], order - 1), self.knots, np.repeat(self.knots[-1], order - 1)])
+        n_coef = len(self.t) - order
+        bdraws = np.atleast_2d(bdraws)
+        if bdraws.shape[1] != n_coef and bdraws.shape[0] == n_coef:
+            bdraws = bdraws.T
+        if bdraws.shape[1] != n_coef:
+            raise ValueError(f"Expected {n_coef} spline coefficients for {len(self.knots)} knots, got bdraws with shape {bdraws.shape}")
+        self.bdraws = bdraws
+        self.tau2 = np.asarray(tau2, dtype=float).ravel()
+        if len(self.tau2) != len(self.bdraws):
+            raise ValueError(f"bdraws and tau2 have different number of draws: {len(self.bdraws)} and {len(self.tau2)}")
+
+    @classmethod
+    def load(cls, path: str | Path | None = None, **kwargs) -> "BaySpline":
+        if path is None:
+            path = get_repo_path("jesstierney/BAYSPLINE") / BAYSPLINE_POSTERIOR
+        model = cls(**load_posterior(path, **kwargs))
+        model.files = [Path(path)]
+        return model
+
+    @property
+    def n_draws(self) -> int:
+        return len(self.tau2)
+
+    def basis(self, sst: np.ndarray) -> np.ndarray:
+        """B-spline design matrix (len(sst), n_coef), extrapolated linearly beyond the end knots
+
+        As in BAYSPLINE (MATLAB fnxtr(..., 2)): outside the knots, the spline continues
+        along its tangent at the end knot instead of along the end polynomial.
+        """
+        from scipy.interpolate import BSpline
+        sst = np.asarray(sst, dtype=float).ravel()
+        lo, hi = self.knots[0], self.knots[-1]
+        splines = BSpline(self.t, np.eye(len(self.t) - self.order), self.order - 1)
+        slopes = splines.derivative()(np.array([lo, hi]))  # (2, n_coef)
+        return (splines(np.clip(sst, lo, hi))
+                + np.minimum(sst - lo, 0)[:, None] * slopes[0]
+                + np.maximum(sst - hi, 0)[:, None] * slopes[1])
+
+    def forward_mean(self, sst: np.ndarray, draws=None) -> np.ndarray:
+        """Mean UK'37 (n_draws, len(sst)) for each posterior draw
+        """
+        bdraws = self.bdraws if draws is None else self.bdraws[draws]
+        return bdraws @ self.basis(sst).T
+
+    def forward(self, sst: np.ndarray, draws=None, seed: int | None = None, rng=None) -> np.ndarray:
+        """UK'37 ensemble (n_draws, len(sst)), including the residual error
+        """
+        if rng is None:
+            rng = np.random.default_rng(seed)
+        tau2 = self.tau2 if draws is None else self.tau2[draws]
+        mean = self.forward_mean(sst, draws)
+        return mean + np.sqrt(tau2)[:, None] * rng.standard_normal(mean.shape)
+
+    def predict(self, uk37: np.ndarray, prior_mean=None, prior_std: float = 10, draws=None, thin: int = 1,
+                grid: np.ndarray | None = None, summary: bool = False, quantiles=(2.5, 50, 97.5),
+                block_size: int | None = None, chunk_size: int = 64, seed: int | None = None, rng=None):
+        """Sample SST given UK'37 values
+
+        Args:
+            uk37: (n,) array of UK'37 values
+            prior_mean: prior SST mean, scalar or (n,). Default to the linear Müller et al. (1998) estimate of each sample.
+            prior_std: prior SST standard deviation (°C)
+            draws: indices of the posterior draws to use (default: all, every `thin`-th)
+            thin: keep every `thin`-th posterior draw
+            grid: SST values on which the posterior is discretized (default: -10 to 50 °C every 0.2 °C)
+            summary: if True, return streaming statistics (see StreamingSummary.result) instead of the samples
+            quantiles: percentiles computed in summary mode
+            block_size: number of posterior draws processed at once (default: about 4M grid values per block)
+            chunk_size: number of samples (sorted by UK'37) processed at once
+
+        Returns:
+            (n_draws, n) array of SST samples, or a dict of statistics if summary is True.
+            Missing (NaN) UK'37 values give NaN.
+        """
+        from lgmproxies.datasets.chatgpt import uk37_to_sst
+
+        if rng is None:
+            rng = np.random.default_rng(seed)
+        uk37 = np.asarray(uk37, dtype=float)
+        if draws is None:
+            draws = np.arange(0, self.n_draws, thin)
+        draws = np.asarray(draws)
+        if grid is None:
+            grid = np.arange(-10, 50.01, 0.2)
+        if prior_mean is None:
+            prior_mean = uk37_to_sst(uk37)
+        prior_mean = np.broadcast_to(np.asarray(prior_mean, dtype=float), uk37.shape)
+
+        n = len(uk37)
+        dx = np.gradient(grid)
+        mean_grid = self.forward_mean(grid, draws)  # (D, G)
+        tau2 = self.tau2[draws]
+
+        # Samples are processed in chunks of similar UK'37 values, on the part of the
+        # grid where the likelihood is not negligible for any draw (within 8 sigma).
+        valid = np.flatnonzero(np.isfinite(uk37))
+        order = valid[np.argsort(uk37[valid])]
+        chunks = [order[c] for c in iter_blocks(len(order), chunk_size)]
+        spread = 8 * np.sqrt(tau2.max())
+        env_lo = mean_grid.min(axis=0) - spread
+        env_hi = mean_grid.max(axis=0) + spread
+        windows = []
+        for rows in chunks:
+            inside = np.flatnonzero((env_hi >= uk37[rows].min()) & (env_lo <= uk37[rows].max()))
+            windows.append(slice(inside.min(), inside.max() + 1) if inside.size else slice(None))
+
+        if block_size is None:
+            block_size = max(1, 2**22 // (len(grid) * min(n, chunk_size)))
+
+        def sample(block):
+            sst = np.full((block.stop - block.start, n), np.nan)
+            for rows, window in zip(chunks, windows):
+                sst[:, rows] = _sample_grid_posterior(
+                    uk37[rows], prior_mean[rows], prior_std, mean_grid[block, window], tau2[block],
+                    grid[window], dx[window], rng)
+            return sst
+
+        return sample_blocks(sample, len(draws), n, block_size, summary, quantiles)
+
+
+def _sample_grid_posterior(obs, prior_mean, prior_std, mean_grid, tau2, grid, dx, rng):
+    """Draw one value per (draw, obs) from the posterior discretized on `grid`
+
+    obs, prior_mean: (n,), mean_grid: (D, G), tau2: (D,), grid and dx: (G,)
+    Returns a (D, n) array.
+    """
+    log_prior = (-0.5 * ((grid[:, None] - prior_mean[None, :]) / prior_std)**2).astype(np.float32)  # (G, n)
+    # single precision is plenty here: the values only serve as sampling weights
+    resid = obs.astype(np.float32)[None, None, :] - mean_grid.astype(np.float32)[:, :, None]
+    logp = log_prior - 0.5 * resid**2 / tau2.astype(np.float32)[:, None, None]  # (D, G, n)
+    logp -= logp.max(axis=1, keepdims=True)
+    cdf = np.cumsum(np.exp(logp, out=logp), axis=1)
+    u = rng.random((len(tau2), len(obs))) * cdf[:, -1, :]
+    k = np.minimum((cdf < u[:, None, :]).sum(axis=1), len(grid) - 1)  # (D, n)
+    return grid[k] + (rng.random(k.shape) - 0.5) * dx[k]
+
+
+def bayspline_calibration(model: BaySpline | None = None, **kwargs):
+    """Calibration for "uk" in lgmproxies.datasets.calibrations
+
+    Example:
+        register_calibration("uk", bayspline_calibration(prior_std=10))
+    """
+    if model is None:
+        model = BaySpline.load()
+
+    def calibration(group, n_samples, rng):
+        draws = sample_draws(model.n_draws, n_samples, rng)
+        return model.predict(group.values, draws=draws, rng=rng, **kwargs)
+
+    return _keyed_calibration(calibration, kwargs, model.files)
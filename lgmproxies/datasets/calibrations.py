@@ -0,0 +1,172 @@
+"""Batched conversion of Tierney-format proxy tables to SST ensembles
+
+A table with the columns ProxyType, ProxyValue, Species, Latitude and Longitude
+(e.g. Tierney2020_LGMProxyData.csv) is grouped once by ProxyType. Each group is
+passed to the calibration registered for that proxy type, which returns a
+(n_samples, len(group)) array written into one ensemble array aligned with the
+rows of the table.
+
+New calibrations plug in with `register_calibration`:
+
+    @register_calibration("uk")
+    def my_uk37(group, n_samples, rng):
+        return ...  # (n_samples, len(group.values)) array
+"""
+from __future__ import annotations
+from typing import Callable, NamedTuple
+import numpy as np
+from lgmproxies.logs import logger
+from lgmproxies.tools import iter_blocks, sample_draws
+
+
+class ProxyGroup(NamedTuple):
+    """Rows of a proxy table sharing the same ProxyType, as numpy arrays"""
+    proxytype: str
+    values: np.ndarray
+    species: np.ndarray
+    latitude: np.ndarray
+    longitude: np.ndarray
+    rows: np.ndarray  # positions in the original table
+
+
+Calibration = Callable[[ProxyGroup, int, np.random.Generator], np.ndarray]
+
+CALIBRATIONS: dict[str, Calibration] = {}
+
+
+def register_calibration(proxytype: str, func: Calibration | None = None, registry: dict | None = None):
+    """Register `func(group, n_samples, rng)` as the calibration for `proxytype`
+
+    Can be used as a decorator. Replaces any calibration previously registered
+    for the same proxy type.
+    """
+    if registry is None:
+        registry = CALIBRATIONS
+
+    def decorator(func):
+        registry[proxytype] = func
+        return func
+
+    if func is not None:
+        return decorator(func)
+    return decorator
+
+
+def _keyed_calibration(func: Calibration, params: dict, files) -> Calibration:
+    """Attach the `params` and posterior `files` that identify `func` in pipeline keys"""
+    func.params = params
+    func.files = files
+    return func
+
+
+def group_rows(proxytypes) -> dict[str, np.ndarray]:
+    """Return {proxytype: sorted row positions}, in a single pass over the column
+
+    Rows with a missing ProxyType are not part of any group.
+    """
+    import pandas as pd
+    codes, uniques = pd.factorize(np.asarray(proxytypes))
+    order = np.argsort(codes, kind="stable")
+    # missing values (code -1) come first in `order`
+    edges = np.cumsum(np.bincount(codes + 1, minlength=len(uniques) + 1))
+    return {proxytype: order[edges[k]:edges[k+1]] for k, proxytype in enumerate(uniques)}
+
+
+def proxies_to_sst(table, n_samples: int = 1000, seed: int | None = None, rng=None,
+                   calibrations: dict | None = None, out=None, errors: str = "warn",
+                   block_size: int | None = None) -> np.ndarray:
+    """Convert a whole proxy table to an SST ensemble
+
+    Args:
+        table: DataFrame with the columns ProxyType, ProxyValue, Species, Latitude, Longitude
+        n_samples: ensemble size
+        seed, rng: random state
+        calibrations: {proxytype: calibration} overriding the registered CALIBRATIONS
+        out: preallocated (n_samples, len(table)) array (or any array-like supporting
+            `out[:, rows] = ...`) to write into. Default to a new array filled with NaN.
+        errors: "warn" to leave rows with a missing or unknown ProxyType as NaN, "raise" to fail
+        block_size: if given, call each calibration for at most `block_size` samples at
+            a time and write each block to `out` (e.g. an EnsembleStore larger than memory)
+
+    Returns:
+        (n_samples, len(table)) array aligned with the rows of the table
+    """
+    if rng is None:
+        rng = np.random.default_rng(seed)
+    calibrations = {**CALIBRATIONS, **(calibrations or {})}
+
+    values = table["ProxyValue"].to_numpy(dtype=float)
+    species = table["Species"].to_numpy(dtype=object)
+    latitude = table["Latitude"].to_numpy(dtype=float)
+    longitude = table["Longitude"].to_numpy(dtype=float)
+
+    if out is None:
+        out = np.full((n_samples, len(table)), np.nan)
+
+    n_missing = int(table["ProxyType"].isna().sum())
+    if n_missing:
+        msg = f"Missing ProxyType in {n_missing} rows"
+        if errors == "raise":
+            raise KeyError(msg)
+        logger.warning(msg)
+
+    for proxytype, rows in group_rows(table["ProxyType"]).items():
+        if proxytype not in calibrations:
+            msg = f"No calibration registered for ProxyType {proxytype!r} ({len(rows)} rows). Available: {', '.join(calibrations)}"
+            if errors == "raise":
+                raise KeyError(msg)
+            logger.warning(msg)
+            continue
+        group = ProxyGroup(proxytype, values[rows], species[rows], latitude[rows], longitude[rows], rows)
+        for block in iter_blocks(n_samples, block_size or max(n_samples, 1)):
+            size = block.stop - block.start
+            sst = np.asarray(calibrations[proxytype](group, size, rng))
+            if sst.shape != (size, len(rows)):
+                raise ValueError(f"Calibration for {proxytype!r} returned shape {sst.shape}, expected {(size, len(rows))}")
+            out[block, rows] = sst
+
+    return out
+
+
+# Default calibrations (simple closed-form equations, see chatgpt.py)
+
+@register_calibration("uk")
+def uk37_muller(group, n_samples, rng):
+    from lgmproxies.datasets.chatgpt import uk37_to_sst, uk37_error
+    return uk37_to_sst(group.values) + uk37_error(group.values) * rng.standard_normal((n_samples, len(group.values)))
+
+
+@register_calibration("tex")
+def tex86_monte_carlo(group, n_samples, rng):
+    from lgmproxies.datasets.chatgpt import tex86_to_sst_monte_carlo
+    return tex86_to_sst_monte_carlo(group.values, group.latitude, n_samples=n_samples, seed=rng)
+
+
+@register_calibration("mg")
+def mgca_anand(group, n_samples, rng):
+    from lgmproxies.datasets.chatgpt import mgca_to_temp, mgca_error
+    return mgca_to_temp(group.values) + mgca_error(group.values) * rng.standard_normal((n_samples, len(group.values)))
+
+
+def delo_calibration(model, delosw) -> Calibration:
+    """Calibration for "delo" from a DeltaO18 (pooled) or DeltaO18Hierarchical model
+
+    Args:
+        model: DeltaO18 or DeltaO18Hierarchical instance
+        delosw: object with an `interpolate(longitude, latitude)` method, e.g. DeloSWMalevitch()
+
+    Example:
+        register_calibration("delo", delo_calibration(model, DeloSWMalevitch()))
+    """
+    from lgmproxies.datasets.tierney import DeltaO18Hierarchical
+
+    n_draws = model.n_draws
+
+    def calibration(group, n_samples, rng):
+        d18osw = delosw.interpolate(group.longitude, group.latitude)
+        draws = sample_draws(n_draws, n_samples, rng)
+        if isinstance(model, DeltaO18Hierarchical):
+            return model.to_sst(group.values, group.species, d18osw, rng=rng, draws=draws)
+        return model.to_sst(group.values, d18osw, rng=rng, draws=draws)
+
+    return calibration
@@ -4,7 +4,6 @@ https://chatgpt.com/share/682f9b2c-ab58-8008-9a48-dbffbbdbf2e9
 
 for a first round
 """
-import pandas as pd
 import numpy as np
 
 def uk37_to_sst(uk37):
@@ -27,22 +26,32 @@ def tex86_error(tex86):
     """Return standard error for TEX86-derived SST (Kim et al. 2010)."""
     return 2.5  # °C, can be regionally adjusted
 
-def tex86_to_sst_monte_carlo(tex86, lat, n_samples=1000, seed=None):
+def tex86_to_sst_monte_carlo(tex86, lat, n_samples=1000, seed=None, summary=False,
+                             quantiles=(2.5, 50, 97.5), cov=False, block_size=None):
     """
     Monte Carlo simulation of SST from TEX86 using a simple latitude-dependent calibration.
 
+    Samples are generated in blocks of `block_size` draws with array operations.
+
     Parameters:
         tex86: array-like of TEX86 proxy values
         lat: array-like of latitudes (same length as tex86)
         n_samples: number of Monte Carlo samples
         seed: random seed for reproducibility
+        summary: if True, do not keep the samples and return streaming statistics instead
+        quantiles: percentiles computed in summary mode
+        cov: in summary mode, also return the covariance matrix of SST estimates
+        block_size: number of samples generated at once (default: about 1M values per block)
 
     Returns:
-        df_results: DataFrame with SST mean and std for each input
-        sst_cov: Covariance matrix of SST estimates across all points
+        sst_samples: (n_samples, n) array of SST samples, if summary is False
+        df_results: DataFrame with SST mean, std and quantiles for each input, if summary is True
+        sst_cov: Covariance matrix of SST estimates across all points, if summary and cov are True
     """
-    tex86 = np.asarray(tex86)
-    lat = np.asarray(lat)
+    from lgmproxies.tools import default_block_size, sample_blocks
+
+    tex86 = np.asarray(tex86, dtype=float)
+    lat = np.asarray(lat, dtype=float)
 
     if seed is not None:
         rng = np.random.default_rng(seed)
@@ -59,27 +68,33 @@ def tex86_to_sst_monte_carlo(tex86, lat, n_samples=1000, seed=None):
     tex86_std = 0.02  # assumed measurement error
 
     n = len(tex86)
-    sst_samples = np.empty((n_samples, n))
-
-    for i in range(n_samples):
-        slope_i = slope + rng.normal(0, slope_std, size=n)
-        intercept_i = intercept + rng.normal(0, intercept_std)
-        tex86_i = tex86 + rng.normal(0, tex86_std, size=n)
-        sst_samples[i] = slope_i * tex86_i + intercept_i
-
-    return sst_samples
-    # sst_mean = sst_samples.mean(axis=0)
-    # sst_std = sst_samples.std(axis=0)
-    # sst_cov = np.cov(sst_samples.T)
-
-    # df_results = pd.DataFrame({
-    #     'tex86': tex86,
-    #     'lat': lat,
-    #     'sst_mean': sst_mean,
-    #     'sst_std': sst_std
-    # })
-
-    # return df_results, sst_cov
+    if block_size is None:
+        block_size = default_block_size(2 * n)
+
+    def sample(block):
+        nb = block.stop - block.start
+        noise = rng.standard_normal(size=(2, nb, n))
+        slope_i = slope + slope_std * noise[0]
+        tex86_i = tex86 + tex86_std * noise[1]
+        intercept_i = intercept + intercept_std * rng.standard_normal(size=(nb, 1))
+        return slope_i * tex86_i + intercept_i
+
+    res = sample_blocks(sample, n_samples, n, block_size, summary, quantiles, cov)
+    if not summary:
+        return res
+
+    import pandas as pd
+    df_results = pd.DataFrame({
+        'tex86': tex86,
+        'lat': lat,
+        'sst_mean': res["mean"],
+        'sst_std': res["std"],
+        **{f'sst_q{q:g}': v for q, v in res.get("quantiles", {}).items()},
+    })
+
+    if cov:
+        return df_results, res["cov"]
+    return df_results
 
 
 def delta18o_to_temp(delta18o_c, delta18o_sw=0.0):
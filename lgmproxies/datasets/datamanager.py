@@ -5,17 +5,18 @@ from pathlib import Path
 import fnmatch
 import json
 import datetime
-import tqdm
 import shutil
 import functools
 import subprocess as sp
 
-from lgmproxies.logs import logger, log_parser, setup_logger
+from lgmproxies.logs import logger, setup_logger
+from lgmproxies.profiling import stage, profiled, add_bytes
 # from lgmproxies.config import CONFIG, config_parser, CACHE_FOLDER, get_sharedpath
 from lgmproxies.config import get_datapath
+from lgmproxies.datasets.registry import registry, DATASET_JSON
+from lgmproxies.datasets.mirror import fetch_dataset
 
 DOWNLOAD_FOLDER = get_datapath("download")
-DATASET_JSON = DOWNLOAD_FOLDER / "datasets.json"
 
 def get_downloadpath(relpath=''):
     return DOWNLOAD_FOLDER / relpath
@@ -23,6 +24,11 @@ def get_downloadpath(relpath=''):
 MEGABYTES = 1024*1024
 
 def download(url, destination, chunk_size=MEGABYTES, wget_args=None):
+    with stage("datamanager.download", url=url):
+        return _download_partial(url, destination, chunk_size, wget_args)
+
+
+def _download_partial(url, destination, chunk_size=MEGABYTES, wget_args=None):
     partial = Path(str(destination) + ".download")
 
     if wget_args:
@@ -33,6 +39,7 @@ def download(url, destination, chunk_size=MEGABYTES, wget_args=None):
         cmd = f"wget {url} -O {partial} {wget_args}"
         logger.debug(cmd)
         sp.check_call(cmd, shell=True)
+        add_bytes(os.path.getsize(partial))
         shutil.move(partial, destination)
         return
 
@@ -53,12 +60,14 @@ def _download(url, destination, chunk_size=MEGABYTES):
     logger.info(f"Download {url} to {destination}")
 
     import requests
+    import tqdm
     with requests.get(url, stream=True) as response:
         Path(destination).parent.mkdir(parents=True, exist_ok=True) # create folder if it does not exist
         total = int(response.headers.get('content-length', 0))
         with open(destination, mode="wb") as file, tqdm.tqdm(total=round(total/MEGABYTES,2), unit='MB') as bar :
             for chunk in response.iter_content(chunk_size=chunk_size):
                 size = file.write(chunk)
+                add_bytes(size)
                 bar.update(round(size/MEGABYTES,2))
 
     assert response.ok
@@ -70,6 +79,7 @@ def _resume_download(url, destination, chunk_size=MEGABYTES):
     ref: https://stackoverflow.com/a/22894873/2192272
     """
     import requests
+    import tqdm
 
     logger.info(f"Resume download {url} to {destination}")
 
@@ -90,6 +100,7 @@ def _resume_download(url, destination, chunk_size=MEGABYTES):
                 ) as bar:
                 for chunk in response.iter_content(chunk_size=chunk_size):
                     size = file.write(chunk)
+                    add_bytes(size)
                     bar.update(round(size/MEGABYTES, 2))
 
     assert response.ok
@@ -114,6 +125,7 @@ def _is_archive(path, ext=None):
 KNOWN_ARCHIVE_EXTENSIONS = [".zip", ".tar", ".gz"]
 
 
+@profiled("datamanager.extract")
 def extract_archive(downloaded, path, ext=None, members=None, recursive=False, delete_archive=False):
     # Extract (ref: https://ioflood.com/blog/python-unzip)
     archive = str(downloaded)
@@ -168,7 +180,6 @@ def get_filename_from_url(url):
 def require_dataset(name, url=None, extract=None, force_download=None, extract_name=None, members=None, recursive=False, skip_download=False, ext=None, caller=None, ignore_cache=False, wget_args=None, **metadata):
 
     filepath = get_datapath(name)
-    dataset_json = get_datapath("datasets.json")
 
     download_folder = get_downloadpath()
 
@@ -183,7 +194,8 @@ def require_dataset(name, url=None, extract=None, force_download=None, extract_n
 
         # if not (downloaded).exists() or force_download:
         if not (downloaded).exists() or ignore_cache:
-            download(url, downloaded, wget_args=wget_args)
+            if not fetch_dataset(name, url, downloaded):
+                download(url, downloaded, wget_args=wget_args)
         elif (downloaded).exists() and force_download:
             logger.warning(f"{downloaded} found on disk and will be reused. Please manually delete or pass --ignore-cache to force new download.")
 
@@ -203,32 +215,14 @@ def require_dataset(name, url=None, extract=None, force_download=None, extract_n
             target.parent.mkdir(parents=True, exist_ok=True)
             shutil.move(downloaded, target)
 
-        # also keep a centralized .json that can be git-tracked
-        metadata.update({"url": url, "date": str(datetime.datetime.now()), "extract_name": str(extract_name) if extract_name else None, "name": str(name), "ext": ext, "members": members, "recursive": recursive})
-
-        if dataset_json.exists():
-            logger.info(f"Update {dataset_json}")
-            all_data_info = json.load(open(dataset_json))
-        else:
-            logger.info(f"Create {dataset_json}")
-            all_data_info = { "records": [] }
-
-        # re-arrange as dict to ease update
-        by_key = {r['name']:r for r in all_data_info["records"]}
-        by_key[metadata['name']] = metadata
-
-        # but save as list of records to make editing less redundant
-        all_data_info["records"]  = sorted(by_key.values(), key=lambda r: r['name'])
+    elif not filepath.exists() or registry.get(str(name)) is not None:
+        return filepath
 
-        # remove redundant fields
-        for r in all_data_info["records"]:
-            if 'recursive' in r and not r['recursive']: r.pop('recursive')
-            if 'members' in r and not r['members']: r.pop('members')
-            if 'extract_name' in r and (not r['extract_name'] or not r.get('ext') or r['extract_name'] == r['name']): r.pop('extract_name')
-            if 'ext' in r and not r['ext']: r.pop('ext')
-
-        with open(dataset_json, "w") as f:
-            json.dump(all_data_info, f, indent=4, sort_keys=True)
+    # keep a centralized registry that can be exported to a git-tracked .json
+    # (also when the data is found on disk without a record, e.g. one lost by an older concurrent update)
+    metadata.update({"url": url, "date": str(datetime.datetime.now()), "extract_name": str(extract_name) if extract_name else None, "name": str(name), "ext": ext, "members": members, "recursive": recursive})
+    logger.info(f"Update {registry.path}")
+    registry.upsert(metadata)
 
     return filepath
 
@@ -290,16 +284,21 @@ def get_all_datasets():
     return [r['name'] for r in DATASET_REGISTER['records']]
 
 def get_local_datasets():
-    return [name for name in get_all_datasets() if get_datapath(name).exists()]
+    """Registered datasets with a registry record (only those are checked on disk, in case the data was removed)
+    """
+    recorded = set(registry.names())
+    return [name for name in get_all_datasets() if name in recorded and get_datapath(name).exists()]
 
 def get_missing_datasets():
-    return [name for name in get_all_datasets() if not get_datapath(name).exists()]
+    local = set(get_local_datasets())
+    return [name for name in get_all_datasets() if name not in local]
 
 
 
 # Needs to be packed in
 def main():
     import argparse
+    from lgmproxies.logs import log_parser
 
     all_datasets = [r['name'] for r in DATASET_REGISTER['records']]
 
@@ -307,7 +306,8 @@ def main():
     e = parser.add_mutually_exclusive_group()
     e.add_argument("--name", nargs='+', default=[], help="List of dataset names to be downloaded. Wildcard are allowed.")
     e.add_argument("--json", action='store_true', help=f"Download datasets from json file (custom selection of datasets).")
-    parser.add_argument("--json-files", nargs='+', default=[get_datapath('datasets.json')], help='specify alternative json file(s)')
+    parser.add_argument("--json-files", nargs='+', help='json file(s) written by --export-json (default: the records of the local registry)')
+    parser.add_argument("--export-json", nargs='?', const=DATASET_JSON, help='export the local registry to a git-trackable json file (default: %(const)s)')
     parser.add_argument("--ls", action="store_true", help='show all available datasets')
     parser.add_argument("--ls-local", action="store_true", help='list locally available datasets (datasets that have already been downloaded)')
     parser.add_argument("--ls-missing", action="store_true", help='list locally unavailable datasets (datasets that have not been downloaded)')
@@ -330,13 +330,17 @@ def main():
         print_missing_datasets()
         return
 
+    if o.export_json:
+        registry.export_json(o.export_json)
+        return
+
     if o.all:
         o.name = all_datasets
 
     # download from json file
     if o.json:
-        records = []
-        for jsfile in o.json_files:
+        records = [] if o.json_files else registry.records()
+        for jsfile in o.json_files or []:
             js = json.load(open(jsfile))
             records.extend(js["records"])
         download_by_records(records, force_download=o.force, ignore_cache=o.ignore_cache)
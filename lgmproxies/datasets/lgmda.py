@@ -0,0 +1,209 @@
+"""Sample the lgmDA gridded reanalysis ensembles at proxy sites
+
+The netCDF files of jesstierney/lgmDA (LGM and late Holocene data
+assimilation, one field per ensemble member) are opened lazily with xarray.
+Site locations are converted once into grid indices (nearest) or indices and
+weights (bilinear). The field is then read one block of ensemble members at a
+time, restricted to the grid rows that contain sites, so only a small part of
+the file is in memory at once:
+
+    field = open_field("lgmDA_lgm_SST_monthly_climo.nc", "sst")
+    sst = sample_field(field, table["Latitude"], table["Longitude"], method="bilinear")
+    # DataArray (nens, [month,] site)
+
+https://github.com/jesstierney/lgmDA
+"""
+from __future__ import annotations
+from pathlib import Path
+from typing import TYPE_CHECKING, NamedTuple
+import numpy as np
+from lgmproxies.logs import logger
+from lgmproxies.datasets.manager import get_repo_path
+from lgmproxies.profiling import profiled
+from lgmproxies.tools import iter_blocks
+
+if TYPE_CHECKING:
+    import xarray as xr
+
+LAT_NAMES = ["lat", "latitude", "nav_lat", "TLAT", "yt_ocean"]
+LON_NAMES = ["lon", "longitude", "nav_lon", "TLONG", "xt_ocean"]
+
+
+def find_fields(pattern: str = "**/*.nc", repo: str | Path | None = None) -> list[Path]:
+    """netCDF files in the lgmDA clone"""
+    if repo is None:
+        repo = get_repo_path("jesstierney/lgmDA")
+    return sorted(Path(repo).glob(pattern))
+
+
+def open_field(path: str | Path, variable: str | None = None, **kwargs) -> "xr.DataArray":
+    """Open one variable of a netCDF file lazily (nothing is read until sampled)
+
+    A relative `path` is looked up in the lgmDA clone. If `variable` is None,
+    the file must contain exactly one variable with latitude and longitude dimensions.
+    """
+    import xarray as xr
+    path = Path(path)
+    if not path.is_absolute() and not path.exists():
+        path = get_repo_path("jesstierney/lgmDA") / path
+    ds = xr.open_dataset(path, **kwargs)
+    if variable is None:
+        candidates = [name for name, v in ds.data_vars.items() if _find_name(v.dims, LAT_NAMES) and _find_name(v.dims, LON_NAMES)]
+        if len(candidates) != 1:
+            raise ValueError(f"Please specify the variable among {list(ds.data_vars)}")
+        variable = candidates[0]
+    return ds[variable]
+
+
+def _find_name(names, candidates):
+    for name in candidates:
+        if name in names:
+            return name
+    return None
+
+
+class GridIndex(NamedTuple):
+    """Grid points and weights used to sample each site
+
+    rows, cols: (n_sites, k) indices along the latitude and longitude dimensions
+    weights: (n_sites, k) interpolation weights (k=1 for nearest, 4 for bilinear)
+    """
+    rows: np.ndarray
+    cols: np.ndarray
+    weights: np.ndarray
+
+
+def _axis_index(coord, values, periodic=False):
+    """Lower neighbour index and fractional position of `values` on a monotonic 1-D axis"""
+    coord = np.asarray(coord, dtype=float)
+    descending = coord[0] > coord[-1]
+    if descending:
+        coord = coord[::-1]
+    if periodic:
+        period = 360.
+        values = (values - coord[0]) % period + coord[0]
+        extended = np.append(coord, coord[0] + period)
+    else:
+        extended = coord
+    i = np.clip(np.searchsorted(extended, values, side="right") - 1, 0, len(extended) - 2)
+    frac = np.clip((values - extended[i]) / (extended[i + 1] - extended[i]), 0, 1)
+    n = len(coord)
+    i1 = (i + 1) % n if periodic else np.minimum(i + 1, n - 1)
+    if descending:
+        i, i1 = n - 1 - i, n - 1 - i1
+    return i, i1, frac
+
+
+def grid_index(lat_coord, lon_coord, latitude, longitude, method: str = "nearest") -> GridIndex:
+    """Vectorised nearest or bilinear index of sites on a regular (1-D lat, 1-D lon) grid
+
+    Longitudes are matched modulo 360, with the grid treated as periodic when it spans the globe.
+    2-D (curvilinear) coordinates are supported with method="nearest" only.
+    """
+    latitude = np.asarray(latitude, dtype=float)
+    longitude = np.asarray(longitude, dtype=float)
+    lat_coord = np.asarray(lat_coord, dtype=float)
+    lon_coord = np.asarray(lon_coord, dtype=float)
+
+    if lat_coord.ndim == 2:
+        if method != "nearest":
+            raise ValueError("Only method='nearest' is supported for curvilinear grids")
+        from scipy.spatial import cKDTree
+        def xyz(lat, lon):
+            lat, lon = np.deg2rad(lat), np.deg2rad(lon)
+            return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+        valid = np.isfinite(lat_coord) & np.isfinite(lon_coord)
+        flat = np.flatnonzero(valid.ravel())
+        tree = cKDTree(xyz(lat_coord.ravel()[flat], lon_coord.ravel()[flat]))
+        _, k = tree.query(xyz(latitude, longitude))
+        rows, cols = np.unravel_index(flat[k], lat_coord.shape)
+        return GridIndex(rows[:, None], cols[:, None], np.ones((len(latitude), 1)))
+
+    dlon = np.abs(np.diff(lon_coord)).mean() if len(lon_coord) > 1 else 360.
+    periodic = len(lon_coord) * dlon >= 360 - 1e-6 * dlon
+    i0, i1, fy = _axis_index(lat_coord, latitude)
+    j0, j1, fx = _axis_index(lon_coord, longitude, periodic=periodic)
+
+    if method == "nearest":
+        rows = np.where(fy < 0.5, i0, i1)
+        cols = np.where(fx < 0.5, j0, j1)
+        return GridIndex(rows[:, None], cols[:, None], np.ones((len(latitude), 1)))
+
+    elif method == "bilinear":
+        rows = np.column_stack([i0, i0, i1, i1])
+        cols = np.column_stack([j0, j1, j0, j1])
+        weights = np.column_stack([(1 - fy) * (1 - fx), (1 - fy) * fx, fy * (1 - fx), fy * fx])
+        return GridIndex(rows, cols, weights)
+
+    raise ValueError(f"Unknown method {method!r}. Use 'nearest' or 'bilinear'.")
+
+
+@profiled("lgmda.sample_field")
+def sample_field(field: "xr.DataArray", latitude, longitude, method: str = "nearest",
+                 dim: str | None = None, block_size: int | None = None, max_bytes: int = 2**26,
+                 skipna: bool = True) -> "xr.DataArray":
+    """Values of `field` at the sites, for all ensemble members (and any other dimension)
+
+    Args:
+        field: lazily opened DataArray with latitude and longitude dimensions (see open_field)
+        latitude, longitude: (n_sites,) site coordinates
+        method: "nearest" or "bilinear"
+        dim: dimension read in blocks (default: the largest non-spatial dimension, e.g. the ensemble)
+        block_size: number of `dim` entries read at once (default: so that a read is about `max_bytes`)
+        skipna: with bilinear interpolation, renormalize the weights over the non-NaN neighbours
+            (e.g. next to land); sites with no valid neighbour are NaN
+
+    Returns:
+        DataArray with the non-spatial dimensions of `field` followed by "site"
+    """
+    import xarray as xr
+
+    lat_name = _find_name(field.coords, LAT_NAMES) or _find_name(field.dims, LAT_NAMES)
+    lon_name = _find_name(field.coords, LON_NAMES) or _find_name(field.dims, LON_NAMES)
+    if lat_name is None or lon_name is None:
+        raise ValueError(f"Could not find latitude/longitude among {list(field.coords)}")
+    lat_coord, lon_coord = field[lat_name], field[lon_name]
+    # dimensions spanned by the horizontal grid (1-D: (lat, lon); 2-D: e.g. (nlat, nlon))
+    ydim, xdim = (lat_coord.dims[0], lon_coord.dims[0]) if lat_coord.ndim == 1 else lat_coord.dims
+    index = grid_index(lat_coord.values, lon_coord.values, latitude, longitude, method)
+
+    field = field.transpose(..., ydim, xdim)
+    other_dims = list(field.dims[:-2])
+    n_sites = len(index.rows)
+
+    # only read the grid rows that contain sites
+    needed_rows = np.unique(index.rows)
+    local_rows = np.searchsorted(needed_rows, index.rows)
+
+    if dim is None and other_dims:
+        dim = max(other_dims, key=lambda d: field.sizes[d])
+    if dim is not None:
+        field = field.transpose(dim, ...)
+        other_dims = [dim] + [d for d in other_dims if d != dim]
+    n_block_dim = field.sizes[dim] if dim is not None else 1
+    bytes_per_entry = field.dtype.itemsize * len(needed_rows) * field.sizes[xdim] * int(np.prod([field.sizes[d] for d in other_dims[1:]]))
+    if block_size is None:
+        block_size = max(1, max_bytes // max(bytes_per_entry, 1))
+
+    out = np.empty([field.sizes[d] for d in other_dims] + [n_sites], dtype=np.result_type(field.dtype, np.float32))
+    for block in iter_blocks(n_block_dim, block_size):
+        subset = field.isel({ydim: needed_rows}) if dim is None else field.isel({dim: block, ydim: needed_rows})
+        values = np.asarray(subset.values)  # (block, ..., n_rows, nx)
+        points = values[..., local_rows, index.cols]  # (block, ..., n_sites, k)
+        weights = np.broadcast_to(index.weights, points.shape)
+        if skipna and index.weights.shape[1] > 1:
+            valid = ~np.isnan(points)
+            total = np.where(valid, weights, 0).sum(axis=-1)
+            result = np.where(valid, points * weights, 0).sum(axis=-1) / np.where(total > 0, total, np.nan)
+        else:
+            result = (points * weights).sum(axis=-1)
+        if dim is None:
+            out[...] = result
+        else:
+            out[block] = result
+        logger.debug(f"Sampled {dim}[{block.start}:{block.stop}] of {field.name}")
+
+    coords = {d: field[d] for d in other_dims if d in field.coords}
+    coords["latitude"] = ("site", np.asarray(latitude, dtype=float))
+    coords["longitude"] = ("site", np.asarray(longitude, dtype=float))
+    return xr.DataArray(out, dims=other_dims + ["site"], coords=coords, name=field.name, attrs=field.attrs)
@@ -1,70 +1,216 @@
+from __future__ import annotations
+import os
+import shutil
+import tempfile
 from pathlib import Path
 import urllib
 import subprocess as sp
 import urllib.parse
 from lgmproxies.logs import logger
+from lgmproxies.profiling import profiled
 from lgmproxies.config import get_datapath
 from lgmproxies.datasets.datamanager import register_dataset, require_dataset, download
+from lgmproxies.datasets.mirror import get_mirror, repo_location, is_remote
 
 
-def get_repo_path(repo_url: str) -> Path:
+def get_repo_name(repo_url: str) -> str:
     """
-    Parses the repository URL and returns the local path where it should be stored.
+    Parses the repository URL and returns its "user/repo" name.
     """
     # https://github.com/jesstierney/BAYSPLINE -> jesstierney/BAYSPLINE
     parsed = urllib.parse.urlparse(repo_url)
-    if parsed.scheme in ("http", "https"):
+    if parsed.scheme in ("http", "https", "file"):
         # e.g. https://github.com/jesstierney/BAYSPLINE
         repo_path = parsed.path.lstrip("/")
     elif "@" in repo_url and ":" in repo_url:
         # e.g. git@github.com:jesstierney/BAYSPLINE
         repo_path = repo_url.split(":", 1)[1]
     else:
-        # fallback: treat as already in "user/repo" form
+        # fallback: treat as already in "user/repo" form (or a local path)
         repo_path = repo_url
     repo_path = Path(repo_path)
-    return get_datapath(repo_path.parent / repo_path.stem)
+    return (repo_path.parent.name + "/" + repo_path.stem).lstrip("/")
+
+
+def get_repo_path(repo_url: str) -> Path:
+    """
+    Parses the repository URL and returns the local path where it should be stored.
+    """
+    return get_datapath(get_repo_name(repo_url))
+
+
+def get_repo_url(repo_url: str) -> str:
+    """
+    Returns a URL that git can fetch from: "user/repo" names are looked up on github,
+    and local paths are turned into file:// URLs (so that shallow fetches are honoured).
+    """
+    if "://" in repo_url or repo_url.startswith("git@"):
+        return repo_url
+    if Path(repo_url).exists():
+        return Path(repo_url).resolve().as_uri()
+    return f"git@github.com:{repo_url}.git"
+
+
+def _git(*args, cwd=None) -> str:
+    cmd = ["git"] + (["-C", str(cwd)] if cwd else []) + list(args)
+    logger.debug(" ".join(cmd))
+    return sp.run(cmd, check=True, capture_output=True, text=True).stdout.strip()
 
 
-def download_repository(repo_url: str, destination: str="", update: bool=False) -> None:
+def _fetch_from_mirror(fetch: list[str], repo_name: str, rev: str | None, destination: Path) -> bool:
+    """Try to fetch `rev` from the configured mirror (see lgmproxies.datasets.mirror)
+
+    The mirror holds complete snapshots, so its objects are fetched without a
+    filter, and "origin" keeps pointing to the remote repository.
+    """
+    root = get_mirror()
+    if root is None:
+        return False
+    location = repo_location(root, repo_name)
+    if is_remote(location):
+        # a plain http server (dumb protocol) cannot negotiate a shallow fetch
+        fetch = [arg for arg in fetch if not arg.startswith("--depth")]
+    else:
+        if not Path(location).exists():
+            logger.info(f"{repo_name} not found in mirror {root}")
+            return False
+        location = Path(location).resolve().as_uri()
+    try:
+        _git(*fetch, location, rev or "HEAD", cwd=destination)
+    except sp.CalledProcessError as e:
+        logger.warning(f"Failed to fetch {repo_name} from mirror {root}: {e.stderr.strip()}")
+        return False
+    logger.info(f"Fetched {repo_name} from mirror {root}")
+    return True
+
+
+@profiled()
+def download_repository(repo_url: str, destination: str="", update: bool=False,
+                        paths: list[str] | None=None, rev: str | None=None, depth: int | None=1) -> Path:
     """
     Downloads a Git repository to the specified destination.
 
+    Only `depth` commits of history are fetched, and if `paths` is provided only these
+    files are checked out (sparse checkout), with their blobs fetched on demand.
+
     Args:
         repo_url (str): The URL of the Git repository to download.
         destination (str): The local path where the repository should be cloned.
+        update (bool): Fetch and check out `rev` again if the repository already exists.
+        paths (list[str]): Sparse checkout patterns (git "non-cone" syntax). None for the whole tree.
+        rev (str): Commit, tag or branch to check out. None for the remote default branch.
+        depth (int): Number of commits to fetch. None for the full history.
+
+    Returns:
+        Path: The local path of the repository.
     """
-    if not repo_url.startswith("https://") and not repo_url.startswith("git@"):
-        repo_url = f"git@github.com:{repo_url}.git"
+    repo_url = get_repo_url(repo_url)
 
     if not destination:
-        destination = str(get_repo_path(repo_url))
+        destination = get_repo_path(repo_url)
+    destination = Path(destination)
 
-    if Path(destination).exists():
-        if update:
-            logger.info(f"Updating repository at {destination}...")
-            sp.run(["git", "-C", destination, "pull"], check=True)
-        else:
+    if destination.exists():
+        if not update:
             logger.info(f"Repository already exists at {destination}. Use 'update=True' to update it.")
-        return
+            return destination
+        logger.info(f"Updating repository at {destination}...")
+        _fetch_checkout(destination, repo_url, paths, rev, depth)
 
-    Path(destination).parent.mkdir(parents=True, exist_ok=True)
-    sp.run(["git", "clone", repo_url, destination], check=True)
+    else:
+        # fetch into a temporary folder renamed into place on success, so that a
+        # failed fetch does not leave an empty repository that looks downloaded
+        logger.info(f"Fetch {repo_url} to {destination}")
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        partial = Path(tempfile.mkdtemp(prefix=f".{destination.name}.", suffix=".partial", dir=destination.parent))
+        try:
+            _git("init", "--quiet", cwd=partial)
+            _git("remote", "add", "origin", repo_url, cwd=partial)
+            _fetch_checkout(partial, repo_url, paths, rev, depth)
+            try:
+                os.rename(partial, destination)
+            except OSError:
+                if not destination.exists():
+                    raise
+                logger.info(f"{destination} was downloaded concurrently")
+        finally:
+            shutil.rmtree(partial, ignore_errors=True)
+
+    logger.info(f"{destination} at {_git('rev-parse', 'HEAD', cwd=destination)}")
+    return destination
+
+
+def _fetch_checkout(destination: Path, repo_url: str, paths, rev, depth) -> None:
+    if paths:
+        _git("sparse-checkout", "set", "--no-cone", *paths, cwd=destination)
+
+    fetch = ["fetch", "--quiet"]
+    if depth:
+        fetch += [f"--depth={depth}"]
+    if not _fetch_from_mirror(fetch, get_repo_name(repo_url), rev, destination):
+        if paths:
+            fetch += ["--filter=blob:none"]
+        _git(*fetch, "origin", rev or "HEAD", cwd=destination)
+    _git("checkout", "--quiet", "--force", "FETCH_HEAD", cwd=destination)
 
 
-def download_repositories(repos: list=[], update: bool=False) -> None:
+def download_repositories(repos: list=[], update: bool=False, jobs: int=4, full: bool=False) -> dict:
     """
-    Downloads multiple Git repositories.
+    Downloads multiple Git repositories concurrently.
+
+    The paths to check out and the revision for each repository are taken from REPO_SPECS.
 
     Args:
         repos (list): A list of repository URLs to download.
         update (bool): If True, updates existing repositories instead of cloning them again.
+        jobs (int): Number of concurrent downloads.
+        full (bool): If True, fetch the full history and check out all files.
+
+    Returns:
+        dict: repository -> local path, for the successful downloads
     """
+    from concurrent.futures import ThreadPoolExecutor
+    from lgmproxies.datasets.repos import REPO_SPECS
+
+    def _download(repo):
+        spec = REPO_SPECS.get(get_repo_name(repo), {})
+        if full:
+            return download_repository(repo, update=update, rev=spec.get("rev"), depth=None)
+        return download_repository(repo, update=update, paths=spec.get("paths"), rev=spec.get("rev"))
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {repo: executor.submit(_download, repo) for repo in repos}
+        for repo, future in futures.items():
+            try:
+                results[repo] = future.result()
+            except sp.CalledProcessError as e:
+                logger.error(f"Failed to download repository {repo}: {e} {e.stderr}")
+    return results
+
+
+def pin_repositories(repos: list, path: str | Path | None = None) -> dict:
+    """
+    Record the checked-out commit of each local clone in the lock file (REPO_LOCK),
+    so that later downloads check out exactly these revisions.
+
+    Returns:
+        dict: "user/repo" -> commit, for the repositories found locally
+    """
+    import json
+    from lgmproxies.datasets.repos import REPO_LOCK, apply_lock
+    path = Path(path or REPO_LOCK)
+    lock = json.loads(path.read_text()) if path.exists() else {}
     for repo in repos:
-        try:
-            download_repository(repo, update=update)
-        except sp.CalledProcessError as e:
-            logger.error(f"Failed to download repository {repo}: {e}")
+        local = get_repo_path(repo)
+        if not (local / ".git").exists():
+            logger.warning(f"No local clone of {repo} at {local}: not pinned")
+            continue
+        lock[get_repo_name(repo)] = _git("rev-parse", "HEAD", cwd=local)
+        logger.info(f"Pin {get_repo_name(repo)} at {lock[get_repo_name(repo)]}")
+    path.write_text(json.dumps(lock, indent=4, sort_keys=True) + "\n")
+    apply_lock(path=path)
+    return lock
 
 
 def main():
@@ -72,8 +218,11 @@ def main():
     Main function to download all repositories.
     """
     import argparse
-    from lgmproxies.datasets.tierney import TIERNEY_REPOS
+    from lgmproxies.logs import log_parser, setup_logger
+    from lgmproxies.datasets.repos import TIERNEY_REPOS
     import lgmproxies.datasets.catalogue # register datasets into DATASET_REGISTER
+    from lgmproxies.datasets.registry import registry, DATASET_JSON
+    from lgmproxies.datasets.mirror import MIRROR_ENV, set_mirror
     from lgmproxies.datasets.datamanager import (
         DATASET_REGISTER,
         expand_names,
@@ -82,14 +231,31 @@ def main():
     ALL_REPOS = TIERNEY_REPOS
     ALL_DATASETS = [r['name'] for r in DATASET_REGISTER['records']]
 
-    parser = argparse.ArgumentParser(description="Download datasets.")
+    parser = argparse.ArgumentParser(description="Download datasets.", parents=[log_parser])
     parser.add_argument("--update", action="store_true", help="Update existing repositories instead of cloning them again.")
     parser.add_argument("--repos", nargs='*', default=ALL_REPOS, help="List of repositories to download. Defaults to all repositories: %(default)s")
+    parser.add_argument("--jobs", type=int, default=4, help="Number of repositories downloaded concurrently (default: %(default)s)")
+    parser.add_argument("--full", action="store_true", help="Fetch the full history and all files instead of shallow, sparse checkouts.")
     parser.add_argument("--datasets", nargs='*', default=ALL_DATASETS, help="List of repositories to download. Defaults to all repositories: %(default)s")
     parser.add_argument("--force", action="store_true", help="Force download of datasets even if they already exist.")
+    parser.add_argument("--pin", action="store_true", help="Record the commits of the local clones of --repos as the revisions to check out, and exit.")
+    parser.add_argument("--mirror", help=f"Local folder, url or bundle archive tried before the remote urls (default: ${MIRROR_ENV}). Create one with lgmproxies-bundle.")
+    parser.add_argument("--export-json", nargs='?', const=DATASET_JSON, help="Export the local dataset registry to a git-trackable json file (default: %(const)s) and exit.")
     args = parser.parse_args()
+    setup_logger(args)
+
+    if args.mirror is not None:
+        set_mirror(args.mirror)
+
+    if args.export_json:
+        registry.export_json(args.export_json)
+        return
+
+    if args.pin:
+        pin_repositories(args.repos)
+        return
 
-    download_repositories(args.repos, update=args.update)
+    download_repositories(args.repos, update=args.update, jobs=args.jobs, full=args.full)
 
     expanded_names = expand_names(args.datasets)
     download_by_names(expanded_names, force_download=args.force)
@@ -0,0 +1,289 @@
+"""Offline mirror of the registered datasets and repositories
+
+A mirror (or bundle) is a folder with one snapshot of each registered dataset
+and repository:
+
+    <root>/datasets/<name>/<file>        # as downloaded from the dataset url
+    <root>/repos/<user>/<repo>.git       # bare git repository with the snapshot as HEAD
+    <root>/manifest.json                 # urls, revisions and sha256 of the snapshots
+
+It is created on a machine with internet access:
+
+    lgmproxies-bundle /shared/lgmproxies-mirror
+    lgmproxies-bundle /tmp/mirror --archive lgmproxies-bundle.tar.gz
+
+When a mirror root is configured (LGMPROXIES_MIRROR environment variable,
+`set_mirror`, or --mirror on the download command), `require_dataset` and
+`download_repository` try it before the remote urls. The root can be a local
+folder, a file:// or http(s):// url (e.g. `python -m http.server` in the
+mirror folder), or a .zip/.tar/.tar.gz bundle, which is extracted once into
+the cache.
+"""
+from __future__ import annotations
+import os
+import json
+import shutil
+import subprocess as sp
+from pathlib import Path
+from urllib.parse import urlparse, unquote
+from lgmproxies.logs import logger
+from lgmproxies.config import get_datapath
+
+MIRROR_ENV = "LGMPROXIES_MIRROR"
+MANIFEST = "manifest.json"
+DATASETS_DIR = "datasets"
+REPOS_DIR = "repos"
+
+# set_mirror() takes precedence over the environment variable ("" disables the mirror)
+_mirror = None
+
+# (path, size, mtime) of a bundle archive -> extracted folder, so that the archive is hashed once per session
+_bundles = {}
+
+
+def set_mirror(root: str | Path | None) -> None:
+    """Configure the mirror root for this session (None: back to $LGMPROXIES_MIRROR)"""
+    global _mirror
+    _mirror = None if root is None else str(root)
+
+
+def get_mirror() -> str | None:
+    """Configured mirror root: a local folder or an http(s) url, or None
+
+    A file:// url is returned as a local path, and a bundle archive as the
+    folder it is extracted to.
+    """
+    root = _mirror if _mirror is not None else os.environ.get(MIRROR_ENV)
+    if not root:
+        return None
+    if root.startswith("file://"):
+        root = unquote(urlparse(root).path)
+    if is_remote(root):
+        return root.rstrip("/")
+    from lgmproxies.datasets.datamanager import _get_extension
+    if Path(root).is_file() and _get_extension(root) in ARCHIVE_FORMATS:
+        return str(_unpack_bundle(Path(root)))
+    return root
+
+
+def is_remote(root: str) -> bool:
+    return urlparse(str(root)).scheme in ("http", "https")
+
+
+def mirror_location(root: str, *parts: str) -> str:
+    """Path (or url) of an entry in the mirror"""
+    if is_remote(root):
+        return "/".join([root.rstrip("/")] + [p.strip("/") for p in parts])
+    return str(Path(root).joinpath(*parts))
+
+
+def dataset_location(root: str, name: str, filename: str) -> str:
+    return mirror_location(root, DATASETS_DIR, name, filename)
+
+
+def repo_location(root: str, repo_name: str) -> str:
+    return mirror_location(root, REPOS_DIR, f"{repo_name}.git")
+
+
+def _unpack_bundle(archive: Path) -> Path:
+    """Extract a bundle archive into the cache (once per archive content)"""
+    st = archive.stat()
+    key = (str(archive.resolve()), st.st_size, st.st_mtime_ns)
+    if key in _bundles and (_bundles[key] / MANIFEST).exists():
+        return _bundles[key]
+    from lgmproxies.tools import file_digest
+    from lgmproxies.datasets.datamanager import extract_archive
+    from lgmproxies.fileutils import file_lock
+    target = get_datapath("mirror") / file_digest(archive)[:16]
+    target.parent.mkdir(parents=True, exist_ok=True)
+    with file_lock(target.with_suffix(".lock")):
+        if not (target / MANIFEST).exists():
+            partial = target.with_suffix(".partial")
+            shutil.rmtree(partial, ignore_errors=True)
+            extract_archive(archive, partial)
+            # the archive may contain the bundle folder itself
+            content = [p for p in partial.iterdir()]
+            root = content[0] if len(content) == 1 and content[0].is_dir() else partial
+            shutil.rmtree(target, ignore_errors=True)
+            os.replace(root, target)
+            shutil.rmtree(partial, ignore_errors=True)
+    _bundles[key] = target
+    return target
+
+
+def fetch_dataset(name: str, url: str, destination: str | Path) -> bool:
+    """Copy (or download) the mirrored file for dataset `name` to `destination`
+
+    Returns False if no mirror is configured or the file is not in the mirror.
+    """
+    root = get_mirror()
+    if root is None:
+        return False
+    from lgmproxies.datasets.datamanager import download, get_filename_from_url
+    location = dataset_location(root, name, get_filename_from_url(url))
+    destination = Path(destination)
+    destination.parent.mkdir(parents=True, exist_ok=True)
+
+    if not is_remote(location):
+        if not Path(location).exists():
+            logger.info(f"{name} not found in mirror {root}")
+            return False
+        logger.info(f"Copy {location} to {destination}")
+        from lgmproxies.profiling import add_bytes
+        shutil.copyfile(location, destination)
+        add_bytes(destination.stat().st_size)
+        return True
+
+    import requests
+    try:
+        if not requests.head(location, allow_redirects=True, timeout=10).ok:
+            logger.info(f"{name} not found in mirror {root}")
+            return False
+        download(location, destination)
+        return True
+    except (requests.RequestException, AssertionError) as e:
+        logger.warning(f"Failed to download {name} from mirror {root}: {e}")
+        Path(str(destination) + ".download").unlink(missing_ok=True)
+        return False
+
+
+def pack_dataset(record: dict, root: str | Path) -> Path | None:
+    """Copy one DATASET_REGISTER record into the mirror, from the download cache or its url"""
+    from lgmproxies.datasets.datamanager import download, get_downloadpath, get_filename_from_url
+    name, url = record["name"], record.get("url")
+    if not url:
+        logger.warning(f"Dataset {name} has no url and cannot be mirrored")
+        return None
+    destination = Path(dataset_location(str(root), name, get_filename_from_url(url)))
+    if destination.exists():
+        logger.info(f"{name} already in {root}")
+        return destination
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    cached = get_downloadpath(name) / get_filename_from_url(url)
+    if cached.exists():
+        logger.info(f"Copy {cached} to {destination}")
+        shutil.copyfile(cached, destination)
+    else:
+        download(url, destination, wget_args=record.get("wget_args"))
+    return destination
+
+
+def pack_repository(repo: str, root: str | Path, rev: str | None = None, depth: int | None = None) -> Path:
+    """Fetch `repo` at `rev` into a bare repository of the mirror
+
+    The snapshot is the mirror's HEAD, and `rev` (if a branch or tag name) is kept
+    as a tag, so that download_repository can fetch either. With `depth`, only
+    that many commits are kept: smaller, but a shallow mirror can only be served
+    from a folder or smart http, not by a plain http server.
+    """
+    from lgmproxies.datasets.manager import _git, get_repo_name, get_repo_url
+    destination = Path(repo_location(str(root), get_repo_name(repo)))
+    if not destination.exists():
+        destination.mkdir(parents=True)
+        _git("init", "--quiet", "--bare", cwd=destination)
+    logger.info(f"Fetch {repo} to {destination}")
+    fetch = ["fetch", "--quiet"] + ([f"--depth={depth}"] if depth else [])
+    _git(*fetch, get_repo_url(repo), rev or "HEAD", cwd=destination)
+    _git("update-ref", "refs/heads/snapshot", "FETCH_HEAD", cwd=destination)
+    _git("symbolic-ref", "HEAD", "refs/heads/snapshot", cwd=destination)
+    if rev and not _is_commit_id(rev):
+        _git("update-ref", f"refs/tags/{rev}", "FETCH_HEAD", cwd=destination)
+    # allow serving the mirror over plain http
+    _git("update-server-info", cwd=destination)
+    return destination
+
+
+def _is_commit_id(rev: str) -> bool:
+    return 7 <= len(rev) <= 64 and all(c in "0123456789abcdef" for c in rev.lower())
+
+
+def pack_bundle(root: str | Path, datasets: list[str] | None = None, repos: list[str] | None = None,
+                archive: str | Path | None = None, depth: int | None = None) -> Path:
+    """Snapshot registered datasets and repositories into a mirror folder
+
+    Args:
+        root: mirror folder (entries already present are kept)
+        datasets: dataset names, wildcards allowed (default: all of DATASET_REGISTER)
+        repos: repositories (default: TIERNEY_REPOS, at the revisions of REPO_SPECS)
+        archive: also pack the folder into this .zip, .tar or .tar.gz file
+        depth: number of commits kept in the repository snapshots (default: all)
+
+    Returns:
+        the mirror folder, or the archive if requested
+    """
+    import lgmproxies.datasets.catalogue  # register datasets into DATASET_REGISTER
+    from lgmproxies.datasets.datamanager import DATASET_REGISTER, expand_names
+    from lgmproxies.datasets.manager import _git, get_repo_name
+    from lgmproxies.datasets.repos import TIERNEY_REPOS, REPO_SPECS
+    from lgmproxies.tools import file_digest
+
+    root = Path(root)
+    root.mkdir(parents=True, exist_ok=True)
+    manifest_path = root / MANIFEST
+    manifest = json.loads(manifest_path.read_text()) if manifest_path.exists() else {"datasets": {}, "repos": {}}
+
+    names = expand_names(datasets) if datasets is not None else [r["name"] for r in DATASET_REGISTER["records"]]
+    for record in DATASET_REGISTER["records"]:
+        if record["name"] not in names:
+            continue
+        try:
+            path = pack_dataset(record, root)
+        except (OSError, AssertionError, sp.CalledProcessError) as e:
+            logger.error(f"Failed to mirror dataset {record['name']}: {e}")
+            continue
+        if path is not None:
+            manifest["datasets"][record["name"]] = {"url": record["url"], "file": path.relative_to(root).as_posix(),
+                                                    "sha256": file_digest(path)}
+
+    for repo in (TIERNEY_REPOS if repos is None else repos):
+        name = get_repo_name(repo)
+        rev = REPO_SPECS.get(name, {}).get("rev")
+        try:
+            path = pack_repository(repo, root, rev=rev, depth=depth)
+        except sp.CalledProcessError as e:
+            logger.error(f"Failed to mirror repository {repo}: {e} {e.stderr}")
+            continue
+        manifest["repos"][name] = {"url": repo, "rev": rev, "path": path.relative_to(root).as_posix(),
+                                   "commit": _git("rev-parse", "HEAD", cwd=path)}
+
+    manifest_path.write_text(json.dumps(manifest, indent=2) + "\n")
+    logger.info(f"Mirror written to {root}: {len(manifest['datasets'])} datasets, {len(manifest['repos'])} repositories")
+
+    if archive is None:
+        return root
+    return make_archive(root, archive)
+
+
+ARCHIVE_FORMATS = {".zip": "zip", ".tar": "tar", ".tar.gz": "gztar"}
+
+
+def make_archive(root: str | Path, archive: str | Path) -> Path:
+    from lgmproxies.datasets.datamanager import _get_extension
+    archive = Path(archive)
+    ext = _get_extension(archive)
+    if ext not in ARCHIVE_FORMATS:
+        raise ValueError(f"Unsupported archive {archive}. Use one of {', '.join(ARCHIVE_FORMATS)}")
+    logger.info(f"Pack {root} into {archive}")
+    base = str(archive)[:-len(ext)]
+    return Path(shutil.make_archive(base, ARCHIVE_FORMATS[ext], root_dir=root))
+
+
+def main():
+    import argparse
+    from lgmproxies.logs import log_parser, setup_logger
+
+    parser = argparse.ArgumentParser(description="Pack the registered datasets and repositories into an offline mirror.",
+                                     parents=[log_parser])
+    parser.add_argument("root", help="mirror folder to create or update")
+    parser.add_argument("--datasets", nargs='*', help="dataset names (wildcards allowed). Defaults to all registered datasets.")
+    parser.add_argument("--repos", nargs='*', help="repositories. Defaults to all repositories.")
+    parser.add_argument("--archive", help="also pack the mirror into a .zip, .tar or .tar.gz file")
+    parser.add_argument("--depth", type=int, help="commits kept per repository (default: all). Shallow mirrors cannot be served by a plain http server.")
+    args = parser.parse_args()
+    setup_logger(args)
+
+    print(pack_bundle(args.root, datasets=args.datasets, repos=args.repos, archive=args.archive, depth=args.depth))
+
+
+if __name__ == "__main__":
+    main()
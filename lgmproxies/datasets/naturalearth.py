@@ -2,6 +2,7 @@ import itertools
 
 from lgmproxies.datasets.manager import get_datapath
 from lgmproxies.datasets.catalogue import register_coast, register_land
+from lgmproxies.profiling import profiled
 
 require_coast_110m = register_coast("110m")
 require_land_50m = register_land("50m")
@@ -10,6 +11,7 @@ NE_DATA = get_datapath("naturalearth")
 
 coastline_data = {}
 
+@profiled("naturalearth.load_coast")
 def _init_coast(res="110m"):
 
     import fiona
@@ -27,6 +29,7 @@ def get_coast_data(res="110m"):
 
 land_data = {}
 
+@profiled("naturalearth.load_land")
 def _init_land(res='110m'):
 
     import fiona
@@ -42,6 +45,7 @@ def get_land_data(res="110m"):
     return land_data[res]
 
 
+@profiled()
 def add_coast(ax=None, color='k', linewidth='.5', lon0=None, shift_lon=0, res='110m', bbox=None, **kw):
     import numpy as np
     import matplotlib.pyplot as plt
@@ -85,6 +89,7 @@ def add_coast(ax=None, color='k', linewidth='.5', lon0=None, shift_lon=0, res='1
                     ax.plot(x, y, color=color, linewidth=linewidth, **kw)
 
 
+@profiled()
 def add_land(ax=None, lon0=None, shift_lon=0, res='50m', domain=None, bbox=None, **kwargs):
     import matplotlib.pyplot as plt
     # from descartes import PolygonPatch
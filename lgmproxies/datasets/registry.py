@@ -0,0 +1,113 @@
+"""Local registry of downloaded datasets
+
+The records are kept in a SQLite database in WAL mode, so that parallel jobs
+sharing the same cache directory can add records concurrently without losing
+each other's updates. The git-trackable `datasets.json` layout is written on
+demand with `DatasetRegistry.export_json`.
+"""
+import json
+import sqlite3
+import contextlib
+from pathlib import Path
+
+from lgmproxies.logs import logger
+from lgmproxies.config import get_datapath
+
+REGISTRY_DB = get_datapath("datasets.sqlite")
+DATASET_JSON = get_datapath("datasets.json")
+
+SCHEMA_VERSION = 1
+
+
+def clean_record(record: dict) -> dict:
+    """Remove redundant fields to make the exported json less verbose
+    """
+    r = dict(record)
+    if 'recursive' in r and not r['recursive']: r.pop('recursive')
+    if 'members' in r and not r['members']: r.pop('members')
+    if 'extract_name' in r and (not r['extract_name'] or not r.get('ext') or r['extract_name'] == r['name']): r.pop('extract_name')
+    if 'ext' in r and not r['ext']: r.pop('ext')
+    return r
+
+
+class DatasetRegistry:
+    """Records of locally available datasets, stored in a SQLite database
+
+    Each write is a single locked transaction on one record (upsert), so
+    that the cost does not grow with the size of the registry.
+    """
+    def __init__(self, path: str | Path = REGISTRY_DB, legacy_json: str | Path | None = DATASET_JSON, timeout: float = 60):
+        self.path = Path(path)
+        self.legacy_json = Path(legacy_json) if legacy_json else None
+        self.timeout = timeout
+
+    @contextlib.contextmanager
+    def connect(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            if conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+                self._init_schema(conn)
+            yield conn
+        finally:
+            conn.close()
+
+    def _init_schema(self, conn):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # re-check now that we hold the write lock (another process may have done it)
+            if conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+                conn.execute("CREATE TABLE IF NOT EXISTS records (name TEXT PRIMARY KEY, record TEXT NOT NULL)")
+                if self.legacy_json and self.legacy_json.exists():
+                    logger.info(f"Import {self.legacy_json} into {self.path}")
+                    for r in json.load(open(self.legacy_json))["records"]:
+                        conn.execute("INSERT OR IGNORE INTO records (name, record) VALUES (?, ?)",
+                                     (r["name"], json.dumps(r, sort_keys=True)))
+                conn.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def upsert(self, record: dict) -> None:
+        """Insert or replace one record, keyed by its name
+        """
+        record = clean_record(record)
+        with self.connect() as conn:
+            conn.execute("INSERT INTO records (name, record) VALUES (?, ?) "
+                         "ON CONFLICT(name) DO UPDATE SET record=excluded.record",
+                         (record["name"], json.dumps(record, sort_keys=True)))
+
+    def remove(self, name: str) -> None:
+        with self.connect() as conn:
+            conn.execute("DELETE FROM records WHERE name = ?", (name,))
+
+    def get(self, name: str) -> dict | None:
+        with self.connect() as conn:
+            row = conn.execute("SELECT record FROM records WHERE name = ?", (name,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def names(self) -> list[str]:
+        with self.connect() as conn:
+            return [row[0] for row in conn.execute("SELECT name FROM records ORDER BY name")]
+
+    def records(self) -> list[dict]:
+        with self.connect() as conn:
+            return [json.loads(row[0]) for row in conn.execute("SELECT record FROM records ORDER BY name")]
+
+    def export_json(self, path: str | Path = DATASET_JSON) -> Path:
+        """Write all records to a git-trackable json file (list of records sorted by name)
+        """
+        path = Path(path)
+        logger.info(f"Export {self.path} to {path}")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump({"records": self.records()}, f, indent=4, sort_keys=True)
+        tmp.replace(path)
+        return path
+
+
+registry = DatasetRegistry()
@@ -0,0 +1,41 @@
+"""Lightweight constants about the external repositories (no heavy imports)
+"""
+import json
+from pathlib import Path
+
+TIERNEY_REPOS = [
+    "jesstierney/lgmDA",
+    "jesstierney/BAYSPLINE",
+    "jesstierney/BAYMAG",
+    "jesstierney/BAYSPAR",
+    "brews/baysparpy", # python port of jesstierney/BAYSPAR
+    # "brews/bayfox", # foram calibration: pypi
+    # "brews/erebusfall", # d18O correction adapted from Tierney al 2017 https://doi.org/10.1130/G39457.1: pypi
+    "brews/d18oc_sst", # d18O correction from Malevich et al 2019 https://doi.org/10.1029/2019PA003576
+    ]
+
+# Files actually needed from each repository (sparse checkout patterns, git
+# "non-cone" syntax) and the revision to check out (commit, tag or branch).
+# paths=None checks out the whole tree, rev=None the remote default branch.
+REPO_SPECS = {
+    "jesstierney/lgmDA": {"paths": ["/proxyData/", "*.nc"], "rev": None},
+    "jesstierney/BAYSPLINE": {"paths": None, "rev": None},
+    "jesstierney/BAYMAG": {"paths": None, "rev": None},
+    "jesstierney/BAYSPAR": {"paths": None, "rev": None},
+    "brews/baysparpy": {"paths": ["/bayspar/modelparams/", "/bayspar/observations/"], "rev": None},
+    "brews/d18oc_sst": {"paths": ["/data/parsed/coretops*.csv"], "rev": None},
+}
+
+# Commits the notebooks and figures were made with, {"user/repo": commit}. Written
+# from existing clones by `lgmproxies-download --pin`, and applied on top of REPO_SPECS.
+REPO_LOCK = Path(__file__).with_name("repos.lock.json")
+
+
+def apply_lock(specs: dict = REPO_SPECS, path: Path = REPO_LOCK) -> dict:
+    if path.exists():
+        for name, rev in json.loads(path.read_text()).items():
+            specs.setdefault(name, {"paths": None})["rev"] = rev
+    return specs
+
+
+apply_lock()
@@ -1,23 +1,18 @@
+from __future__ import annotations
 from pathlib import Path
-import pandas as pd
-import cloudpickle as cp
+from typing import TYPE_CHECKING, NamedTuple
 import numpy as np
-import pymc as pm
-import arviz as az
-from scipy.interpolate import NearestNDInterpolator
 from lgmproxies.logs import logger
+from lgmproxies.profiling import profiled
 from lgmproxies.datasets.manager import get_repo_path
+from lgmproxies.datasets.repos import TIERNEY_REPOS
+
+# pymc, arviz, cloudpickle, scipy and pandas are imported on first use
+if TYPE_CHECKING:
+    import pymc as pm
+    import arviz as az
+    import pandas as pd
 
-TIERNEY_REPOS = [
-    "jesstierney/lgmDA",
-    "jesstierney/BAYSPLINE",
-    "jesstierney/BAYMAG",
-    "jesstierney/BAYSPAR",
-    "brews/baysparpy", # python port of jesstierney/BAYSPAR
-    # "brews/bayfox", # foram calibration: pypi
-    # "brews/erebusfall", # d18O correction adapted from Tierney al 2017 https://doi.org/10.1130/G39457.1: pypi
-    "brews/d18oc_sst", # d18O correction from Malevich et al 2019 https://doi.org/10.1029/2019PA003576
-    ]
 
 
 class DeltaO18:
@@ -29,6 +24,7 @@ class DeltaO18:
         self.trace = trace
 
     @classmethod
+    @profiled("tierney.DeltaO18.load")
     def load(cls, model_path: str | Path, trace_path: str | Path, **kwargs) -> "DeltaO18":
         """
         Load a DeltaO18 model and its trace from specified paths.
@@ -40,16 +36,60 @@ class DeltaO18:
         Returns:
             DeltaO18: An instance of the DeltaO18 class.
         """
+        import cloudpickle as cp
+        import arviz as az
         model = cp.load(open(model_path, "rb"))
         trace = az.from_netcdf(trace_path)
         return cls(model, trace, **kwargs)
 
-    def to_sst(self, delta_o18: np.ndarray, delta_o18_sw: np.ndarray, seed: int=345, rng=None) -> np.ndarray:
+    @property
+    def n_draws(self) -> int:
+        """Number of posterior draws (all chains)"""
+        return self.trace.posterior.sizes["chain"] * self.trace.posterior.sizes["draw"]
+
+    def _params(self, draws=None) -> list[np.ndarray]:
+        """Posterior a, b and tau, flattened over (chain, draw) and optionally indexed by `draws`"""
+        params = [self.trace.posterior[name].values for name in ("a", "b", "tau")]
+        params = [p.reshape(-1, *p.shape[2:]) for p in params]
+        if draws is not None:
+            params = [p[draws] for p in params]
+        return params
+
+    def _forward(self, temperature, delta_o18_sw, species=None, draws=None) -> tuple[np.ndarray, np.ndarray]:
+        """Mean and std of the d18Oc likelihood, as (n_draws, n) arrays"""
+        a, b, tau = self._params(draws)
+        mean = a[:, None] + b[:, None] * np.asarray(temperature) + (np.asarray(delta_o18_sw) - 0.27)
+        return mean, np.broadcast_to(tau[:, None], mean.shape)
+
+    def _predict(self, temperature, delta_o18_sw, species, draws, noise, seed, rng) -> np.ndarray:
+        mean, std = self._forward(temperature, delta_o18_sw, species, draws)
+        if not noise:
+            return mean
+        if rng is None:
+            rng = np.random.default_rng(seed)
+        return mean + std * rng.standard_normal(mean.shape)
+
+    @profiled()
+    def predict_d18oc(self, temperature: np.ndarray, delta_o18_sw: np.ndarray, draws=None,
+                      noise: bool = False, seed: int = 345, rng=None) -> np.ndarray:
+        """
+        Forward model: returns a (n_draws, n) array of d18Oc, one row per posterior draw
+        (or per index in `draws`), for the given temperature and d18Osw.
+
+        d18oc = a + b * temp + (d18osw - 0.27), plus N(0, tau) if `noise` is True
+        (posterior predictive samples rather than the expected value).
+        """
+        return self._predict(temperature, delta_o18_sw, None, draws, noise, seed, rng)
+
+    @profiled()
+    def to_sst(self, delta_o18: np.ndarray, delta_o18_sw: np.ndarray, seed: int=345, rng=None, draws=None) -> np.ndarray:
+        """
+        Returns a (n_draws, n) array of SST, one row per posterior draw
+        (or per index in `draws`, if provided, into the flattened posterior).
+        """
         if rng is None:
             rng = np.random.default_rng(seed)
-        a = self.trace.posterior["a"].values.flatten()
-        b = self.trace.posterior["b"].values.flatten()
-        tau = self.trace.posterior["tau"].values.flatten()
+        a, b, tau = self._params(draws)
         # d18oc_est = a + b * temp + (d18osw - 0.27) + N(0, tau)
         # -> temp = (delta_o18 - N(0, tau) - delta_o18_sw + 0.27) / b
         temp = (delta_o18 - a[:, None] - delta_o18_sw + 0.27) / b[:, None]
@@ -76,9 +116,32 @@ class DeltaO18Hierarchical(DeltaO18):
             categories = CATEGORIES
         self.categories = categories
 
+    def _species_index(self, species) -> np.ndarray:
+        species = np.asarray(species)
+        if species.dtype.kind not in "iu":
+            lookup = {name: i for i, name in enumerate(self.categories)}
+            species = np.asarray([lookup[s] for s in species])
+        return species
+
+    def _forward(self, temperature, delta_o18_sw, species=None, draws=None) -> tuple[np.ndarray, np.ndarray]:
+        a, b, tau = self._params(draws)
+        species = self._species_index(species)
+        mean = a[:, species] + b[:, species] * np.asarray(temperature) + (np.asarray(delta_o18_sw) - 0.27)
+        return mean, tau[:, species]
+
+    @profiled()
+    def predict_d18oc(self, temperature: np.ndarray, species: np.ndarray, delta_o18_sw: np.ndarray,
+                      draws=None, noise: bool = False, seed: int = 345, rng=None) -> np.ndarray:
+        """
+        Forward model with per-species a, b and tau (species as names or codes, see to_sst).
+        Returns a (n_draws, n) array of d18Oc, plus N(0, tau) if `noise` is True.
+        """
+        return self._predict(temperature, delta_o18_sw, species, draws, noise, seed, rng)
+
+    @profiled()
     def to_sst(self, delta_o18: np.ndarray,
                species: np.ndarray, delta_o18_sw: np.ndarray,
-               seed: int = 345, rng=None) -> np.ndarray:
+               seed: int = 345, rng=None, draws=None) -> np.ndarray:
         """
         delta_o18: 1D array of delta O-18 values for each sample
         species: 1D array of species names corresponding to each delta O-18 value
@@ -92,16 +155,15 @@ N. incompta       90 -> 2 - "incompta"
 N. pachyderma    273 -> 3 - "pachy"
 T. sacculifer    243 -> 4 - "sacculifer"
 Name: count, dtype: int64
+
+Returns a (n_draws, n) array of SST, one row per posterior draw
+(or per index in `draws`, if provided, into the stacked posterior samples).
 """
-        if not species.dtype.kind == "i":
-            species = np.asarray([self.categories.index(s) for s in species])
+        species = self._species_index(species)
         if rng is None:
             rng = np.random.default_rng(seed)
-        post = az.extract(self.trace.posterior)
-        a = post["a"].values
+        a, b, tau = self._params(draws)
         assert a.ndim == 2, f"Expected a to be 2D (samples, species). Got {a.ndim}D: {a.shape}"
-        b = post["b"].values
-        tau = post["tau"].values
         # d18oc_est = a + b * temp + (d18osw - 0.27) + N(0, tau)
         # -> temp = (delta_o18 - N(0, tau) - delta_o18_sw + 0.27) / b
         temp = (delta_o18 - a[:, species] - delta_o18_sw + 0.27) / b[:, species]
@@ -115,7 +177,10 @@ Name: count, dtype: int64
 
 
 class DeloSWMalevitch:
+    @profiled()
     def __init__(self):
+        import pandas as pd
+        from scipy.interpolate import NearestNDInterpolator
         repo = get_repo_path("brews/d18oc_sst")
         self.coretops_raw = pd.read_csv(repo/"data/parsed/coretops.csv")
         self.coretops_grid = pd.read_csv(repo/"data/parsed/coretops_grid.csv")
@@ -131,7 +196,114 @@ class DeloSWMalevitch:
         # Create the nearest neighbor interpolator
         self.interpolator = NearestNDInterpolator(points, d18osw_values)
 
+    @profiled()
     def interpolate(self, longitude: float, latitude: float) -> float:
         # Example: Predict d18osw value at a new point
         new_point = np.array([latitude, longitude]).T  # Replace with actual values
         return self.interpolator(new_point)
+
+
+def load_coretops(temperature: str = "t_annual") -> "pd.DataFrame":
+    """Gridded core tops of Malevich et al. (2019), used to fit the DeltaO18 models
+
+    Adds a "temp" column (copy of `temperature`, e.g. "t_annual" or "t_seasonal") and
+    a "foramtype" column with the species codes used by DeltaO18Hierarchical.
+    """
+    import pandas as pd
+    coretops = pd.read_csv(get_repo_path("brews/d18oc_sst")/"data/parsed/coretops_grid.csv")
+    coretops["temp"] = coretops[temperature]
+    coretops["foramtype"] = coretops["species"].astype("category").cat.codes
+    return coretops
+
+
+class PredictiveScore(NamedTuple):
+    """Posterior predictive check of a DeltaO18 model against observed d18Oc
+
+    pointwise: DataFrame with one row per observation: lppd (log pointwise predictive
+        density), pit (probability integral transform), covered (within the central
+        predictive interval), mean and std of the predictive distribution, residual
+    lppd: sum of the pointwise lppd
+    coverage: fraction of observations within the central predictive interval
+    rmse: root mean square error of the predictive mean
+    log_likelihood: (n_draws, n) log-likelihood, if requested (e.g. for az.loo)
+    """
+    pointwise: "pd.DataFrame"
+    lppd: float
+    coverage: float
+    rmse: float
+    log_likelihood: np.ndarray | None = None
+
+
+@profiled("tierney.posterior_predictive_score")
+def posterior_predictive_score(model: DeltaO18, coretops: "pd.DataFrame | None" = None, interval: float = 0.95,
+                               draws=None, block_size: int | None = None,
+                               log_likelihood: bool = False) -> PredictiveScore:
+    """Score a pooled or hierarchical DeltaO18 model against the core tops
+
+    The posterior draws are evaluated `block_size` at a time (default: about 2**20
+    values per block) and accumulated, so only a (block_size, n) array is in memory
+    unless the full `log_likelihood` is requested.
+
+    Args:
+        model: DeltaO18 or DeltaO18Hierarchical instance
+        coretops: DataFrame with temp, d18osw, d18oc and foramtype columns (default: load_coretops())
+        interval: probability of the central predictive interval used for coverage
+        draws: indices into the flattened posterior (default: all draws)
+        block_size: number of draws evaluated at once
+        log_likelihood: also return the (n_draws, n) pointwise log-likelihood
+
+    Example:
+        coretops = load_coretops()
+        pooled = posterior_predictive_score(DeltaO18.load(...), coretops)
+        hierarchical = posterior_predictive_score(DeltaO18Hierarchical.load(...), coretops)
+        pooled.lppd, hierarchical.lppd
+    """
+    import pandas as pd
+    from scipy.special import ndtr
+    from lgmproxies.tools import iter_blocks, default_block_size
+
+    if coretops is None:
+        coretops = load_coretops()
+    temperature = coretops["temp"].to_numpy(dtype=float)
+    d18osw = coretops["d18osw"].to_numpy(dtype=float)
+    d18oc = coretops["d18oc"].to_numpy(dtype=float)
+    species = coretops["foramtype"].to_numpy() if isinstance(model, DeltaO18Hierarchical) else None
+
+    draws = np.arange(model.n_draws) if draws is None else np.asarray(draws)
+    n_draws, n = len(draws), len(d18oc)
+    if block_size is None:
+        block_size = default_block_size(n)
+
+    # running log-sum-exp of the log-likelihood, and sums over draws of the moments and CDF
+    ll_max = np.full(n, -np.inf)
+    ll_sum = np.zeros(n)
+    mean_sum = np.zeros(n)
+    second_sum = np.zeros(n)
+    cdf_sum = np.zeros(n)
+    full = np.empty((n_draws, n)) if log_likelihood else None
+
+    for block in iter_blocks(n_draws, block_size):
+        mean, std = model._forward(temperature, d18osw, species, draws[block])
+        z = (d18oc - mean) / std
+        ll = -0.5 * z**2 - np.log(std) - 0.5 * np.log(2 * np.pi)
+        if full is not None:
+            full[block] = ll
+        new_max = np.maximum(ll_max, ll.max(axis=0))
+        ll_sum = ll_sum * np.exp(ll_max - new_max) + np.exp(ll - new_max).sum(axis=0)
+        ll_max = new_max
+        mean_sum += mean.sum(axis=0)
+        second_sum += (mean**2 + std**2).sum(axis=0)
+        cdf_sum += ndtr(z).sum(axis=0)
+
+    lppd = ll_max + np.log(ll_sum) - np.log(n_draws)
+    pred_mean = mean_sum / n_draws
+    pred_std = np.sqrt(np.maximum(second_sum / n_draws - pred_mean**2, 0))
+    pit = cdf_sum / n_draws
+    tail = (1 - interval) / 2
+    covered = (pit >= tail) & (pit <= 1 - tail)
+    residual = d18oc - pred_mean
+
+    pointwise = pd.DataFrame({"lppd": lppd, "pit": pit, "covered": covered,
+                              "mean": pred_mean, "std": pred_std, "residual": residual}, index=coretops.index)
+    return PredictiveScore(pointwise, float(lppd.sum()), float(covered.mean()),
+                           float(np.sqrt(np.mean(residual**2))), full)
@@ -0,0 +1,177 @@
+"""Proxy tables of Tierney et al. (2020), from the jesstierney/lgmDA repository
+
+The three CSV files (late Holocene, LGM and paired) are parsed once into a
+single typed table: text columns become categoricals and a Period column is
+added. The table is sorted by (Period, ProxyType, Species) and cached as a
+binary .npz file, keyed by the hash of the source files. The sort means
+each (period, proxy type, species) group, and each of its prefixes, is a
+contiguous block of rows. Those blocks are precomputed, so selecting one is
+a dictionary lookup and a slice instead of boolean masks over the whole
+table:
+
+    tables = load_tierney2020()
+    tables.select("LGM", "mg", "ruber")
+    tables.select("LH", "uk")
+    tables.select(proxytype="tex")   # all periods
+
+https://github.com/jesstierney/lgmDA
+https://doi.org/10.1038/s41586-020-2617-x
+"""
+from __future__ import annotations
+from pathlib import Path
+from typing import TYPE_CHECKING
+import numpy as np
+from lgmproxies.logs import logger
+from lgmproxies.config import get_datapath
+from lgmproxies.datasets.manager import get_repo_path
+from lgmproxies.tools import file_digest
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+TIERNEY2020_FILES = {
+    "LH": "Tierney2020_LHProxyData.csv",
+    "LGM": "Tierney2020_LGMProxyData.csv",
+    "paired": "Tierney2020_ProxyDataPaired.csv",
+}
+
+GROUP_COLUMNS = ["Period", "ProxyType", "Species"]
+
+CACHE_DIR = get_datapath("tierney2020")
+
+# any value (as opposed to None, which selects rows with a missing value, e.g. Species for uk)
+ANY = ...
+
+_tables = {}
+
+
+def _read_csv_files(paths: dict) -> "pd.DataFrame":
+    import pandas as pd
+    frames = []
+    for period, path in paths.items():
+        logger.info(f"Read {path}")
+        df = pd.read_csv(path)
+        df.insert(0, "Period", period)
+        df.insert(1, "Row", np.arange(len(df)))
+        frames.append(df)
+    table = pd.concat(frames, ignore_index=True)
+    for column in table.columns:
+        if table[column].dtype == object or str(table[column].dtype) in ("string", "str"):
+            table[column] = table[column].astype("category")
+    # stable sort by group, with missing values last
+    codes = [table[c].cat.codes.to_numpy() % (len(table[c].cat.categories) + 1) for c in GROUP_COLUMNS if c in table]
+    order = np.lexsort(codes[::-1])
+    return table.iloc[order].reset_index(drop=True)
+
+
+def _to_arrays(table) -> dict:
+    arrays = {}
+    for column in table.columns:
+        values = table[column]
+        if str(values.dtype) == "category":
+            arrays[f"codes:{column}"] = values.cat.codes.to_numpy()
+            arrays[f"categories:{column}"] = values.cat.categories.to_numpy().astype(str)
+        else:
+            arrays[f"values:{column}"] = values.to_numpy()
+    arrays["columns"] = np.array(list(table.columns), dtype=str)
+    return arrays
+
+
+def _from_arrays(arrays) -> "pd.DataFrame":
+    import pandas as pd
+    columns = {}
+    for column in arrays["columns"]:
+        if f"codes:{column}" in arrays:
+            columns[column] = pd.Categorical.from_codes(arrays[f"codes:{column}"], arrays[f"categories:{column}"])
+        else:
+            columns[column] = arrays[f"values:{column}"]
+    return pd.DataFrame(columns)
+
+
+class ProxyTables:
+    """Sorted, categorical proxy table with precomputed group slices
+
+    Attributes:
+        table: DataFrame with all periods, sorted by Period, ProxyType and Species.
+            The Row column holds the row number in the original CSV file.
+        groups: {key: slice} for keys (period,), (period, proxytype) and
+            (period, proxytype, species). Missing values appear as None in keys.
+    """
+    def __init__(self, table: "pd.DataFrame"):
+        self.table = table
+        self.groups = {}
+        columns = [c for c in GROUP_COLUMNS if c in table]
+        codes = np.array([table[c].cat.codes.to_numpy() for c in columns]).reshape(len(columns), len(table))
+        categories = [list(table[c].cat.categories) + [None] for c in columns]  # code -1 -> None
+        for depth in range(1, len(columns) + 1):
+            changes = np.any(np.diff(codes[:depth], axis=1) != 0, axis=0)
+            edges = np.concatenate([[0], np.flatnonzero(changes) + 1, [len(table)]]) if len(table) else [0]
+            for start, stop in zip(edges[:-1], edges[1:]):
+                key = tuple(categories[j][codes[j, start]] for j in range(depth))
+                self.groups[key] = slice(int(start), int(stop))
+
+    @property
+    def periods(self) -> list[str]:
+        return [key[0] for key in self.groups if len(key) == 1]
+
+    def rows(self, period=ANY, proxytype=ANY, species=ANY) -> slice | np.ndarray:
+        """Positions in `table` of the selection: a slice when the selection is one group"""
+        key = (period, proxytype, species)
+        depth = 3
+        while depth > 0 and key[depth - 1] is ANY:
+            depth -= 1
+        if depth == 0:
+            return slice(None)
+        if ANY not in key[:depth]:
+            return self.groups.get(key[:depth], slice(0, 0))
+        # wildcard before a fixed level (e.g. a proxy type in all periods): combine the groups
+        slices = [s for k, s in self.groups.items() if len(k) == depth
+                  and all(q is ANY or q == v for q, v in zip(key[:depth], k))]
+        if not slices:
+            return np.array([], dtype=int)
+        return np.concatenate([np.arange(s.start, s.stop) for s in slices])
+
+    def select(self, period=ANY, proxytype=ANY, species=ANY) -> "pd.DataFrame":
+        """Rows of one period / proxy type / species (ANY for all, None for missing values)"""
+        return self.table.iloc[self.rows(period, proxytype, species)]
+
+    def __getitem__(self, key) -> "pd.DataFrame":
+        key = key if isinstance(key, tuple) else (key,)
+        return self.select(*key)
+
+
+def load_tierney2020(periods: list[str] | None = None, repo: str | Path | None = None,
+                     cache: bool = True) -> ProxyTables:
+    """Load the Tierney et al. (2020) proxy tables
+
+    Args:
+        periods: subset of TIERNEY2020_FILES keys (default: all)
+        repo: folder containing the CSV files (default: proxyData in the lgmDA clone)
+        cache: read from / write to the binary cache
+
+    The binary cache is rebuilt whenever one of the CSV files changes.
+    """
+    if repo is None:
+        repo = get_repo_path("jesstierney/lgmDA") / "proxyData"
+    if periods is None:
+        periods = list(TIERNEY2020_FILES)
+    paths = {period: Path(repo) / TIERNEY2020_FILES[period] for period in periods}
+
+    import hashlib
+    digest = hashlib.sha256("".join(f"{p}:{file_digest(path)}" for p, path in paths.items()).encode()).hexdigest()
+    if digest in _tables:
+        return _tables[digest]
+
+    cached = CACHE_DIR / f"tierney2020_{'_'.join(periods)}_{digest[:16]}.npz"
+    if cache and cached.exists():
+        with np.load(cached) as data:
+            table = _from_arrays(data)
+    else:
+        table = _read_csv_files(paths)
+        if cache:
+            CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            np.savez(cached, **_to_arrays(table))
+            logger.info(f"Cached {cached}")
+
+    _tables[digest] = tables = ProxyTables(table)
+    return tables
@@ -0,0 +1,242 @@
+"""Chunked on-disk store for (n_draws, n_sites) SST ensembles
+
+Results are written straight into a compressed, chunked netCDF4/HDF5 variable
+(via h5netcdf), next to one coordinate variable per column of the site table
+(ProxyType, Species, Latitude, Longitude, period...). Reads and reductions only
+touch the chunks they need, so ensembles much larger than memory can be
+written, sliced and summarized block by block.
+
+Example:
+
+    store = EnsembleStore.create("lgm_sst.nc", table[["ProxyType", "Species", "Latitude", "Longitude"]], n_draws=100_000)
+    proxies_to_sst(table, n_samples=100_000, out=store, block_size=1000)
+    store.select(ProxyType="uk", draws=slice(0, 1000))
+    store.summary(ProxyType="delo")
+
+The file opens in xarray as well: xr.open_dataset("lgm_sst.nc", engine="h5netcdf")
+"""
+from __future__ import annotations
+from pathlib import Path
+from typing import TYPE_CHECKING
+import numpy as np
+from lgmproxies.logs import logger
+from lgmproxies.tools import StreamingSummary, iter_blocks
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+DRAW_DIM = "draw"
+SITE_DIM = "site"
+
+
+def _site_variable_name(column) -> str:
+    return str(column).replace("/", "_")
+
+
+class EnsembleStore:
+    """(n_draws, n_sites) ensemble in a chunked netCDF4 file, with site metadata coordinates
+
+    Use `create` for a new store and `open` for an existing one. Indexing with
+    `store[draws, sites]` reads from / writes to the file, so a store can be
+    passed anywhere an output array is expected (e.g. `proxies_to_sst(out=store)`).
+    """
+    def __init__(self, file, name: str = "sst"):
+        self.file = file
+        self.name = name
+        self.variable = file[name]
+
+    @classmethod
+    def create(cls, path: str | Path, sites: "pd.DataFrame", n_draws: int, name: str = "sst",
+               chunks: tuple[int, int] | None = None, dtype="f4", compression: str | None = "gzip",
+               compression_opts: int | None = 4, attrs: dict | None = None) -> "EnsembleStore":
+        """Create a new store filled with NaN
+
+        Args:
+            path: netCDF file to create (overwritten if it exists)
+            sites: DataFrame with one row per site, each column is stored as a coordinate
+            n_draws: ensemble size
+            name: name of the ensemble variable
+            chunks: (draws, sites) chunk shape. Default to about 1 MB chunks spanning up to 1000 sites.
+            dtype: storage type (single precision by default)
+            compression, compression_opts: HDF5 compression filter and level (None to disable)
+            attrs: attributes of the ensemble variable (e.g. {"units": "degC"})
+        """
+        import h5py
+        import h5netcdf
+
+        n_sites = len(sites)
+        if chunks is None:
+            site_chunk = max(1, min(n_sites, 1000))
+            chunks = (max(1, min(n_draws, 2**18 // site_chunk)), site_chunk)
+
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        logger.info(f"Create ensemble store {path} ({n_draws} draws x {n_sites} sites, chunks {chunks})")
+        f = h5netcdf.File(path, "w")
+        f.dimensions = {DRAW_DIM: n_draws, SITE_DIM: n_sites}
+
+        coords = []
+        for column in sites.columns:
+            values = sites[column].to_numpy()
+            if values.dtype.kind in "OUS" or str(sites[column].dtype) in ("category", "string", "str"):
+                var = f.create_variable(_site_variable_name(column), (SITE_DIM,), dtype=h5py.string_dtype())
+                missing = sites[column].isna().to_numpy()
+                var[:] = np.array(["" if m else str(v) for v, m in zip(values, missing)], dtype=object)
+                if missing.any():
+                    # strings have no NaN: missing values are flagged in a companion variable
+                    mask = f.create_variable(_site_variable_name(column) + "_missing", (SITE_DIM,), data=missing.astype("u1"))
+                    var.attrs["missing_mask"] = mask.name.lstrip("/")
+            else:
+                var = f.create_variable(_site_variable_name(column), (SITE_DIM,), data=values)
+            var.attrs["column"] = str(column)
+            coords.append(_site_variable_name(column))
+
+        var = f.create_variable(name, (DRAW_DIM, SITE_DIM), dtype=dtype, chunks=chunks,
+                                compression=compression, compression_opts=compression_opts if compression else None,
+                                fillvalue=np.nan)
+        if coords:
+            var.attrs["coordinates"] = " ".join(coords)
+        for k, v in (attrs or {}).items():
+            var.attrs[k] = v
+        return cls(f, name)
+
+    @classmethod
+    def open(cls, path: str | Path, mode: str = "r", name: str = "sst") -> "EnsembleStore":
+        import h5netcdf
+        return cls(h5netcdf.File(path, mode), name)
+
+    def close(self) -> None:
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return self.variable.shape
+
+    @property
+    def n_draws(self) -> int:
+        return self.shape[0]
+
+    @property
+    def n_sites(self) -> int:
+        return self.shape[1]
+
+    @property
+    def chunks(self) -> tuple[int, int]:
+        return self.variable.chunks
+
+    @property
+    def sites(self) -> "pd.DataFrame":
+        """Site metadata, as passed to `create`"""
+        import pandas as pd
+        columns = {}
+        for name in self.variable.attrs.get("coordinates", "").split():
+            var = self.file[name]
+            values = var[:]
+            if values.dtype.kind in "OS":
+                values = np.array([v.decode() if isinstance(v, bytes) else v for v in values], dtype=object)
+                if "missing_mask" in var.attrs:
+                    values[self.file[var.attrs["missing_mask"]][:].astype(bool)] = None
+            columns[var.attrs.get("column", name)] = values
+        return pd.DataFrame(columns)
+
+    def _sites_index(self, sites):
+        """Positions as a sorted index array or slice (h5py requires increasing indices)"""
+        if sites is None or isinstance(sites, slice):
+            return slice(None) if sites is None else sites
+        sites = np.asarray(sites)
+        if sites.dtype == bool:
+            sites = np.flatnonzero(sites)
+        if sites.ndim == 0:
+            return int(sites)
+        return sites
+
+    def __getitem__(self, index):
+        draws, sites = index if isinstance(index, tuple) else (index, slice(None))
+        sites = self._sites_index(sites)
+        if isinstance(sites, np.ndarray):
+            order = np.argsort(sites, kind="stable")
+            values = self.variable[draws, sites[order]]
+            out = np.empty_like(values)
+            out[..., order] = values
+            return out
+        return self.variable[draws, sites]
+
+    def __setitem__(self, index, values):
+        draws, sites = index if isinstance(index, tuple) else (index, slice(None))
+        sites = self._sites_index(sites)
+        if isinstance(sites, np.ndarray):
+            order = np.argsort(sites, kind="stable")
+            values = np.broadcast_to(values, np.broadcast_shapes(np.shape(values), (1, len(sites))))
+            self.variable[draws, sites[order]] = values[..., order]
+        else:
+            self.variable[draws, sites] = values
+
+    def site_rows(self, sites=None, **criteria) -> np.ndarray:
+        """Site positions matching `sites` (positions, boolean mask or slice) and all criteria
+
+        Criteria are metadata columns, matched against a value or a list of values,
+        e.g. site_rows(ProxyType="uk", Species=["ruber", "bulloides"])
+        """
+        mask = np.zeros(self.n_sites, dtype=bool)
+        mask[self._sites_index(sites)] = True
+        if criteria:
+            table = self.sites
+            for column, value in criteria.items():
+                values = value if isinstance(value, (list, tuple, set, np.ndarray)) else [value]
+                mask &= table[column].isin(list(values)).to_numpy()
+        return np.flatnonzero(mask)
+
+    def select(self, sites=None, draws=slice(None), **criteria) -> np.ndarray:
+        """Read the (draws, selected sites) block into memory"""
+        return self[draws, self.site_rows(sites, **criteria)]
+
+    def write(self, values, sites=None, draws=slice(None)) -> None:
+        """Write a (draws, sites) block"""
+        self[draws, slice(None) if sites is None else sites] = values
+
+    def iter_chunks(self, sites=None, draws=slice(None), block_size: int | None = None, **criteria):
+        """Yield (draw slice, (block, n_selected) array) over the selected draws, one block at a time"""
+        rows = self.site_rows(sites, **criteria)
+        draws = range(self.n_draws)[draws]
+        if block_size is None:
+            block_size = self.chunks[0] if self.chunks else 1000
+        for block in iter_blocks(len(draws), block_size):
+            selected = draws[block]
+            index = slice(selected.start, selected.stop, selected.step)
+            yield index, self[index, rows]
+
+    def reduce(self, func, sites=None, draws=slice(None), block_size: int | None = None, **criteria):
+        """Apply `func(accumulator, block)` to successive draw blocks, starting with accumulator=None"""
+        accumulator = None
+        for _, block in self.iter_chunks(sites, draws, block_size, **criteria):
+            accumulator = func(accumulator, block)
+        return accumulator
+
+    def summary(self, sites=None, draws=slice(None), quantiles=(2.5, 50, 97.5), cov: bool = False,
+                block_size: int | None = None, **criteria) -> dict:
+        """Mean, std and quantiles over draws for the selected sites, read block by block
+
+        See StreamingSummary.result for the output format. NaN values (e.g. rows
+        left unwritten by proxies_to_sst for an unknown ProxyType) are skipped, and
+        sites without any value give NaN.
+        """
+        rows = self.site_rows(sites, **criteria)
+        stats = StreamingSummary(len(rows), quantiles=quantiles, cov=cov)
+        for _, block in self.iter_chunks(rows, draws, block_size):
+            stats.update(block)
+        return stats.result()
+
+    def mean(self, **kwargs) -> np.ndarray:
+        return self.summary(quantiles=(), **kwargs)["mean"]
+
+    def to_xarray(self):
+        """Open the same file as a lazily-loaded xarray Dataset"""
+        import xarray as xr
+        self.file.flush()
+        return xr.open_dataset(self.file.filename, engine="h5netcdf")
@@ -1,13 +1,15 @@
 """ChatGPT-enabled client for Gaskell et al webtool
 """
+from __future__ import annotations
 
-import requests
-from bs4 import BeautifulSoup
-import pandas as pd
 from io import StringIO
 import hashlib
 import pickle
+import threading
+from contextlib import contextmanager
 from lgmproxies.datasets.manager import get_datapath
+from lgmproxies.fileutils import atomic_write, file_lock
+from lgmproxies.profiling import stage, profiled, add_bytes
 
 calibration_options = [
     "bayfox_pooled",
@@ -62,6 +64,8 @@ co3_options = [
     "none", "sosd"
 ]
 
+CONVERTER_URL = "https://research.peabody.yale.edu/d180/proxy.php"
+
 legacy_cachefile = get_datapath("gaskell_hull2023_cache.pkl")
 cachedir = get_datapath("gaskell_hull2023")
 
@@ -69,6 +73,7 @@ def hash_dataframe(df):
     """
     Return a hash of a DataFrame's content for use as a cache key.
     """
+    import pandas as pd
     df_bytes = pd.util.hash_pandas_object(df, index=True).values.tobytes()
     return hashlib.sha256(df_bytes).hexdigest()
 
@@ -79,6 +84,74 @@ def get_file_path(key):
     filename = "cache_" + hashlib.sha256(str(key).encode()).hexdigest() + ".csv"
     return cachedir / filename
 
+def get_cache_path(df_input, *args, **kwargs):
+    """
+    Path of the cached result of a `cached` function called with these arguments.
+    """
+    # sorted, not a frozenset: set order depends on the per-process string hash seed,
+    # and the key must be the same in every process (cache files and cross-process locks)
+    df_hash = hash_dataframe(df_input)
+    filepath = get_file_path((df_hash, args, tuple(sorted(kwargs.items()))))
+    if not filepath.exists():
+        _migrate_legacy_path(filepath, df_hash, args, kwargs)
+    return filepath
+
+LEGACY_MANIFEST = "legacy_names.json"
+
+_legacy_names = {}  # cachedir: names of its cache files still under the former key
+_legacy_checked = set()  # cache paths already looked up under the former key in this session
+
+def get_legacy_names():
+    """
+    Names of the cache files written under the former frozenset key, not migrated yet.
+
+    All the cache files present when this version first runs on the cache folder
+    predate it: their names are recorded once in LEGACY_MANIFEST. Names that no
+    longer exist (migrated or deleted) are dropped at the first lookup of each
+    session, so that once none remains, cache misses cost nothing more.
+    """
+    import json
+    if cachedir not in _legacy_names:
+        manifest = cachedir / LEGACY_MANIFEST
+        with file_lock(manifest.with_suffix(".lock")):
+            if manifest.exists():
+                recorded = json.loads(manifest.read_text())
+                names = [name for name in recorded if (cachedir / name).exists()]
+            else:
+                recorded = None
+                names = sorted(p.name for p in cachedir.glob("cache_*.csv"))
+            if names != recorded:
+                with atomic_write(manifest) as f:
+                    json.dump(names, f)
+        _legacy_names[cachedir] = set(names)
+    return _legacy_names[cachedir]
+
+def _migrate_legacy_path(filepath, df_hash, args, kwargs):
+    """
+    Rename a cache file written under the former frozenset key to `filepath`.
+
+    The frozenset repr depends on the hash seed of the process that wrote it,
+    so every order of the options is a candidate (only while legacy files remain).
+    """
+    import os
+    import itertools
+    from lgmproxies.logs import logger
+    legacy_names = get_legacy_names()
+    if not legacy_names or filepath in _legacy_checked or len(kwargs) > 8:
+        return
+    _legacy_checked.add(filepath)
+    for items in itertools.permutations(kwargs.items()):
+        options = "frozenset({%s})" % ", ".join(map(repr, items)) if items else "frozenset()"
+        legacy = get_file_path(f"({df_hash!r}, {args!r}, {options})")  # str() of the former key tuple
+        if legacy.name in legacy_names:
+            try:
+                os.replace(legacy, filepath)
+                logger.info(f"Renamed cache file {legacy.name} to {filepath.name}")
+            except FileNotFoundError:
+                pass  # renamed by another process
+            legacy_names.discard(legacy.name)
+            return
+
 def cached(func):
     """
     Decorator to cache the results of the function.
@@ -97,18 +170,63 @@ def cached(func):
         legacy_cachefile.unlink()  # Remove old cache file
 
     def wrapper(df_input, *args, **kwargs):
-        df_hash = hash_dataframe(df_input)
-        key = (df_hash, args, frozenset(kwargs.items()))
-        filepath = get_file_path(key)
+        import pandas as pd
+        filepath = get_cache_path(df_input, *args, **kwargs)
         if not filepath.exists():
-            result = func(df_input.copy(), *args, **kwargs)
-            filepath.parent.mkdir(parents=True, exist_ok=True)
-            result.to_csv(filepath, index=False)
-            return result
-        return pd.read_csv(filepath)
+            # Concurrent callers with the same key (threads, then processes) wait
+            # for the one running request, and read its result from the cache.
+            with _key_lock(filepath), file_lock(filepath.with_suffix(".lock")):
+                if not filepath.exists():
+                    result = func(df_input.copy(), *args, **kwargs)
+                    with atomic_write(filepath, newline="") as f:
+                        result.to_csv(f, index=False)
+                    return result
+        with stage("gaskell_hull2023.read_cache"):
+            return pd.read_csv(filepath)
 
     return wrapper
 
+
+_key_locks = {}  # filepath: [lock, number of users]
+_key_locks_guard = threading.Lock()
+
+@contextmanager
+def _key_lock(filepath):
+    """In-process lock per cache entry (single flight)"""
+    with _key_locks_guard:
+        entry = _key_locks.setdefault(filepath, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _key_locks_guard:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del _key_locks[filepath]
+
+def validate_options(calibration='bayfox_pooled', timescale='GTS2020', ice='rohling1', latlong='none',
+                     spatial='gaskell_poly', benthic='rohling1', co3='none'):
+    """
+    Raise ValueError if an option is not accepted by the converter.
+    """
+    if calibration not in calibration_options:
+        raise ValueError(f"Invalid calibration option: {calibration}. Must be one of {calibration_options}")
+    if timescale not in timescale_options:
+        raise ValueError(f"Invalid timescale option: {timescale}. Must be one of {timescale_options}")
+    if ice not in ice_options:
+        raise ValueError(f"Invalid ice option: {ice}. Must be one of {ice_options}")
+    if latlong not in ['none', 'latlong']:
+        raise ValueError(f"Invalid latlong option: {latlong}. Must be 'none' or 'latlong'")
+    if spatial not in spatial_options:
+        raise ValueError(f"Invalid spatial option: {spatial}. Must be one of {spatial_options}")
+    if benthic not in benthic_options:
+        raise ValueError(f"Invalid benthic option: {benthic}. Must be one of {benthic_options}")
+    if co3 not in co3_options:
+        raise ValueError(f"Invalid co3 option: {co3}. Must be one of {co3_options}")
+
+
+@profiled("gaskell_hull2023.convert_d18o_df")
 @cached
 def convert_d18o_df(
     df_input,
@@ -161,31 +279,20 @@ def convert_d18o_df(
         'co3': co3,
     }
 
-    # validate options
-    if calibration not in calibration_options:
-        raise ValueError(f"Invalid calibration option: {calibration}. Must be one of {calibration_options}")
-    if timescale not in timescale_options:
-        raise ValueError(f"Invalid timescale option: {timescale}. Must be one of {timescale_options}")
-    if ice not in ice_options:
-        raise ValueError(f"Invalid ice option: {ice}. Must be one of {ice_options}")
-    if latlong not in ['none', 'latlong']:
-        raise ValueError(f"Invalid latlong option: {latlong}. Must be 'none' or 'latlong'")
-    if spatial not in spatial_options:
-        raise ValueError(f"Invalid spatial option: {spatial}. Must be one of {spatial_options}")
-    if benthic not in benthic_options:
-        raise ValueError(f"Invalid benthic option: {benthic}. Must be one of {benthic_options}")
-    if co3 not in co3_options:
-        raise ValueError(f"Invalid co3 option: {co3}. Must be one of {co3_options}")
+    validate_options(calibration, timescale, ice, latlong, spatial, benthic, co3)
 
-    url = "https://research.peabody.yale.edu/d180/proxy.php"
-    response = requests.post(url, files=files, data=data)
-    response.raise_for_status()
+    import requests
+    with stage("gaskell_hull2023.request", url=CONVERTER_URL):
+        response = requests.post(CONVERTER_URL, files=files, data=data)
+        response.raise_for_status()
+        add_bytes(len(response.content))
 
     return read_html_results(response.text)
 
 
 # Load the HTML file
 
+@profiled()
 def read_html_results(html_content: str) -> pd.DataFrame:
     """
     Read the HTML file and extract the first table as a DataFrame.
@@ -196,6 +303,8 @@ def read_html_results(html_content: str) -> pd.DataFrame:
     Returns:
         pd.DataFrame: DataFrame containing the first table found in the HTML.
     """
+    import pandas as pd
+    from bs4 import BeautifulSoup
     soup = BeautifulSoup(html_content, "html.parser")
 
     # Extract tables from the HTML
@@ -206,4 +315,112 @@ def read_html_results(html_content: str) -> pd.DataFrame:
         raise ValueError("No tables found in the HTML file.")
 
     df = pd.read_html(StringIO(str(tables[0])))[0]
-    return df
\ No newline at end of file
+    return df
+
+class RateLimiter:
+    """
+    Space calls to `wait()` at least 1/rate seconds apart, across threads.
+    """
+    def __init__(self, rate=None):
+        self.interval = 1 / rate if rate else 0
+        self.next_time = 0.
+        self.lock = threading.Lock()
+
+    def wait(self):
+        import time
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_time)
+            self.next_time = start + self.interval
+        time.sleep(max(0., start - now))
+
+
+def expand_grid(grid):
+    """
+    List of option dicts for all combinations of a {option: values} grid.
+    """
+    import itertools
+    names = list(grid)
+    values = [grid[name] if isinstance(grid[name], (list, tuple)) else [grid[name]] for name in names]
+    return [dict(zip(names, combination)) for combination in itertools.product(*values)]
+
+
+def sweep(df_input, grid, max_workers=4, rate=1.0, errors="warn", func=None):
+    """
+    Convert `df_input` for every combination of converter options in `grid`.
+
+    Invalid combinations are dropped, cached ones are read from disk, and the
+    remaining requests run in a thread pool of `max_workers`, starting at most
+    `rate` requests per second (None for no limit). Reruns only send the
+    requests that have not succeeded yet.
+
+    Parameters
+    ----------
+    df_input : pd.DataFrame
+        Must contain columns: d18O, age, lat, long
+    grid : dict
+        {option: list of values}, e.g. {"calibration": ["bayfox_pooled", "bemis"], "ice": ice_options}.
+        Options not in the grid take the convert_d18o_df defaults.
+    errors : str
+        "warn" to skip failed requests with a warning, "raise" to fail
+    func : callable
+        converter (default: convert_d18o_df)
+
+    Returns
+    -------
+    pd.DataFrame
+        Long-format table: one block of rows per option combination, with
+        the option values as leading columns.
+    """
+    import pandas as pd
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    from lgmproxies.logs import logger
+
+    if func is None:
+        func = convert_d18o_df
+
+    combinations = []
+    for options in expand_grid(grid):
+        try:
+            validate_options(**options)
+        except ValueError as error:
+            logger.warning(f"Skip {options}: {error}")
+            continue
+        combinations.append(options)
+
+    is_cached = [get_cache_path(df_input, **options).exists() for options in combinations]
+    logger.info(f"{len(combinations)} option combinations: {sum(is_cached)} cached, {len(combinations) - sum(is_cached)} to request")
+
+    results = {}
+    for i, options in enumerate(combinations):
+        if is_cached[i]:
+            results[i] = func(df_input, **options)
+
+    limiter = RateLimiter(rate)
+
+    def run(options):
+        limiter.wait()
+        return func(df_input, **options)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(run, options): i for i, options in enumerate(combinations) if not is_cached[i]}
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                results[i] = future.result()
+            except Exception as error:
+                if errors == "raise":
+                    raise
+                logger.warning(f"Request failed for {combinations[i]}: {error!r}")
+
+    tables = []
+    for i in sorted(results):
+        table = results[i]
+        for k, (name, value) in enumerate(combinations[i].items()):
+            table.insert(k, name, value)
+        tables.append(table)
+    if not tables:
+        return pd.DataFrame(columns=list(grid))
+    return pd.concat(tables, ignore_index=True)
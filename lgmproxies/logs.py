@@ -1,17 +1,35 @@
+import os
 import logging
-import argparse
+import types
 import lgmproxies
 
-log_parser = argparse.ArgumentParser(add_help=False)
-g = log_parser.add_argument_group("logging")
-g.add_argument("--log-file")
-g.add_argument("--debug", action='store_const', dest='log_level', const=logging.DEBUG)
-g.add_argument("--info", action='store_const', dest='log_level', const=logging.INFO)
-g.add_argument("--warning", action='store_const', dest='log_level', const=logging.WARNING)
-g.add_argument("--error", action='store_const', dest='log_level', const=logging.ERROR)
+_log_parser = None
+
+def get_log_parser():
+    """Parent parser with logging options (built on first use to keep import light)
+    """
+    global _log_parser
+    if _log_parser is None:
+        import argparse
+        _log_parser = argparse.ArgumentParser(add_help=False)
+        g = _log_parser.add_argument_group("logging")
+        g.add_argument("--log-file")
+        g.add_argument("--debug", action='store_const', dest='log_level', const=logging.DEBUG)
+        g.add_argument("--info", action='store_const', dest='log_level', const=logging.INFO)
+        g.add_argument("--warning", action='store_const', dest='log_level', const=logging.WARNING)
+        g.add_argument("--error", action='store_const', dest='log_level', const=logging.ERROR)
+        g.add_argument("--profile", nargs="?", const="-", metavar="FILE",
+                       help="write stage timings, bytes transferred and peak memory as JSON lines to FILE (default: stderr)")
+    return _log_parser
+
+def __getattr__(name):
+    # `from lgmproxies.logs import log_parser` still works
+    if name == "log_parser":
+        return get_log_parser()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def init_logger(cmd=None):
-    o, _ = log_parser.parse_known_args(cmd)
+    o, _ = get_log_parser().parse_known_args(cmd)
     setup_logger(o)
 
 logger = logging.getLogger(lgmproxies.__name__)
@@ -29,8 +47,11 @@ def setup_logger(o):
         handler = streamhandler
     logger.addHandler(handler)
     logger.setLevel(o.log_level or logging.INFO)
+    profile = getattr(o, "profile", None)
+    if profile:
+        from lgmproxies.profiling import enable_profiling
+        enable_profiling(None if profile == "-" else profile)
 
-init_logger([])
-
-
-del argparse
\ No newline at end of file
+# same as init_logger([]) without building the parser
+# (profiling can also be switched on for scripts and notebooks with LGMPROXIES_PROFILE=FILE or -)
+setup_logger(types.SimpleNamespace(log_file=None, log_level=None, profile=os.environ.get("LGMPROXIES_PROFILE")))
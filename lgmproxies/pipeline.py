@@ -0,0 +1,343 @@
+"""Incremental, dependency-tracked processing pipeline
+
+Each stage declares what its output depends on: upstream stages, data files
+(hashed by content), parameters, and its own code. These are combined into a
+key, and the output is pickled under that key in the cache directory. A
+stage only recomputes when its key changes, which happens when any of its
+inputs or any upstream key changes. Stages unaffected by a change are read
+back from the cache.
+
+    pipeline = Pipeline()
+
+    @pipeline.stage(files=lambda: [tables_csv])
+    def tables():
+        ...
+
+    @pipeline.stage(deps=["tables"], params={"source": "malevich"})
+    def d18osw(tables, source):
+        ...
+
+    pipeline.run(["d18osw"])            # {"d18osw": ...}
+    pipeline.status()                    # {"tables": "cached", "d18osw": "stale"}
+
+`proxy_pipeline` wires the standard chain: Tierney tables -> d18Osw -> one
+SST ensemble per proxy type -> summary. Changing the d18Osw source only
+recomputes the d18O branch and the summary.
+"""
+from __future__ import annotations
+import json
+import pickle
+import hashlib
+import inspect
+from pathlib import Path
+from typing import Callable, NamedTuple
+from lgmproxies.logs import logger
+from lgmproxies.config import get_datapath
+from lgmproxies.fileutils import atomic_write
+from lgmproxies.profiling import stage as profile_stage
+
+PIPELINE_CACHE = get_datapath("pipeline")
+
+# (path, size, mtime) -> sha256, so that unchanged files are not hashed twice in a session
+_file_digests = {}
+
+
+def _file_digest(path) -> str:
+    from lgmproxies.tools import file_digest
+    path = Path(path)
+    st = path.stat()
+    key = (str(path.resolve()), st.st_size, st.st_mtime_ns)
+    if key not in _file_digests:
+        _file_digests[key] = file_digest(path)
+    return _file_digests[key]
+
+
+def _code_digest(func) -> str:
+    try:
+        source = inspect.getsource(func)
+    except (OSError, TypeError):
+        source = repr(func.__code__.co_code) if hasattr(func, "__code__") else repr(func)
+    return hashlib.sha256(source.encode()).hexdigest()
+
+
+def _param_default(value):
+    """json fallback for stage params: functions by name, code and their `params` attribute (not by address)"""
+    if callable(value):
+        return {"callable": f"{getattr(value, '__module__', '')}:{getattr(value, '__qualname__', type(value).__qualname__)}",
+                "code": _code_digest(value), "params": getattr(value, "params", None)}
+    return repr(value)
+
+
+def _stage_files(s) -> list:
+    """Files of a stage: a list, or a callable given the stage params it accepts by name"""
+    if not callable(s.files):
+        return list(s.files)
+    accepted = inspect.signature(s.files).parameters
+    if any(p.kind is p.VAR_KEYWORD for p in accepted.values()):
+        return list(s.files(**s.params))
+    return list(s.files(**{k: v for k, v in s.params.items() if k in accepted}))
+
+
+class Stage(NamedTuple):
+    name: str
+    func: Callable
+    deps: tuple = ()
+    files: Callable | tuple = ()
+    params: dict = {}
+    version: str | None = None
+
+
+class Pipeline:
+    """Set of stages with cached, key-addressed outputs
+
+    Args:
+        cache_dir: where stage outputs are pickled
+    """
+    def __init__(self, cache_dir: str | Path = PIPELINE_CACHE):
+        self.cache_dir = Path(cache_dir)
+        self.stages: dict[str, Stage] = {}
+        self._outputs = {}  # key: output, for this session
+
+    def add_stage(self, name: str, func: Callable, deps=(), files=(), params: dict | None = None,
+                  version: str | None = None) -> Stage:
+        """Register (or replace) a stage
+
+        Args:
+            name: stage name, used by downstream stages in `deps`
+            func: called as func(**{dep: output}, **params)
+            deps: names of the upstream stages
+            files: paths whose content the output depends on, or a callable returning them,
+                called with the params it names (so that set_params updates the files too)
+            params: parameters passed to func (json-serializable, functions, or objects with a stable repr)
+            version: identifies the code of the stage (default: hash of the function source)
+        """
+        self.stages[name] = Stage(name, func, tuple(deps), files, dict(params or {}), version)
+        return self.stages[name]
+
+    def stage(self, name: str | None = None, deps=(), files=(), params: dict | None = None, version: str | None = None):
+        """Decorator version of add_stage (the name defaults to the function name)"""
+        def decorator(func):
+            self.add_stage(name or func.__name__, func, deps, files, params, version)
+            return func
+        return decorator
+
+    def set_params(self, name: str, **params) -> None:
+        """Update the parameters of a stage (downstream stages are recomputed on the next run)"""
+        self.stages[name] = self.stages[name]._replace(params={**self.stages[name].params, **params})
+
+    def _order(self, targets) -> list[str]:
+        order, visiting = [], set()
+
+        def visit(name):
+            if name in order:
+                return
+            if name in visiting:
+                raise ValueError(f"Cycle in pipeline at stage {name!r}")
+            if name not in self.stages:
+                raise KeyError(f"Unknown stage {name!r}. Available: {', '.join(self.stages)}")
+            visiting.add(name)
+            for dep in self.stages[name].deps:
+                visit(dep)
+            visiting.discard(name)
+            order.append(name)
+
+        for name in targets:
+            visit(name)
+        return order
+
+    def keys(self, targets=None) -> dict[str, str]:
+        """Key of each stage, from its code, params, files and the keys of its upstream stages"""
+        keys = {}
+        for name in self._order(targets or list(self.stages)):
+            s = self.stages[name]
+            description = {
+                "name": name,
+                "code": s.version or _code_digest(s.func),
+                "params": json.dumps(s.params, sort_keys=True, default=_param_default),
+                "files": {str(f): _file_digest(f) for f in _stage_files(s)},
+                "deps": {dep: keys[dep] for dep in s.deps},
+            }
+            keys[name] = hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+        return keys
+
+    def _path(self, name, key) -> Path:
+        return self.cache_dir / f"{name}_{key[:16]}.pkl"
+
+    def status(self, targets=None) -> dict[str, str]:
+        """"cached" or "stale" for each stage needed by `targets` (default: all stages)"""
+        return {name: "cached" if key in self._outputs or self._path(name, key).exists() else "stale"
+                for name, key in self.keys(targets).items()}
+
+    def run(self, targets=None, force=()) -> dict:
+        """Compute `targets` (default: all stages), recomputing only stale stages
+
+        Args:
+            targets: stage names
+            force: stage names to recompute even if cached
+
+        Returns:
+            {name: output} for the targets
+        """
+        targets = list(targets or self.stages)
+        keys = self.keys(targets)
+        outputs = {}
+        for name, key in keys.items():
+            s = self.stages[name]
+            path = self._path(name, key)
+            if name not in force and key in self._outputs:
+                outputs[name] = self._outputs[key]
+            elif name not in force and path.exists():
+                logger.info(f"Pipeline stage {name}: cached")
+                with open(path, "rb") as f:
+                    outputs[name] = pickle.load(f)
+            else:
+                logger.info(f"Pipeline stage {name}: run")
+                with profile_stage(f"pipeline.{name}"):
+                    outputs[name] = s.func(**{dep: outputs[dep] for dep in s.deps}, **s.params)
+                with atomic_write(path, "wb") as f:
+                    pickle.dump(outputs[name], f, protocol=pickle.HIGHEST_PROTOCOL)
+            self._outputs[key] = outputs[name]
+        return {name: outputs[name] for name in targets}
+
+
+# Standard proxy-processing chain
+
+D18OSW_SOURCES = {
+    "malevich": "lgmproxies.datasets.tierney:DeloSWMalevitch",
+}
+
+PROXY_TYPES = ["uk", "tex", "mg"]
+
+
+def _load_object(spec: str):
+    import importlib
+    module, name = spec.split(":")
+    return getattr(importlib.import_module(module), name)
+
+
+def _tierney_files(periods):
+    from lgmproxies.datasets.manager import get_repo_path
+    from lgmproxies.datasets.tierney2020 import TIERNEY2020_FILES
+    repo = get_repo_path("jesstierney/lgmDA") / "proxyData"
+    return [repo / TIERNEY2020_FILES[p] for p in periods]
+
+
+def _malevich_files():
+    from lgmproxies.datasets.manager import get_repo_path
+    repo = get_repo_path("brews/d18oc_sst") / "data/parsed"
+    return [repo / "coretops.csv", repo / "coretops_grid.csv"]
+
+
+# source (D18OSW_SOURCES name or "module:Class" spec) -> callable returning the files it reads
+D18OSW_FILES = {
+    "malevich": _malevich_files,
+}
+
+
+def _d18osw_files(source):
+    return D18OSW_FILES[source]() if source in D18OSW_FILES else []
+
+
+def _calibration_files(calibration):
+    """Posterior files of a calibration (see bayspline_calibration, bayspar_calibration, baymag_calibration)"""
+    return getattr(calibration, "files", [])
+
+
+def proxy_tables(periods):
+    from lgmproxies.datasets.tierney2020 import load_tierney2020
+    tables = load_tierney2020(periods)
+    return tables.table
+
+
+def attach_d18osw(tables, source):
+    """d18Osw at each row of the table, from a D18OSW_SOURCES entry (or a "module:Class" spec)"""
+    delosw = _load_object(D18OSW_SOURCES.get(source, source))()
+    return delosw.interpolate(tables["Longitude"].to_numpy(), tables["Latitude"].to_numpy())
+
+
+def proxy_sst(tables, proxytype, calibration, n_samples, seed):
+    """(rows, (n_samples, len(rows)) SST ensemble) for one proxy type, with calibration(group, n_samples, rng)"""
+    import numpy as np
+    from lgmproxies.datasets.calibrations import ProxyGroup, group_rows
+    rows = group_rows(tables["ProxyType"]).get(proxytype, np.array([], dtype=int))
+    group = ProxyGroup(proxytype, tables["ProxyValue"].to_numpy(dtype=float)[rows],
+                       tables["Species"].to_numpy(dtype=object)[rows],
+                       tables["Latitude"].to_numpy(dtype=float)[rows],
+                       tables["Longitude"].to_numpy(dtype=float)[rows], rows)
+    rng = np.random.default_rng(seed)
+    return rows, calibration(group, n_samples, rng)
+
+
+def delo_sst(tables, d18osw, model_path, trace_path, hierarchical, n_samples, seed):
+    """(rows, SST ensemble) for the d18O rows, with a DeltaO18 (or hierarchical) posterior"""
+    import numpy as np
+    from lgmproxies.tools import sample_draws
+    from lgmproxies.datasets.tierney import DeltaO18, DeltaO18Hierarchical
+    rows = np.flatnonzero(tables["ProxyType"].to_numpy() == "delo")
+    rng = np.random.default_rng(seed)
+    model = (DeltaO18Hierarchical if hierarchical else DeltaO18).load(model_path, trace_path)
+    draws = sample_draws(model.n_draws, n_samples, rng)
+    values = tables["ProxyValue"].to_numpy(dtype=float)[rows]
+    if hierarchical:
+        species = tables["Species"].to_numpy(dtype=object)[rows]
+        return rows, model.to_sst(values, species, d18osw[rows], rng=rng, draws=draws)
+    return rows, model.to_sst(values, d18osw[rows], rng=rng, draws=draws)
+
+
+def summarize(tables, quantiles=(2.5, 50, 97.5), **ensembles):
+    """Table with SST mean, std and quantiles for every row covered by an ensemble"""
+    import numpy as np
+    result = tables.copy()
+    result["sst_mean"] = np.nan
+    result["sst_std"] = np.nan
+    for q in quantiles:
+        result[f"sst_q{q:g}"] = np.nan
+    for rows, sst in ensembles.values():
+        result.iloc[rows, result.columns.get_loc("sst_mean")] = np.nanmean(sst, axis=0)
+        result.iloc[rows, result.columns.get_loc("sst_std")] = np.nanstd(sst, axis=0)
+        for q, values in zip(quantiles, np.nanpercentile(sst, quantiles, axis=0)):
+            result.iloc[rows, result.columns.get_loc(f"sst_q{q:g}")] = values
+    return result
+
+
+def proxy_pipeline(d18osw: str = "malevich", model_path=None, trace_path=None, hierarchical: bool = False,
+                   n_samples: int = 1000, seed: int = 345, periods=("LH", "LGM"), calibrations: dict | None = None,
+                   cache_dir: str | Path = PIPELINE_CACHE) -> Pipeline:
+    """Tierney tables -> d18Osw -> SST ensembles per proxy type -> summary
+
+    The d18O branch (stages "d18osw" and "sst_delo") is only added when the
+    DeltaO18 model and trace paths are given; their content is part of the key.
+
+    The SST stages use the calibrations registered in CALIBRATIONS when the
+    pipeline is built, unless overridden by `calibrations` ({proxytype: calibration}).
+    A calibration is part of the stage key through its code, its `params` attribute
+    and the content of its `files` attribute (the BAYSPLINE, BAYSPAR and BAYMAG
+    posteriors), and can be replaced with set_params("sst_uk", calibration=...).
+
+    Example:
+        pipeline = proxy_pipeline(model_path="modelresults/deltao18_annual.cpkl", trace_path="modelresults/deltao18_annual.nc")
+        summary = pipeline.run(["summary"])["summary"]
+        pipeline.set_params("d18osw", source="other.module:DeloSW")
+        pipeline.run(["summary"])  # recomputes d18osw, sst_delo and summary only
+    """
+    from lgmproxies.datasets.calibrations import CALIBRATIONS
+    calibrations = {**CALIBRATIONS, **(calibrations or {})}
+    pipeline = Pipeline(cache_dir)
+    pipeline.add_stage("tables", proxy_tables, files=_tierney_files, params={"periods": list(periods)})
+    ensembles = []
+    for proxytype in PROXY_TYPES:
+        pipeline.add_stage(f"sst_{proxytype}", proxy_sst, deps=["tables"], files=_calibration_files,
+                           params={"proxytype": proxytype, "calibration": calibrations[proxytype],
+                                   "n_samples": n_samples, "seed": seed})
+        ensembles.append(f"sst_{proxytype}")
+
+    if model_path is not None and trace_path is not None:
+        pipeline.add_stage("d18osw", attach_d18osw, deps=["tables"],
+                           files=_d18osw_files, params={"source": d18osw})
+        pipeline.add_stage("sst_delo", delo_sst, deps=["tables", "d18osw"], files=[model_path, trace_path],
+                           params={"model_path": str(model_path), "trace_path": str(trace_path),
+                                   "hierarchical": hierarchical, "n_samples": n_samples, "seed": seed})
+        ensembles.append("sst_delo")
+
+    pipeline.add_stage("summary", summarize, deps=["tables"] + ensembles)
+    return pipeline
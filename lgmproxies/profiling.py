@@ -0,0 +1,160 @@
+"""Stage timing and memory instrumentation
+
+Stages are marked with the `stage` context manager or the `profiled` decorator:
+
+    with stage("tierney.to_sst", n=len(values)):
+        ...
+
+    @profiled("datamanager.extract")
+    def extract_archive(...):
+        ...
+
+and `add_bytes(n)` counts bytes transferred in the innermost running stage.
+Nothing is recorded unless profiling is enabled (`--profile [FILE]` in the logs
+parser, or `enable_profiling`): a disabled stage costs one attribute lookup.
+
+When enabled, each finished stage writes a JSON line with its wall time,
+bytes transferred, the call count so far and the process peak RSS, and a
+per-stage summary ({"event": "summary"}) is written at exit:
+
+    {"event": "stage", "stage": "datamanager.download", "wall": 1.52, "calls": 1, "bytes": 1048576, "peak_rss_mb": 212.4, "url": "..."}
+"""
+from __future__ import annotations
+import sys
+import json
+import time
+import atexit
+import functools
+import threading
+from contextlib import nullcontext
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+# ru_maxrss is in kilobytes on Linux, bytes on macOS
+_RSS_UNIT = 1 if sys.platform == "darwin" else 1024
+
+
+class _State:
+    enabled = False
+    stream = None
+
+
+_state = _State()
+_lock = threading.Lock()
+_local = threading.local()
+_totals = {}
+
+_DISABLED = nullcontext()
+
+
+def peak_rss_mb() -> float | None:
+    """Peak resident set size of the process so far (MB), or None if unavailable"""
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * _RSS_UNIT / 2**20
+
+
+def _emit(record: dict) -> None:
+    line = json.dumps(record, default=str)
+    with _lock:
+        _state.stream.write(line + "\n")
+        _state.stream.flush()
+
+
+def enable_profiling(file=None) -> None:
+    """Start writing JSON lines to `file` (path, open stream, or None for stderr)"""
+    if isinstance(file, str) or hasattr(file, "__fspath__"):
+        file = open(file, "a")
+    if not _state.enabled:
+        atexit.register(write_summary)
+    _state.stream = file or sys.stderr
+    _state.enabled = True
+
+
+def disable_profiling() -> None:
+    _state.enabled = False
+
+
+def is_profiling() -> bool:
+    return _state.enabled
+
+
+class _Stage:
+    __slots__ = ("name", "fields", "bytes", "start")
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+        self.bytes = 0
+
+    def __enter__(self):
+        stack = getattr(_local, "stack", None)
+        if stack is None:
+            stack = _local.stack = []
+        stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall = time.perf_counter() - self.start
+        _local.stack.pop()
+        rss = peak_rss_mb()
+        with _lock:
+            total = _totals.setdefault(self.name, {"calls": 0, "wall": 0., "bytes": 0})
+            total["calls"] += 1
+            total["wall"] += wall
+            total["bytes"] += self.bytes
+            calls = total["calls"]
+        record = {"event": "stage", "stage": self.name, "wall": round(wall, 6), "calls": calls,
+                  "bytes": self.bytes, "peak_rss_mb": rss and round(rss, 1), **self.fields}
+        if exc_type is not None:
+            record["error"] = exc_type.__name__
+        _emit(record)
+        return False
+
+
+def stage(name: str, **fields):
+    """Context manager timing the enclosed block as stage `name` (extra fields are written as is)"""
+    if not _state.enabled:
+        return _DISABLED
+    return _Stage(name, fields)
+
+
+def profiled(name: str | None = None):
+    """Decorator recording each call of the function as a stage (default name: module.function)"""
+    def decorator(func):
+        stage_name = name or f"{func.__module__.rsplit('.', 1)[-1]}.{func.__qualname__}"
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _state.enabled:
+                return func(*args, **kwargs)
+            with _Stage(stage_name, {}):
+                return func(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+def add_bytes(n: int) -> None:
+    """Count `n` bytes transferred in the innermost running stage"""
+    if not _state.enabled:
+        return
+    stack = getattr(_local, "stack", None)
+    if stack:
+        stack[-1].bytes += n
+
+
+def write_summary() -> None:
+    """Write one {"event": "summary"} line per stage, with totals since profiling was enabled"""
+    if not _state.enabled or not _totals:
+        return
+    rss = peak_rss_mb()
+    with _lock:
+        totals = {k: dict(v) for k, v in _totals.items()}
+    for name, total in totals.items():
+        _emit({"event": "summary", "stage": name, "calls": total["calls"], "wall": round(total["wall"], 6),
+               "bytes": total["bytes"], "peak_rss_mb": rss and round(rss, 1)})
@@ -0,0 +1,250 @@
+"""Small numerical helpers shared across the package
+"""
+import hashlib
+import warnings
+from pathlib import Path
+import numpy as np
+
+
+def file_digest(path) -> str:
+    """sha256 hex digest of a file's content
+    """
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+_cached_arrays = {}  # (name, (path, size, mtime) of the sources, options): arrays, for this session
+
+
+def load_cached_arrays(read, sources, cache_dir, name: str, options=None, cache: bool = True) -> dict:
+    """Arrays returned by `read()` from the `sources` files (e.g. MATLAB posteriors)
+
+    The sources are read once: the arrays are stored as {name}_{digest}.npz in
+    `cache_dir`, keyed by the content of the sources and the repr of `options`,
+    and kept in memory for the session.
+    """
+    sources = [Path(path) for path in sources]
+    key = (name, tuple((str(p), p.stat().st_size, p.stat().st_mtime_ns) for p in sources), repr(options))
+    if key in _cached_arrays:
+        return _cached_arrays[key]
+
+    h = hashlib.sha256(repr(options).encode())
+    for path in sources:
+        h.update(file_digest(path).encode())
+    cached = Path(cache_dir) / f"{name}_{h.hexdigest()[:16]}.npz"
+
+    if cache and cached.exists():
+        with np.load(cached) as data:
+            arrays = {k: data[k] for k in data.files}
+    else:
+        arrays = read()
+        if cache:
+            cached.parent.mkdir(parents=True, exist_ok=True)
+            np.savez(cached, **arrays)
+
+    _cached_arrays[key] = arrays
+    return arrays
+
+
+def sample_draws(n_draws: int, n_samples: int, rng) -> np.ndarray:
+    """Indices of `n_samples` posterior draws out of `n_draws` (with replacement only if there are not enough)
+    """
+    return rng.choice(n_draws, size=n_samples, replace=n_samples > n_draws)
+
+
+def iter_blocks(n: int, block_size: int):
+    """Yield slices of at most `block_size` covering range(n)
+    """
+    for start in range(0, n, block_size):
+        yield slice(start, min(start + block_size, n))
+
+
+def default_block_size(n: int, max_elements: int = 2**20) -> int:
+    """Number of (n,)-rows in a block holding about `max_elements` values
+    """
+    return max(1, max_elements // max(n, 1))
+
+
+def sample_blocks(sample, n_draws: int, n: int, block_size: int, summary: bool = False,
+                  quantiles=(2.5, 50, 97.5), cov: bool = False):
+    """Call `sample(block)` for slices of at most `block_size` draws, each returning a (block, n) array
+
+    Returns:
+        the (n_draws, n) array of all blocks, or, if summary is True, the statistics
+        accumulated block by block (see StreamingSummary.result)
+    """
+    if summary:
+        stats = StreamingSummary(n, quantiles=quantiles, cov=cov)
+    else:
+        samples = np.empty((n_draws, n))
+    for block in iter_blocks(n_draws, block_size):
+        if summary:
+            stats.update(sample(block))
+        else:
+            samples[block] = sample(block)
+    return stats.result() if summary else samples
+
+
+def sample_linear_inverse(y, intercept, slope, noise_var, prior_mean, prior_std, rng) -> np.ndarray:
+    """Sample x from y = intercept + slope * x + N(0, noise_var), with prior x ~ N(prior_mean, prior_std**2)
+
+    The posterior is normal (conjugate), so all arguments can be broadcast arrays,
+    e.g. (n_draws, 1) parameters against (n,) observations.
+    """
+    post_var = 1 / (1 / prior_std**2 + slope**2 / noise_var)
+    post_mean = post_var * (prior_mean / prior_std**2 + slope * (y - intercept) / noise_var)
+    return post_mean + np.sqrt(post_var) * rng.standard_normal(np.shape(post_mean))
+
+
+class StreamingSummary:
+    """Running mean, std, quantiles (and optionally covariance) over blocks of samples
+
+    Blocks of shape (n_block, n) are passed to `update`, so that the full sample
+    matrix never needs to be kept in memory. Mean and (co)variance are merged
+    exactly (Chan et al. parallel update). Non-finite values (e.g. NaN for rows
+    without a calibration) are ignored, with a separate count for each column;
+    a column without any finite value gives NaN.
+
+    Quantiles are read from per-column histograms. The first `warmup` draws are
+    buffered, and each column's bin range is set from them: mean +- `width` std,
+    extended to their min and max. Later values outside that range are counted
+    in the edge bins. If fewer than `warmup` draws are passed in total, the
+    quantiles are computed exactly from the buffer.
+    """
+    def __init__(self, n: int, quantiles=(2.5, 50, 97.5), cov: bool = False, bins: int = 500, width: float = 8.0,
+                 warmup: int = 100):
+        self.n = n
+        self.quantiles = list(quantiles)
+        self.bins = bins
+        self.width = width
+        self.warmup = warmup
+        self.count = np.zeros(n, dtype=np.int64)
+        self.mean = np.zeros(n)
+        self.m2 = np.zeros((n, n) if cov else n)
+        self.cov = cov
+        self.incomplete = np.zeros(n, dtype=bool)  # columns with missing values (NaN covariance)
+        self.counts = None
+        self.buffer = []
+        self.buffered = 0
+
+    def update(self, block: np.ndarray) -> None:
+        block = np.asarray(block, dtype=float).reshape(-1, self.n)
+        nb = block.shape[0]
+        if nb == 0:
+            return
+        finite = np.isfinite(block)
+        if finite.all():
+            nb = np.full(self.n, nb)
+            mean_b = block.mean(axis=0)
+            anom = block - mean_b
+        else:
+            nb = finite.sum(axis=0)
+            self.incomplete |= nb < block.shape[0]
+            mean_b = np.where(finite, block, 0).sum(axis=0) / np.maximum(nb, 1)
+            anom = np.where(finite, block - mean_b, 0)
+        m2_b = anom.T @ anom if self.cov else (anom**2).sum(axis=0)
+
+        delta = mean_b - self.mean
+        total = self.count + nb
+        factor = np.where(total > 0, self.count * nb / np.maximum(total, 1), 0)
+        correction = delta[:, None] * delta[None, :] * factor[:, None] if self.cov else delta**2 * factor
+        self.m2 += m2_b + correction
+        self.mean += delta * np.where(total > 0, nb / np.maximum(total, 1), 0)
+        self.count = total
+
+        if self.quantiles:
+            self._update_histogram(block)
+
+    def _update_histogram(self, block):
+        if self.counts is None:
+            self.buffer.append(block)
+            self.buffered += block.shape[0]
+            if self.buffered < self.warmup:
+                return
+            block = np.concatenate(self.buffer)
+            self.buffer = []
+            self.counts = np.zeros((self.n, self.bins), dtype=np.int64)
+            self.lo = np.full(self.n, np.nan)
+            self.dx = np.full(self.n, np.nan)
+
+        finite = np.isfinite(block)
+        # columns whose range is not set yet (no finite value so far)
+        unset = np.isnan(self.lo) & finite.any(axis=0)
+        if unset.any():
+            self._set_range(block[:, unset], np.flatnonzero(unset))
+        if not finite.all():
+            finite &= ~np.isnan(self.lo)
+
+        with np.errstate(invalid="ignore"):
+            idx = np.floor((block - self.lo) / self.dx)
+        idx = np.clip(np.where(finite, idx, 0), 0, self.bins - 1).astype(np.intp)
+        idx += np.arange(self.n) * self.bins
+        idx = idx.ravel() if finite.all() else idx[finite]
+        if block.shape[0] < self.bins:
+            # few draws per column: scattered increments are much cheaper than a full-size bincount
+            np.add.at(self.counts.reshape(-1), idx, 1)
+        else:
+            self.counts += np.bincount(idx, minlength=self.n * self.bins).reshape(self.n, self.bins)
+
+    def _set_range(self, values, columns):
+        with np.errstate(invalid="ignore"), warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            mean = np.nanmean(values, axis=0)
+            std = np.nanstd(values, axis=0)
+            lo = np.minimum(mean - self.width * std, np.nanmin(values, axis=0))
+            hi = np.maximum(mean + self.width * std, np.nanmax(values, axis=0))
+        # constant columns: a narrow range around the value
+        pad = np.where(hi > lo, 0, np.maximum(np.abs(mean) * 1e-6, 1e-12))
+        self.lo[columns] = lo - pad
+        self.dx[columns] = (hi - lo + 2 * pad) / self.bins
+
+    def get_quantiles(self) -> dict:
+        if self.counts is None:
+            # fewer than `warmup` draws: exact quantiles
+            values = np.concatenate(self.buffer) if self.buffer else np.full((1, self.n), np.nan)
+            values = np.where(np.isfinite(values), values, np.nan)
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", RuntimeWarning)
+                return {q: np.nanpercentile(values, q, axis=0) for q in self.quantiles}
+        total = self.counts.sum(axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            cdf = np.cumsum(self.counts, axis=1) / total[:, None]
+        rows = np.arange(self.n)
+        results = {}
+        for q in self.quantiles:
+            p = q / 100
+            k = np.minimum((cdf < p).sum(axis=1), self.bins - 1)
+            below = np.where(k > 0, cdf[rows, np.maximum(k - 1, 0)], 0)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                in_bin = self.counts[rows, k] / total
+            frac = np.where(in_bin > 0, (p - below) / np.where(in_bin > 0, in_bin, 1), 0.5)
+            results[q] = np.where(total > 0, self.lo + (k + np.clip(frac, 0, 1)) * self.dx, np.nan)
+        return results
+
+    @property
+    def var(self) -> np.ndarray:
+        m2 = np.diag(self.m2) if self.cov else self.m2
+        return np.where(self.count > 0, m2 / np.maximum(self.count, 1), np.nan)
+
+    @property
+    def std(self) -> np.ndarray:
+        return np.sqrt(self.var)
+
+    def result(self) -> dict:
+        """Return a dict with "mean", "std", "quantiles" ({q: array}) and "cov" if requested
+
+        std is normalized like np.std (ddof=0) and cov like np.cov (ddof=1).
+        Covariances involving a column with missing values are NaN.
+        """
+        res = {"mean": np.where(self.count > 0, self.mean, np.nan), "std": self.std}
+        if self.quantiles:
+            res["quantiles"] = self.get_quantiles()
+        if self.cov:
+            cov = self.m2 / np.maximum(np.minimum(self.count[:, None], self.count[None, :]) - 1, 1)
+            cov[self.incomplete | (self.count == 0)] = np.nan
+            cov[:, self.incomplete | (self.count == 0)] = np.nan
+            res["cov"] = cov
+        return res
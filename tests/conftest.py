@@ -0,0 +1,9 @@
+import os
+import atexit
+import shutil
+import tempfile
+
+# keep the tests out of the user's cache: lgmproxies.config reads XDG_CACHE_HOME at import
+_cache = tempfile.mkdtemp(prefix="lgmproxies-tests-")
+os.environ["XDG_CACHE_HOME"] = _cache
+atexit.register(shutil.rmtree, _cache, ignore_errors=True)
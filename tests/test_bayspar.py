@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+import pytest
+from lgmproxies.datasets.bayspar import BaySpar, bayspar_calibration, EARTH_RADIUS
+from lgmproxies.datasets.calibrations import proxies_to_sst
+
+pytest.importorskip("scipy")
+
+
+@pytest.fixture
+def model():
+    """Tiny synthetic posterior: 4 boxes with parameters (lon, lat centres), 3000 draws"""
+    rng = np.random.default_rng(0)
+    locs = np.array([[-170., -80.], [10., 10.], [30., 10.], [10., 50.]])
+    n_draws = 3000
+    alpha = rng.normal([[0.1], [0.2], [0.3], [0.25]], 0.01, size=(4, n_draws))
+    beta = rng.normal([[0.015], [0.02], [0.01], [0.012]], 0.001, size=(4, n_draws))
+    tau2 = rng.uniform(0.002, 0.004, n_draws)
+    seatemp_locs = np.array([[10., 10.], [12., 11.], [10., 50.], [-170., -80.], [30., 10.]])
+    seatemp = np.array([25., 27., 12., -1., 28.])
+    return BaySpar(alpha, beta, tau2, locs, grid_index=np.full((9, 18), -1), seatemp=seatemp, seatemp_locs=seatemp_locs)
+
+
+def chord_distance(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(np.deg2rad, (lat1, lon1, lat2, lon2))
+    cos = np.sin(lat1) * np.sin(lat2) + np.cos(lat1) * np.cos(lat2) * np.cos(lon1 - lon2)
+    return EARTH_RADIUS * np.sqrt(2 - 2 * np.clip(cos, -1, 1))
+
+
+def reference_moments(model, tex86, lat, lon, prior_mean, prior_std):
+    """Mean and std of the BAYSPAR predictive ensemble, one site and one draw at a time
+
+    Nearest box centre by chordal distance (BAYSPAR's EarthChordDistances), then the
+    conjugate normal posterior of baysparpy's target_timeseries_pred for each draw.
+    """
+    means, stds = [], []
+    for y, la, lo, mu in zip(tex86, lat, lon, prior_mean):
+        g = np.argmin([chord_distance(la, lo, c[1], c[0]) for c in model.locs])
+        post_mean, post_var = [], []
+        for d in range(model.n_draws):
+            a, b, tau2 = model.alpha[g, d], model.beta[g, d], model.tau2[d]
+            var = 1 / (prior_std**-2 + b**2 / tau2)
+            post_mean.append(var * (mu * prior_std**-2 + b * (y - a) / tau2))
+            post_var.append(var)
+        post_mean, post_var = np.array(post_mean), np.array(post_var)
+        means.append(post_mean.mean())
+        stds.append(np.sqrt(np.mean(post_var + post_mean**2) - post_mean.mean()**2))
+    return np.array(means), np.array(stds)
+
+
+def test_predict_matches_reference(model):
+    tex86 = np.array([0.7, 0.55, 0.6, 0.3])
+    lat = np.array([12., 8., 45., -75.])
+    lon = np.array([11., 25., 175., -150.])  # site 3 is in a box without parameters
+    prior_mean = model.get_prior_mean(lat, lon)
+    np.testing.assert_allclose(prior_mean, [26., 28., 12., -1.])
+    sst = model.predict(tex86, lat, lon, prior_std=10, seed=1)
+    mean, std = reference_moments(model, tex86, lat, lon, prior_mean, 10)
+    # Monte Carlo error of the ensemble mean: std / sqrt(n_draws)
+    np.testing.assert_allclose((sst.mean(axis=0) - mean) / std * np.sqrt(model.n_draws), 0, atol=4)
+    np.testing.assert_allclose(sst.std(axis=0), std, rtol=0.05)
+
+
+def test_boxes_without_parameters(model):
+    # the box with the closest centre, never an error
+    lat = np.array([45., 0., -89., 89.])
+    lon = np.array([175., -100., 0., 0.])
+    expected = [np.argmin([chord_distance(la, lo, c[1], c[0]) for c in model.locs]) for la, lo in zip(lat, lon)]
+    np.testing.assert_array_equal(model.find_boxes(lat, lon), expected)
+
+
+def test_missing_location(model):
+    lat, lon = np.array([10., np.nan, 50.]), np.array([10., 20., np.nan])
+    np.testing.assert_array_equal(model.find_boxes(lat, lon), [1, -1, -1])
+    sst = model.predict(np.array([0.7, 0.6, 0.5]), lat, lon, seed=0)
+    assert np.isfinite(sst[:, 0]).all() and np.isnan(sst[:, 1:]).all()
+    res = model.predict(np.array([0.7, 0.6, 0.5]), lat, lon, seed=0, summary=True)
+    assert np.isfinite(res["mean"][0]) and np.isnan(res["mean"][1:]).all()
+
+
+def test_calibration_does_not_abort_table(model):
+    table = pd.DataFrame({"ProxyType": ["tex"] * 3, "ProxyValue": [0.7, 0.6, 0.5], "Species": [None] * 3,
+                          "Latitude": [10., -40., np.nan], "Longitude": [10., 100., 0.]})
+    sst = proxies_to_sst(table, n_samples=50, seed=0, calibrations={"tex": bayspar_calibration(model)})
+    assert np.isfinite(sst[:, :2]).all() and np.isnan(sst[:, 2]).all()
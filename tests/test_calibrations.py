@@ -0,0 +1,60 @@
+import logging
+import numpy as np
+import pandas as pd
+import pytest
+from lgmproxies.datasets.calibrations import proxies_to_sst, group_rows
+
+
+def offset(delta):
+    """Deterministic calibration: value + delta in every sample"""
+    def calibration(group, n_samples, rng):
+        return np.broadcast_to(group.values + delta, (n_samples, len(group.values)))
+    return calibration
+
+
+CALIBRATIONS = {"uk": offset(10), "mg": offset(20)}
+
+
+@pytest.fixture
+def table():
+    return pd.DataFrame({
+        "ProxyType": ["uk", "mg", "uk", "delo_unknown", None, "mg"],
+        "ProxyValue": [0.1, 2.0, 0.5, -1.0, 3.0, 4.0],
+        "Species": [None, "ruber", None, "ruber", None, "bulloides"],
+        "Latitude": [0., 10., 20., 30., 40., 50.],
+        "Longitude": [0., 5., 10., 15., 20., 25.],
+    })
+
+
+def test_group_rows(table):
+    groups = group_rows(table["ProxyType"])
+    assert list(groups) == ["uk", "mg", "delo_unknown"]
+    np.testing.assert_array_equal(groups["uk"], [0, 2])
+    np.testing.assert_array_equal(groups["mg"], [1, 5])
+
+
+@pytest.mark.parametrize("block_size", [None, 3])
+def test_proxies_to_sst(table, block_size, caplog):
+    with caplog.at_level(logging.WARNING, logger="lgmproxies"):
+        sst = proxies_to_sst(table, n_samples=7, seed=0, calibrations=CALIBRATIONS, block_size=block_size)
+    assert sst.shape == (7, 6)
+    np.testing.assert_allclose(sst[:, [0, 2]], [[10.1, 10.5]] * 7)
+    np.testing.assert_allclose(sst[:, [1, 5]], [[22.0, 24.0]] * 7)
+    assert np.isnan(sst[:, [3, 4]]).all()
+    assert "delo_unknown" in caplog.text and "Missing ProxyType in 1 rows" in caplog.text
+
+
+def test_proxies_to_sst_out(table):
+    out = np.zeros((4, 6))
+    proxies_to_sst(table[table["ProxyType"].isin(["uk", "mg"])], n_samples=4, calibrations=CALIBRATIONS, out=out[:, :4])
+    np.testing.assert_allclose(out[0], [10.1, 22.0, 10.5, 24.0, 0, 0])
+
+
+def test_proxies_to_sst_errors(table):
+    with pytest.raises(KeyError, match="Missing ProxyType"):
+        proxies_to_sst(table, n_samples=2, calibrations=CALIBRATIONS, errors="raise")
+    with pytest.raises(KeyError, match="delo_unknown"):
+        proxies_to_sst(table.dropna(subset=["ProxyType"]), n_samples=2, calibrations=CALIBRATIONS, errors="raise")
+    bad = {"uk": lambda group, n_samples, rng: np.zeros((n_samples, 1))}
+    with pytest.raises(ValueError, match="shape"):
+        proxies_to_sst(table[table["ProxyType"] == "uk"], n_samples=2, calibrations=bad)
@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+import pytest
+from lgmproxies.ensemble import EnsembleStore
+from lgmproxies.datasets.calibrations import proxies_to_sst
+
+pytest.importorskip("h5netcdf")
+
+
+def offset(delta):
+    def calibration(group, n_samples, rng):
+        return group.values + delta + rng.standard_normal((n_samples, len(group.values)))
+    return calibration
+
+
+@pytest.fixture
+def table():
+    return pd.DataFrame({
+        "ProxyType": ["uk", "mg", "uk", "other", "mg"],
+        "ProxyValue": [0.1, 2.0, 0.5, -1.0, 4.0],
+        "Species": [None, "ruber", None, "ruber", "bulloides"],
+        "Latitude": [0., 10., 20., 30., 40.],
+        "Longitude": [0., 5., 10., 15., 20.],
+    })
+
+
+@pytest.fixture
+def store(tmp_path, table):
+    store = EnsembleStore.create(tmp_path / "sst.nc", table[["ProxyType", "Species", "Latitude", "Longitude"]],
+                                 n_draws=300, chunks=(64, 2), dtype="f8")
+    yield store
+    store.close()
+
+
+def test_sites_round_trip(tmp_path, store, table):
+    store.close()
+    with EnsembleStore.open(tmp_path / "sst.nc") as reopened:
+        pd.testing.assert_frame_equal(reopened.sites, table[["ProxyType", "Species", "Latitude", "Longitude"]],
+                                      check_dtype=False)
+        assert reopened.shape == (300, 5)
+        assert np.isnan(reopened[:, :]).all()
+
+
+def test_write_through_proxies_to_sst(store, table):
+    calibrations = {"uk": offset(10), "mg": offset(20)}
+    expected = proxies_to_sst(table, n_samples=300, seed=1, calibrations=calibrations)
+    proxies_to_sst(table, n_samples=300, seed=1, calibrations=calibrations, out=store)
+    np.testing.assert_allclose(store[:, :], expected)
+    # unsorted site positions are read back in the requested order
+    np.testing.assert_allclose(store[10:20, [4, 0, 2]], expected[10:20, [4, 0, 2]])
+    np.testing.assert_allclose(store.select(ProxyType="mg", draws=slice(0, 5)), expected[:5, [1, 4]])
+    assert list(store.site_rows(ProxyType="uk", Species=[None])) == [0, 2]
+
+
+@pytest.mark.filterwarnings("ignore::RuntimeWarning")
+def test_summary(store, table):
+    proxies_to_sst(table, n_samples=300, seed=2, calibrations={"uk": offset(10), "mg": offset(20)}, out=store)
+    values = store[:, :]
+    res = store.summary(block_size=50)
+    np.testing.assert_allclose(res["mean"], np.nanmean(values, axis=0))
+    np.testing.assert_allclose(res["std"], np.nanstd(values, axis=0))
+    assert np.isnan(res["mean"][3])  # ProxyType without a calibration: never written
+    np.testing.assert_allclose(store.mean(ProxyType="uk"), values[:, [0, 2]].mean(axis=0))
+    total = store.reduce(lambda acc, block: block.shape[0] + (acc or 0), ProxyType="mg", block_size=64)
+    assert total == 300
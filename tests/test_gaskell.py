@@ -0,0 +1,117 @@
+import json
+import threading
+import importlib.util
+import multiprocessing
+from pathlib import Path
+import pandas as pd
+import pytest
+from lgmproxies import gaskell_hull2023
+from lgmproxies.fileutils import atomic_write
+
+pytest.importorskip("requests")
+
+OPTIONS = {"calibration": "bayfox_pooled", "timescale": "GTS2020", "co3": "none"}
+
+
+def _stub_converter(delay):
+    path = Path(__file__).parents[1] / "benchmarks" / "hot_paths.py"
+    spec = importlib.util.spec_from_file_location("hot_paths", path)
+    hot_paths = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(hot_paths)
+    return hot_paths._stub_converter(delay=delay)
+
+
+def _d18o_table():
+    return pd.DataFrame({"d18O": [1.0, 2.0, 3.0], "age": [19.0, 20.0, 21.0],
+                         "lat": [10.0, -20.0, 30.0], "long": [-150.0, 0.0, 120.0]})
+
+
+def _convert_in_threads(cachedir, url, barrier, n_threads):
+    gaskell_hull2023.cachedir = Path(cachedir)
+    gaskell_hull2023.CONVERTER_URL = url
+    df = _d18o_table()
+    barrier.wait()
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(gaskell_hull2023.convert_d18o_df(df, **OPTIONS)))
+               for _ in range(n_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(results) == n_threads and all(len(res) == 1000 for res in results)
+
+
+@pytest.fixture
+def cachedir(tmp_path, monkeypatch):
+    monkeypatch.setattr(gaskell_hull2023, "cachedir", tmp_path / "gaskell_hull2023")
+    monkeypatch.setattr(gaskell_hull2023, "_legacy_names", {})
+    monkeypatch.setattr(gaskell_hull2023, "_legacy_checked", set())
+    monkeypatch.setattr(gaskell_hull2023, "CONVERTER_URL", gaskell_hull2023.CONVERTER_URL)
+    return gaskell_hull2023.cachedir
+
+
+def test_single_request_across_processes_and_threads(cachedir):
+    server = _stub_converter(delay=0.5)
+    try:
+        ctx = multiprocessing.get_context("spawn")
+        barrier = ctx.Barrier(4)
+        jobs = [ctx.Process(target=_convert_in_threads, args=(str(cachedir), gaskell_hull2023.CONVERTER_URL, barrier, 4))
+                for _ in range(4)]
+        for job in jobs:
+            job.start()
+        for job in jobs:
+            job.join()
+            assert job.exitcode == 0
+        assert server.n_requests == 1
+        assert len(list(cachedir.glob("cache_*.csv"))) == 1
+    finally:
+        server.shutdown()
+
+
+def test_legacy_cache_migrated_once(cachedir, monkeypatch):
+    import itertools
+    df = _d18o_table()
+    df_hash = gaskell_hull2023.hash_dataframe(df)
+    options = "frozenset({%s})" % ", ".join(map(repr, reversed(OPTIONS.items())))
+    legacy = gaskell_hull2023.get_file_path(f"({df_hash!r}, (), {options})")
+    legacy.parent.mkdir(parents=True)
+    legacy.write_text("d18O\n1.0\n")
+
+    filepath = gaskell_hull2023.get_cache_path(df, **OPTIONS)
+    assert filepath.read_text() == "d18O\n1.0\n" and not legacy.exists()
+    assert json.loads((cachedir / gaskell_hull2023.LEGACY_MANIFEST).read_text()) == [legacy.name]
+
+    # the next session finds no legacy file left: misses no longer try the option orders
+    monkeypatch.setattr(gaskell_hull2023, "_legacy_names", {})
+    monkeypatch.setattr(itertools, "permutations", None)
+    filepath.unlink()
+    (cachedir / "cache_new.csv").touch()  # written under the current key
+    assert gaskell_hull2023.get_cache_path(df, **OPTIONS) == filepath
+    assert gaskell_hull2023.get_cache_path(df, calibration="bayfox_pooled") != filepath
+    assert json.loads((cachedir / gaskell_hull2023.LEGACY_MANIFEST).read_text()) == []
+
+
+def test_atomic_write_readers_see_whole_files(tmp_path):
+    path = tmp_path / "table.csv"
+    contents = [str(i) * 100_000 for i in range(10)]
+    with atomic_write(path) as f:
+        f.write(contents[0])
+    done = threading.Event()
+    seen = set()
+
+    def read():
+        while not done.is_set():
+            seen.add(path.read_text())
+
+    reader = threading.Thread(target=read)
+    reader.start()
+    try:
+        for i in range(200):
+            with atomic_write(path) as f:
+                for start in range(0, 100_000, 1000):  # several writes per file
+                    f.write(contents[i % 10][start:start + 1000])
+    finally:
+        done.set()
+        reader.join()
+    assert seen <= set(contents)
+    assert list(tmp_path.iterdir()) == [path]
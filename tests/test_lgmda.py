@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+xr = pytest.importorskip("xarray")
+pytest.importorskip("scipy")
+from lgmproxies.datasets.lgmda import sample_field
+
+
+@pytest.fixture
+def field():
+    # descending latitudes, as in many reanalysis files; global periodic longitudes
+    rng = np.random.default_rng(0)
+    lat = np.arange(85., -90., -10.)
+    lon = np.arange(0., 360., 10.)
+    values = rng.normal(size=(7, 2, len(lat), len(lon)))
+    return xr.DataArray(values, dims=["nens", "month", "lat", "lon"], name="sst",
+                        coords={"month": [1, 2], "lat": lat, "lon": lon})
+
+
+@pytest.fixture
+def sites():
+    rng = np.random.default_rng(1)
+    return rng.uniform(-84, 84, 40), rng.uniform(1, 349, 40)
+
+
+def _reference(field, lat, lon, **kwargs):
+    return field.interp(lat=xr.DataArray(lat, dims="site"), lon=xr.DataArray(lon, dims="site"), **kwargs)
+
+
+@pytest.mark.parametrize("block_size", [None, 3])
+def test_bilinear_matches_interp(field, sites, block_size):
+    lat, lon = sites
+    res = sample_field(field, lat, lon, method="bilinear", block_size=block_size)
+    assert res.dims == ("nens", "month", "site")
+    np.testing.assert_allclose(res.values, _reference(field, lat, lon).values)
+
+
+def test_nearest_matches_sel(field, sites):
+    lat, lon = sites
+    res = sample_field(field, lat, lon, method="nearest", block_size=2)
+    ref = field.sel(lat=xr.DataArray(lat, dims="site"), lon=xr.DataArray(lon, dims="site"), method="nearest")
+    np.testing.assert_array_equal(res.values, ref.values)
+
+
+def test_longitude_wrap_around(field):
+    lat = np.array([12.5, -33.0, 47.0, 0.0])
+    lon = np.array([355.0, -3.0, 352.5, -179.0])
+    # reference: close the grid with a copy of the first longitude at 360
+    closed = xr.concat([field, field.isel(lon=[0]).assign_coords(lon=[360.])], dim="lon")
+    res = sample_field(field, lat, lon, method="bilinear")
+    np.testing.assert_allclose(res.values, _reference(closed, lat, lon % 360).values)
+
+    nearest = sample_field(field, lat, lon, method="nearest")
+    ref = closed.sel(lat=xr.DataArray(lat, dims="site"), lon=xr.DataArray(lon % 360, dims="site"), method="nearest")
+    np.testing.assert_array_equal(nearest.values, ref.values)
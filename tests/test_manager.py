@@ -0,0 +1,70 @@
+import subprocess as sp
+from pathlib import Path
+import pytest
+from lgmproxies.datasets.manager import download_repository, _git
+from lgmproxies.datasets.mirror import MIRROR_ENV, set_mirror
+
+
+@pytest.fixture
+def bare_repo(tmp_path):
+    """Bare repository with three commits, tag "v1" on the second one"""
+    work = tmp_path / "work"
+    work.mkdir()
+    _git("init", "--quiet", cwd=work)
+    for i in range(3):
+        (work / "keep").mkdir(exist_ok=True)
+        (work / "other").mkdir(exist_ok=True)
+        (work / "keep" / "data.csv").write_text(f"version,{i}\n")
+        (work / "other" / "big.bin").write_text("x" * 1000 * (i + 1))
+        _git("add", ".", cwd=work)
+        _git("-c", "user.name=test", "-c", "user.email=test@example.org", "commit", "--quiet", "-m", f"commit {i}", cwd=work)
+        if i == 1:
+            _git("tag", "v1", cwd=work)
+    bare = tmp_path / "upstream.git"
+    _git("clone", "--quiet", "--bare", str(work), str(bare))
+    return bare
+
+
+@pytest.fixture(autouse=True)
+def no_mirror(monkeypatch):
+    monkeypatch.delenv(MIRROR_ENV, raising=False)
+    set_mirror(None)
+
+
+def test_shallow_sparse_checkout_at_rev(bare_repo, tmp_path):
+    destination = download_repository(str(bare_repo), tmp_path / "clones" / "upstream", paths=["/keep/"], rev="v1")
+    assert _git("rev-list", "--count", "HEAD", cwd=destination) == "1"
+    assert _git("rev-parse", "HEAD", cwd=destination) == _git("rev-parse", "v1^{commit}", cwd=bare_repo)
+    assert (destination / "keep" / "data.csv").read_text() == "version,1\n"
+    assert not (destination / "other").exists()
+
+
+def test_failed_fetch_leaves_nothing(bare_repo, tmp_path):
+    parent = tmp_path / "clones"
+    with pytest.raises(sp.CalledProcessError):
+        download_repository(str(bare_repo), parent / "upstream", rev="no-such-branch")
+    assert not (parent / "upstream").exists()
+    assert not list(parent.glob("*.partial"))
+    # a later call downloads the repository instead of reusing an empty folder
+    destination = download_repository(str(bare_repo), parent / "upstream")
+    assert (destination / "other" / "big.bin").exists()
+
+
+def test_bundle_hashed_once(tmp_path, monkeypatch):
+    from lgmproxies import tools
+    from lgmproxies.datasets.mirror import MANIFEST, get_mirror, make_archive
+    digests = []
+    file_digest = tools.file_digest
+    monkeypatch.setattr(tools, "file_digest", lambda path: digests.append(path) or file_digest(path))
+    bundle = tmp_path / "bundle"
+    bundle.mkdir()
+    (bundle / MANIFEST).write_text('{"datasets": {}, "repos": {}}\n')
+    archive = make_archive(bundle, tmp_path / "bundle.tar.gz")
+    set_mirror(archive)
+    root = get_mirror()
+    assert (Path(root) / MANIFEST).read_text() == (bundle / MANIFEST).read_text()
+    assert get_mirror() == root and len(digests) == 1
+
+    (bundle / "datasets").mkdir()
+    make_archive(bundle, archive)  # new content: extracted again
+    assert get_mirror() != root and len(digests) == 2
@@ -0,0 +1,39 @@
+import pytest
+from lgmproxies import pipeline as P
+
+
+@pytest.fixture
+def build(tmp_path, monkeypatch):
+    """proxy_pipeline on synthetic csv files, with stand-ins for the stage functions"""
+    for name in ["LH.csv", "LGM.csv", "malevich.csv", "other.csv", "model.cpkl", "trace.nc"]:
+        (tmp_path / name).write_text(f"name,value\n{name},1\n")
+    monkeypatch.setattr(P, "_tierney_files", lambda periods: [tmp_path / f"{p}.csv" for p in periods])
+    monkeypatch.setitem(P.D18OSW_FILES, "malevich", lambda: [tmp_path / "malevich.csv"])
+    monkeypatch.setitem(P.D18OSW_FILES, "other", lambda: [tmp_path / "other.csv"])
+
+    def build():
+        pipeline = P.proxy_pipeline(model_path=tmp_path / "model.cpkl", trace_path=tmp_path / "trace.nc",
+                                    cache_dir=tmp_path / "cache")
+        for name, s in pipeline.stages.items():
+            pipeline.stages[name] = s._replace(func=lambda **kwargs: None, version="stand-in")
+        return pipeline
+
+    return build
+
+
+def test_d18osw_source_only_invalidates_d18o_branch(build):
+    pipeline = build()
+    pipeline.run()
+    assert set(pipeline.status().values()) == {"cached"}
+
+    pipeline = build()  # a new session: outputs read from the cache folder
+    pipeline.set_params("d18osw", source="other")
+    stale = {name for name, status in pipeline.status().items() if status == "stale"}
+    assert stale == {"d18osw", "sst_delo", "summary"}
+
+
+def test_d18osw_file_change_only_invalidates_d18o_branch(build, tmp_path):
+    build().run()
+    (tmp_path / "malevich.csv").write_text("name,value\nmalevich.csv,20\n")  # new size: the mtime may not change
+    stale = {name for name, status in build().status().items() if status == "stale"}
+    assert stale == {"d18osw", "sst_delo", "summary"}
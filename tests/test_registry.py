@@ -0,0 +1,63 @@
+import json
+import multiprocessing
+from lgmproxies.datasets.registry import DatasetRegistry
+
+
+def _upsert_many(path, worker, n):
+    registry = DatasetRegistry(path, legacy_json=None)
+    for i in range(n):
+        registry.upsert({"name": f"w{worker}_{i}", "url": f"https://example.org/{worker}/{i}"})
+
+
+def test_concurrent_upserts(tmp_path):
+    path = tmp_path / "datasets.sqlite"
+    ctx = multiprocessing.get_context("spawn")
+    jobs = [ctx.Process(target=_upsert_many, args=(path, w, 25)) for w in range(6)]
+    for job in jobs:
+        job.start()
+    for job in jobs:
+        job.join()
+        assert job.exitcode == 0
+    names = DatasetRegistry(path, legacy_json=None).names()
+    assert names == sorted(f"w{w}_{i}" for w in range(6) for i in range(25))
+
+
+def test_upsert_replaces_record(tmp_path):
+    registry = DatasetRegistry(tmp_path / "datasets.sqlite", legacy_json=None)
+    registry.upsert({"name": "a", "url": "u1", "members": []})
+    registry.upsert({"name": "a", "url": "u2"})
+    assert registry.records() == [{"name": "a", "url": "u2"}]
+    registry.remove("a")
+    assert registry.get("a") is None
+
+
+def test_export_json_round_trip(tmp_path):
+    registry = DatasetRegistry(tmp_path / "a.sqlite", legacy_json=None)
+    for name in ["b", "a", "c"]:
+        registry.upsert({"name": name, "url": f"https://example.org/{name}.zip", "ext": ".zip"})
+    exported = registry.export_json(tmp_path / "datasets.json")
+    assert [r["name"] for r in json.loads(exported.read_text())["records"]] == ["a", "b", "c"]
+    assert DatasetRegistry(tmp_path / "b.sqlite", legacy_json=exported).records() == registry.records()
+
+
+def test_legacy_json_imported_once(tmp_path):
+    legacy = tmp_path / "datasets.json"
+    legacy.write_text(json.dumps({"records": [{"name": "old", "url": "u"}]}))
+    registry = DatasetRegistry(tmp_path / "datasets.sqlite", legacy_json=legacy)
+    assert registry.names() == ["old"]
+    registry.remove("old")
+    # the json file is only read when the database is created
+    assert DatasetRegistry(tmp_path / "datasets.sqlite", legacy_json=legacy).names() == []
+
+
+def test_local_and_missing_datasets(tmp_path, monkeypatch):
+    from lgmproxies.datasets import datamanager
+    monkeypatch.setattr(datamanager, "registry", DatasetRegistry(tmp_path / "datasets.sqlite", legacy_json=None))
+    monkeypatch.setitem(datamanager.DATASET_REGISTER, "records", [{"name": name} for name in "abc"])
+    monkeypatch.setattr(datamanager, "get_datapath", lambda name: tmp_path / name)
+    (tmp_path / "a").touch()
+    (tmp_path / "b").touch()  # on disk, but not recorded
+    datamanager.registry.upsert({"name": "a"})
+    datamanager.registry.upsert({"name": "c"})  # recorded, but removed from disk
+    assert datamanager.get_local_datasets() == ["a"]
+    assert datamanager.get_missing_datasets() == ["b", "c"]
@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+from lgmproxies.tools import StreamingSummary, iter_blocks
+
+QUANTILES = (2.5, 50, 97.5)
+
+
+def _summarize(samples, block_size, **kwargs):
+    stats = StreamingSummary(samples.shape[1], quantiles=QUANTILES, **kwargs)
+    for block in iter_blocks(len(samples), block_size):
+        stats.update(samples[block])
+    return stats.result()
+
+
+@pytest.mark.parametrize("block_size", [1, 2, 7, 1000])
+def test_quantiles_small_blocks(block_size):
+    rng = np.random.default_rng(0)
+    samples = rng.normal([0, 10, -5], [1, 3, 0.1], size=(2000, 3))
+    res = _summarize(samples, block_size)
+    np.testing.assert_allclose(res["mean"], samples.mean(axis=0))
+    np.testing.assert_allclose(res["std"], samples.std(axis=0))
+    for q in QUANTILES:
+        # histogram resolution: 2 * 8 std / 500 bins
+        error = (res["quantiles"][q] - np.percentile(samples, q, axis=0)) / samples.std(axis=0)
+        np.testing.assert_allclose(error, 0, atol=0.05)
+
+
+def test_quantiles_fewer_draws_than_warmup():
+    rng = np.random.default_rng(1)
+    samples = rng.normal(size=(30, 4))
+    res = _summarize(samples, 1)
+    for q in QUANTILES:
+        np.testing.assert_allclose(res["quantiles"][q], np.percentile(samples, q, axis=0))
+
+
+@pytest.mark.filterwarnings("ignore::RuntimeWarning")
+@pytest.mark.parametrize("block_size", [1, 3, 1000])
+def test_nan_columns(block_size):
+    rng = np.random.default_rng(2)
+    samples = rng.normal(5, 2, size=(1500, 4))
+    samples[:, 1] = np.nan  # e.g. a row without a calibration
+    samples[::3, 2] = np.nan  # partially missing
+    res = _summarize(samples, block_size, cov=True)
+    assert np.isnan(res["mean"][1]) and np.isnan(res["std"][1])
+    np.testing.assert_allclose(res["mean"], np.nanmean(samples, axis=0))
+    np.testing.assert_allclose(res["std"], np.nanstd(samples, axis=0))
+    for q in QUANTILES:
+        expected = np.nanpercentile(samples[:, [0, 2, 3]], q, axis=0)
+        assert np.isnan(res["quantiles"][q][1])
+        np.testing.assert_allclose(res["quantiles"][q][[0, 2, 3]], expected, atol=0.1)
+    complete = [0, 3]
+    np.testing.assert_allclose(res["cov"][np.ix_(complete, complete)], np.cov(samples[:, complete].T))
+    assert np.isnan(res["cov"][1]).all() and np.isnan(res["cov"][:, 2]).all()
+
+
+def test_tex86_summary_block_size_one():
+    from lgmproxies.datasets.chatgpt import tex86_to_sst_monte_carlo
+    tex86, lat = np.array([0.45, 0.6]), np.array([10., 50.])
+    # the random streams differ with the block size: compare with a large reference sample
+    samples = tex86_to_sst_monte_carlo(tex86, lat, n_samples=20000, seed=3)
+    df = tex86_to_sst_monte_carlo(tex86, lat, n_samples=4000, seed=4, summary=True, block_size=1)
+    for q in QUANTILES:
+        np.testing.assert_allclose(df[f"sst_q{q:g}"], np.percentile(samples, q, axis=0), atol=0.4)
+
+
+def test_load_cached_arrays(tmp_path):
+    from lgmproxies.tools import load_cached_arrays
+    source = tmp_path / "posterior.txt"
+    source.write_text("1 2 3")
+    calls = []
+
+    def read():
+        calls.append(1)
+        return {"x": np.loadtxt(source)}
+
+    first = load_cached_arrays(read, [source], tmp_path / "cache", "posterior")
+    np.testing.assert_array_equal(first["x"], [1, 2, 3])
+    assert load_cached_arrays(read, [source], tmp_path / "cache", "posterior") is first
+    assert len(calls) == 1 and len(list((tmp_path / "cache").glob("posterior_*.npz"))) == 1
+    # another session reads the .npz; new content or options give a new entry
+    from lgmproxies import tools
+    tools._cached_arrays.clear()
+    np.testing.assert_array_equal(load_cached_arrays(read, [source], tmp_path / "cache", "posterior")["x"], [1, 2, 3])
+    assert len(calls) == 1
+    source.write_text("4 5")
+    np.testing.assert_array_equal(load_cached_arrays(read, [source], tmp_path / "cache", "posterior")["x"], [4, 5])
+    load_cached_arrays(read, [source], tmp_path / "cache", "posterior", options={"k": "v"})
+    assert len(calls) == 3
+
+
+@pytest.mark.parametrize("summary", [False, True])
+def test_sample_blocks(summary):
+    from lgmproxies.tools import sample_blocks
+    samples = np.random.default_rng(5).normal(size=(50, 3))
+    res = sample_blocks(lambda block: samples[block], 50, 3, block_size=7, summary=summary, cov=True)
+    if summary:
+        np.testing.assert_allclose(res["mean"], samples.mean(axis=0))
+        np.testing.assert_allclose(res["cov"], np.cov(samples.T))
+    else:
+        np.testing.assert_array_equal(res, samples)